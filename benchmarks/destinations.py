@@ -0,0 +1,81 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Throughput benchmark of the fan-out to destinations, using in-process memory destinations
+so no external service is needed. Optionally adds a slow destination to check that it doesn't
+hold the others. Run it from the repository root:
+
+    python -m benchmarks.destinations --destinations 3 --batches 2000 --slow 0.01
+"""
+
+import argparse
+import time
+import pyximport; pyximport.install()  # pylint: disable=C0321
+from benchmarks.line_protocol import generate_events, generate_records  # pylint: disable=C0413
+from libs.destinations import create  # pylint: disable=C0413
+from libs.destinations.event_buffer import EventBuffer  # pylint: disable=C0413
+from libs.destinations.outputs import Outputs  # pylint: disable=C0413
+from libs.xdp_code.decoder import encode_events  # pylint: disable=C0413
+from libs.xdp_code.LineProtocol import LineBuffer  # pylint: disable=C0413
+
+
+def main():
+    """ Run the benchmark """
+    parser = argparse.ArgumentParser(description="Destinations fan-out benchmark")
+    parser.add_argument("--destinations", default=3, type=int, help="Memory destinations")
+    parser.add_argument("--batches", default=2000, type=int, help="Batches to write")
+    parser.add_argument("--events", default=512, type=int, help="Events per batch")
+    parser.add_argument("--batch-size", default=5000, type=int, help="Points per write")
+    parser.add_argument("--slow", default=0.0, type=float,
+                        help="Add a destination spending this many seconds per write")
+    args = parser.parse_args()
+
+    batch = generate_events(generate_records(args.events, 4, 500))
+    lines = LineBuffer()
+    encode_events(batch.flows, batch.hop_latencies, batch.queue_occups, lines, lambda ts: ts)
+    data, points = lines.getvalue(), lines.points
+
+    outputs = Outputs(batch_size=args.batch_size, interval=0.01)
+    fast = []
+    for i in range(args.destinations):
+        fast.append(create("memory"))
+        outputs.add(f"memory-{i}", fast[-1], EventBuffer(1 << 30, 1 << 30))
+    if args.slow:
+        slow = create("memory", delay=args.slow)
+        outputs.add("slow", slow, EventBuffer(1 << 30, 1 << 30))
+    outputs.start()
+
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        outputs.put(data, points)
+    while any(destination.points < args.batches * points for destination in fast):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    total = args.batches * points
+    print(f"{total} points ({len(data) * args.batches / 1e6:.1f} MB) to "
+          f"{args.destinations} destinations in {elapsed:.3f}s")
+    print(f"Per destination: {total / elapsed / 1e6:8.2f} M points/s")
+    print(f"Fan-out total:   {total * args.destinations / elapsed / 1e6:8.2f} M points/s")
+    if args.slow:
+        print(f"Slow destination: {slow.points} of {total} points written meanwhile")
+
+    outputs.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Micro-benchmark of the InfluxDB line protocol encoding of threshold events.
+
+Compares the per-line string formatting used before LineBuffer with the batch encoder.
+Run it from the repository root:
+
+    python -m benchmarks.line_protocol --events 20000 --hops 4
+"""
+
+import argparse
+import struct
+import time
+import numpy as np
+import pyximport; pyximport.install()  # pylint: disable=C0321
+from libs.xdp_code.decoder import encode_events  # pylint: disable=C0413
+from libs.xdp_code.EventRecords import EventBatch  # pylint: disable=C0413
+from libs.xdp_code.LineProtocol import LineBuffer  # pylint: disable=C0413
+
+
+EVENT_FLOW, EVENT_HOP_LATENCY, EVENT_QUEUE_OCCUP = 1, 2, 3
+FLOW_INFO_SIZE = 296  # Bytes sent per event before the event records
+
+
+def _header(sink_time, sw_id, vlan_id, event_type, entries, flow_latency=0):
+    """ Header of an event record of egress port 11 """
+    return struct.pack("<QIIHHBBH", sink_time, sw_id, flow_latency, vlan_id, 11, event_type,
+                       entries, 0)
+
+
+def generate_records(num_events, num_hops, num_flows):
+    """ Congestion storm: every event flags all hops for latency and queue occupancy. Returns
+    the records of the XDP code. """
+    rng = np.random.default_rng(0)
+    now = time.time_ns()
+    sw_ids = [4217755253 - hop for hop in range(num_hops)]
+    records = []
+    for i in range(num_events):
+        vlan_id = int(rng.integers(1, num_flows + 1))
+        latencies = rng.integers(0, 2 ** 20, num_hops).tolist()
+        occups = rng.integers(0, 2 ** 24, num_hops).tolist()
+
+        if i % 100 == 0:
+            records.append(_header(now + i, sw_ids[0], vlan_id, EVENT_FLOW, num_hops,
+                                   sum(latencies)) +
+                           b"".join(struct.pack("<IHHHH", sw_id, 23, 11, 2, 0)
+                                    for sw_id in sw_ids))
+        records.append(_header(now + i, sw_ids[0], vlan_id, EVENT_HOP_LATENCY, num_hops) +
+                       b"".join(struct.pack("<II", sw_id, latency)
+                                for sw_id, latency in zip(sw_ids, latencies)))
+        records.append(_header(now + i, sw_ids[0], vlan_id, EVENT_QUEUE_OCCUP, num_hops) +
+                       b"".join(struct.pack("<IHHI", sw_id, 11, 2, occup)
+                                for sw_id, occup in zip(sw_ids, occups)))
+    return records
+
+
+def generate_events(records):
+    """ Batch decoded from records, as the ring buffer callback does """
+    batch = EventBatch(capacity=len(records))
+    for record in records:
+        batch.add(record)
+    return batch
+
+
+def format_lines(batch):
+    """ Per-line % formatting, as done before LineBuffer """
+    event_data = []
+    for flow in batch.flows.tolist():
+        ts, sw_id, flow_latency, vlan_id, e_port, _, num_hop, _, path = flow
+        path_str = ",".join(f"{in_port}-{hop_sw_id}-{hop_e_port}.{queue}"
+                            for hop_sw_id, in_port, hop_e_port, queue, _
+                            in reversed(path[:num_hop]))
+        event_data.append(u"flow_lat_path\\,vlan_id=%d\\,sw_id=%i\\,port=%d "
+                          u"flow_latency=%d,path=\"%s\" %s" %
+                          (vlan_id, sw_id, e_port, flow_latency, path_str, ts))
+
+    for ts, last_sw_id, vlan_id, e_port, sw_id, latency in batch.hop_latencies.tolist():
+        event_data.append(u"latency\\,vlan\\=%d\\,sw\\=%i\\,port\\=%d\\,hop\\=%i value=%d %s" %
+                          (vlan_id, last_sw_id, e_port, sw_id, latency, ts))
+
+    for ts, sw_id, e_port, queue_id, occup in batch.queue_occups.tolist():
+        event_data.append(u"queue_occ\\,sw\\=%d\\,port\\=%d\\,queue\\=%d value=%d %s" %
+                          (sw_id, e_port, queue_id, occup, ts))
+
+    # What write_points(protocol="line") does before sending the body
+    return ("\n".join(event_data) + "\n").encode("utf-8")
+
+
+def encode_lines(batch, lines):
+    """ Batch encoding with LineBuffer """
+    lines.clear()
+    encode_events(batch.flows, batch.hop_latencies, batch.queue_occups, lines, lambda ts: ts)
+    return lines.getvalue()
+
+
+def best_of(repeat, function, *args):
+    """ Fastest run in seconds and the result """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    """ Run the benchmark """
+    parser = argparse.ArgumentParser(description="Line protocol encoding benchmark")
+    parser.add_argument("--events", default=20000, type=int, help="Events per batch")
+    parser.add_argument("--hops", default=4, type=int, help="INT hops per event")
+    parser.add_argument("--flows", default=500, type=int, help="Distinct VLANs")
+    parser.add_argument("--repeat", default=5, type=int, help="Runs per encoder")
+    args = parser.parse_args()
+
+    records = generate_records(args.events, args.hops, args.flows)
+    batch = generate_events(records)
+    lines = LineBuffer()
+
+    legacy, legacy_body = best_of(args.repeat, format_lines, batch)
+    encoder, encoder_body = best_of(args.repeat, encode_lines, batch, lines)
+
+    if sorted(legacy_body.splitlines()) != sorted(encoder_body.splitlines()):
+        raise SystemExit("Encoders produced different points")
+
+    points = lines.points
+    print(f"{points} points from {args.events} events")
+    print(f"% formatting: {legacy * 1e9 / points:8.1f} ns/point")
+    print(f"LineBuffer:   {encoder * 1e9 / points:8.1f} ns/point")
+
+    # Ring buffer records are rounded up to 8 bytes and have an 8-byte header
+    record_bytes = sum((len(record) + 7) // 8 * 8 + 8 for record in records)
+    print(f"Ring buffer:  {record_bytes / args.events:8.1f} bytes/event "
+          f"({(FLOW_INFO_SIZE + 8) / (record_bytes / args.events):.1f}x less than flow_info_t)")
+    print(f"Speedup:      {legacy / encoder:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
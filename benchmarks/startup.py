@@ -0,0 +1,142 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Startup benchmarks of an instance. Each start runs in a new process, as instances do, and
+reports the time taken and the peak memory of the process.
+
+extensions: import of the Cython extensions, built ahead of time or compiled by pyximport on a
+fresh host (cold) or with its build directory from a previous start (warm). Extensions that were
+built by setup.py are always used, so run it before and after building them.
+
+bpf: load of the XDP code without cache, with a cold cache, and with a warm cache. Requires root.
+
+Both require bcc. Run it from the repository root:
+
+    sudo python -m benchmarks.startup --runs 3
+    python -m benchmarks.startup --what extensions --modules LineProtocol
+"""
+
+import argparse
+import importlib
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from libs.xdp_code.extensions import EXTENSIONS
+
+
+SOURCE = "./libs/xdp_code/BPFCollector.c"
+CFLAGS = ["-w", "-D_INT_DST_PORT=5900"]
+
+
+def start(cache_dir):
+    """ Load the program once and print the results as JSON """
+    from bcc import BPF  # pylint: disable=C0415
+    from libs.xdp_code import bpf_cache  # pylint: disable=C0415
+
+    begin = time.perf_counter()
+    bpf = bpf_cache.load(SOURCE, CFLAGS, {"collector": (BPF.XDP, -1)}, cache_dir or None)
+    bpf.load_func("collector", BPF.XDP)
+    elapsed = time.perf_counter() - begin
+
+    print(json.dumps({"seconds": elapsed, "cached": isinstance(bpf, bpf_cache.CachedBPF),
+                      "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def import_extensions(modules, pyxbld):
+    """ Import the extensions once and print the results as JSON """
+    begin = time.perf_counter()
+    import pyximport  # pylint: disable=C0415
+    pyximport.install(build_dir=pyxbld)  # Only used by extensions that weren't built
+    origins = [importlib.import_module(f"libs.xdp_code.{name}").__file__ for name in modules]
+    elapsed = time.perf_counter() - begin
+
+    print(json.dumps({"seconds": elapsed,
+                      "cached": all(not origin.startswith(pyxbld) for origin in origins),
+                      "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run(*options):
+    """ Start a new process and return its results """
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", *options],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def report(results, hits):
+    """ Print the results of each kind of start """
+    for kind, runs in results.items():
+        seconds = sorted(result["seconds"] for result in runs)
+        print(f"{kind:>10}: median {seconds[len(seconds) // 2]:7.3f}s  "
+              f"min {seconds[0]:7.3f}s  "
+              f"max RSS {max(result['max_rss_mb'] for result in runs):7.1f} MB  "
+              f"{hits} {sum(result['cached'] for result in runs)}/{len(runs)}")
+
+
+def main():
+    """ Run the benchmark """
+    parser = argparse.ArgumentParser(description="XDP code startup benchmark")
+    parser.add_argument("--runs", default=3, type=int, help="Starts of each kind")
+    parser.add_argument("--what", default="all", choices=["all", "extensions", "bpf"],
+                        help="Part of the startup to measure. Default: all.")
+    parser.add_argument("--modules", default=",".join(EXTENSIONS),
+                        help="Comma-separated extensions to import. Default: all.")
+    parser.add_argument("--start", help=argparse.SUPPRESS)
+    parser.add_argument("--import-extensions", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.start is not None:
+        start(args.start)
+        return
+    if args.import_extensions is not None:
+        import_extensions(args.modules.split(","), args.import_extensions)
+        return
+
+    if args.what in ["all", "extensions"]:
+        pyxbld = tempfile.mkdtemp(prefix="int_collector_pyxbld_")
+        options = ["--modules", args.modules, "--import-extensions", pyxbld]
+        try:
+            results = {"cold": [], "warm": []}
+            for _ in range(args.runs):
+                shutil.rmtree(pyxbld, ignore_errors=True)
+                results["cold"].append(run(*options))
+                results["warm"].append(run(*options))
+        finally:
+            shutil.rmtree(pyxbld, ignore_errors=True)
+        print(f"Extensions: {args.modules}")
+        report(results, "built")
+
+    if args.what in ["all", "bpf"]:
+        cache_dir = tempfile.mkdtemp(prefix="int_collector_bpf_")
+        try:
+            results = {"no cache": [run("--start", "") for _ in range(args.runs)],
+                       "cold": [], "warm": []}
+            for _ in range(args.runs):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                results["cold"].append(run("--start", cache_dir))
+                results["warm"].append(run("--start", cache_dir))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        print("XDP code")
+        report(results, "cache hits")
+
+
+if __name__ == "__main__":
+    main()
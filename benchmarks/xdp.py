@@ -0,0 +1,225 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Micro-benchmark of the XDP code. Reports are run through collector() and its stages with
+BPF_PROG_TEST_RUN, without an interface or a database, and the kernel measures the time per
+report. Each scenario checks the counters and maps the reports should have changed.
+
+Steady scenarios repeat a report of a known flow. New flow scenarios run a report of a new flow
+at a time, so their time includes the inserts and the events. Requires root and bcc. Run it from
+the repository root, and compare with the results of another commit:
+
+    sudo python -m benchmarks.xdp --repeat 1000000 --output xdp.json
+    sudo python -m benchmarks.xdp --compare xdp.json --scenario "10 hops, all, steady"
+"""
+
+import argparse
+import json
+import platform
+import struct
+import subprocess
+import numpy as np
+from libs.xdp_code.extensions import load_extension
+from libs.xdp_code.syscall import prog_test_run
+
+
+Collector = load_extension("InDBCollector")  # pylint: disable=C0103
+
+XDP_DROP, XDP_PASS = 1, 2
+INT_PORT = 5900
+MAX_INT_HOP = 10
+MODES = {0: "all", 1: "counters", 2: "thresholds"}
+
+# Types of the report counters, as in BPFCollector.c
+RECEIVED, EVENTS, DAMAGED, LOST = 0, 2, 3, 5
+
+# Name, hops, mode, new flows, and damaged reports
+SCENARIOS = [
+    ("1 hop, counters", 1, 1, False, False),
+    ("10 hops, counters", 10, 1, False, False),
+    ("1 hop, thresholds, steady", 1, 2, False, False),
+    ("10 hops, thresholds, steady", 10, 2, False, False),
+    ("1 hop, thresholds, new flow", 1, 2, True, False),
+    ("10 hops, thresholds, new flow", 10, 2, True, False),
+    ("10 hops, all, steady", 10, 0, False, False),
+    ("10 hops, damaged", 10, 0, False, True),
+]
+
+
+class Points(object):
+    """ Outputs counting the points of the events """
+
+    def __init__(self):
+        self.points = 0
+
+    def put(self, _, points):
+        self.points += points
+
+
+def build_report(hops, vlan_id=42, e_port=11, seq=1, damaged=False):
+    """ An INT report of hops switches, the last one being 0xFB65D675. Damaged reports have a hop
+    leaving before it was received. """
+    metadata = b"".join(struct.pack("!IHHIIII", 0xfb65d675 - hop, 23, e_port if hop == 0 else 11,
+                                    0, 2 << 24 | 111, 1000, 1000 if damaged else 2456)
+                        for hop in range(hops))
+    shim = struct.pack("!BBBB", 1, 0, 3 + 6 * hops, 0)
+    header = struct.pack("!BBBBHH", 0x10, 0, 6, MAX_INT_HOP - hops, 0xfc00, 0)
+    payload = struct.pack("!HHHH", 50000, 50001, 8 + len(shim + header + metadata), 0) + \
+        shim + header + metadata
+    inner_ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0x17 << 2, 20 + len(payload), 0, 0, 64, 17, 0,
+                           b"\x09\x09\x09\x09", b"\x08\x08\x08\x08")
+    inner = b"\x00" * 12 + struct.pack("!HHH", 0x8100, vlan_id, 0x0800) + inner_ip + payload
+    telemetry = struct.pack("!BBHIII", 0x14, 0, 0, 0xfb65d675, seq, 0)
+    udp = struct.pack("!HHHH", 6000, INT_PORT, 8 + len(telemetry + inner), 0)
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp + telemetry + inner), 0, 0, 64, 17,
+                     0, b"\x0a\x00\x00\x02", b"\x0a\x00\x00\x01")
+    return b"\x00\x90\xfb\x65\xd6\x75\x00\x0e\x1e\xd7\x0d\xa3\x08\x00" + ip + udp + telemetry + \
+        inner
+
+
+def read_counters(collector):
+    """ {(map index, type): value} of the report counters """
+    counters = {}
+    for index, table in enumerate(collector.counter_maps):
+        keys, values = table.snapshot()
+        for counter_type, value in zip(keys["type"].tolist(), values["value"].tolist()):
+            counters[(index, counter_type)] = value
+    return counters
+
+
+def interface_packets(collector):
+    """ Packets counted by tb_egr_interface_util """
+    return int(collector.egr_interface_map.snapshot()[1]["packets"].sum())
+
+
+def run_scenario(collector, scenario, repeat, flows):
+    """ Run the reports of scenario and return its results """
+    name, hops, mode, new_flows, damaged = scenario
+    collector.configure(50000, 100000, 225, 3600, mode != 2, mode != 1)
+    collector.tb_flow.clear()
+    collector.tb_queue.clear()
+    counters, packets = read_counters(collector), interface_packets(collector)
+    fd = collector.fn_collector.fd
+
+    if new_flows:
+        # One run per report: a flow is only new once
+        results = []
+        for i in range(flows):
+            report = build_report(hops, vlan_id=1 + i % 4094, e_port=1 + i // 4094, seq=i)
+            results.append(prog_test_run(fd, report))
+            if i % 1000 == 999:
+                collector.poll_events(0)
+        retvals = {retval for retval, _ in results}
+        retval = retvals.pop() if len(retvals) == 1 else -1
+        ns = float(np.mean([duration for _, duration in results]))
+        runs = flows
+    else:
+        # The first run inserts the flow
+        report = build_report(hops, damaged=damaged)
+        prog_test_run(fd, report)
+        retval, ns = prog_test_run(fd, report, repeat)
+        runs = repeat + 1
+    collector.poll_events(0)
+
+    # What the reports should have changed
+    after = read_counters(collector)
+
+    def delta(index, counter_type):
+        return after.get((index, counter_type), 0) - counters.get((index, counter_type), 0)
+
+    checks = {"retval": retval == (XDP_PASS if damaged else XDP_DROP),
+              "received": delta(0, RECEIVED) == runs}
+    if damaged:
+        checks["damaged"] = delta(2, DAMAGED) == runs
+    elif mode != 2:
+        checks["interface counters"] = interface_packets(collector) - packets == runs * hops
+    if mode != 1 and not damaged:
+        expected = flows if new_flows else 1
+        checks["flows"] = len(collector.tb_flow) == expected
+        checks["events"] = delta(1, EVENTS) == expected and delta(1, LOST) == 0
+    return {"hops": hops, "mode": MODES[mode], "new_flows": new_flows, "damaged": damaged,
+            "runs": runs, "ns_per_packet": ns, "retval": retval,
+            "failed_checks": [check for check, passed in checks.items() if not passed]}
+
+
+def describe():
+    """ Where the results come from """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "kernel": platform.release(), "machine": platform.machine()}
+
+
+def main():
+    """ Run the benchmark """
+    parser = argparse.ArgumentParser(description="XDP code micro-benchmark")
+    parser.add_argument("--repeat", default=1000000, type=int,
+                        help="Runs of the report of steady scenarios. Default: 1000000.")
+    parser.add_argument("--flows", default=5000, type=int,
+                        help="Reports of new flow scenarios, at most flow_map_size. "
+                             "Default: 5000.")
+    parser.add_argument("--rounds", default=3, type=int,
+                        help="Runs of each scenario. The median is kept. Default: 3.")
+    parser.add_argument("--scenario", action="append", choices=[name for name, *_ in SCENARIOS],
+                        help="Scenario to run, can be repeated. Default: all.")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results of this JSON file")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.scenario:
+        scenarios = [scenario for scenario in SCENARIOS if scenario[0] in args.scenario]
+    previous = {}
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)["scenarios"]
+
+    collector = Collector.Collector(int_dst_port=INT_PORT, debug_int=0, flags=0,
+                                    hop_latency=50000, flow_latency=100000, queue_occ=225,
+                                    flow_keepalive=3600, enable_counter_mode=True,
+                                    enable_threshold_mode=True, outputs=Points())
+    collector.open_events()
+    results = dict(describe(), repeat=args.repeat, flows=args.flows, scenarios={})
+    try:
+        for scenario in scenarios:
+            rounds = [run_scenario(collector, scenario, args.repeat, args.flows)
+                      for _ in range(args.rounds)]
+            failed = sorted({check for round_ in rounds for check in round_["failed_checks"]})
+            rounds.sort(key=lambda round_: round_["ns_per_packet"])
+            result = dict(rounds[len(rounds) // 2], failed_checks=failed)
+            results["scenarios"][scenario[0]] = result
+
+            line = f"{scenario[0]:>30}: {result['ns_per_packet']:8.1f} ns/packet"
+            if scenario[0] in previous:
+                before = previous[scenario[0]]["ns_per_packet"]
+                line += f"  (was {before:8.1f}, {(result['ns_per_packet'] / before - 1):+7.1%})"
+            if result["failed_checks"]:
+                line += f"  FAILED: {', '.join(result['failed_checks'])}"
+            print(line)
+    finally:
+        collector.close_events()
+        collector.bpf_collector.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
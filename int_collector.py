@@ -20,9 +20,12 @@
 import sys
 import os
 import shlex
+import signal
 import subprocess
 
 from libs.input.cli import get_options
+from libs.input.parse_cli import parse_params
+from libs.xdp_code.extensions import EXTENSIONS, is_built
 
 
 VERSION = "1.1"
@@ -34,6 +37,29 @@ if not instances:
     print("No options provided. Exiting.")
     sys.exit(2)
 
+# Running instances re-read their section of the config file on SIGHUP
+if parse_params().reload:
+    for instance in instances:
+        try:
+            with open(instance.name + '.pid') as pidfile:
+                pid = int(pidfile.read())
+            os.kill(pid, signal.SIGHUP)
+            print(f"INT Collector: Instance {instance.name} (PID {pid}) is reloading.")
+        except (OSError, ValueError) as error:
+            print(f"INT Collector: Instance {instance.name} could not be reloaded: {error}")
+    sys.exit(0)
+
+# Build the Cython extensions once if needed, instead of every instance compiling them at the same
+# time with pyximport.
+if not all(is_built(name) for name in EXTENSIONS):
+    print("INT Collector: Building the Cython extensions.")
+    result = subprocess.run([sys.executable, "setup.py", "build_ext", "--inplace"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, check=False)
+    if result.returncode:
+        print("INT Collector: Extensions could not be built. Instances will compile them when "
+              "they start.")
+
 # Popen each instance requested. If request came from CLI there will be only one instance.
 for instance in instances:
     # Get current full path
@@ -0,0 +1,74 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Output destinations. A destination receives whole batches of points encoded in InfluxDB
+line protocol. Destinations are loaded by name, so optional dependencies are only imported
+when used. """
+
+import collections
+import importlib
+
+
+# A batch is the bytes of one or more points, one per line, and the number of points
+Batch = collections.namedtuple("Batch", ["data", "points"])
+
+# Name: class path
+DESTINATIONS = {
+    "influxdb": "libs.destinations.influxdb_http.InfluxDBHTTP",
+    "influxdb-udp": "libs.destinations.influxdb_udp.InfluxDBUDP",
+    "file": "libs.destinations.file.FileDestination",
+    "kafka": "libs.destinations.kafka.KafkaDestination",
+    "memory": "libs.destinations.memory.MemoryDestination",
+}
+
+
+class Destination(object):
+    """ Base class of the destinations.
+
+    open(), write() and close() are called by the destination's own worker thread. write()
+    raises an exception if the batch couldn't be written. Destinations that write
+    asynchronously report failed batches to on_failure(data, points) instead, and tell if the
+    last write succeeded with healthy. """
+
+    on_failure = None
+    healthy = True
+
+    def open(self):
+        """ Connect before the first write """
+
+    def write(self, batch):
+        """ Write a Batch """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Called when there are no more batches to write for now """
+
+    def close(self):
+        """ Write everything pending and disconnect """
+
+
+def register(name, path):
+    """ Add a destination class, given as "module.Class" """
+    DESTINATIONS[name] = path
+
+
+def create(name, **options):
+    """ Instantiate the destination registered as name """
+    if name not in DESTINATIONS:
+        raise ValueError(f"Unknown destination {name}")
+    module, cls = DESTINATIONS[name].rsplit(".", 1)
+    return getattr(importlib.import_module(module), cls)(**options)
@@ -0,0 +1,245 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module holds encoded points waiting to be written to the database. Memory is bounded
+by bytes and by points. When full, the oldest or the newest points are dropped, or points are
+spilled to an append-only log on disk and replayed once the database is back. """
+
+import collections
+import os
+import struct
+import threading
+
+
+POLICIES = ["drop-oldest", "drop-newest", "spill"]
+
+# Spill record header: data length and number of points
+_RECORD = struct.Struct("<II")
+
+
+class SpillLog(object):
+    """ Append-only log of batches split in segment files. Segments are replayed oldest first
+    and deleted once read. Segments left by a previous run are replayed too. """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, max_size=4096 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(int(name.split(".")[0]) for name in os.listdir(directory)
+                               if name.endswith(".log"))
+        self.size = sum(os.path.getsize(self._path(seq)) for seq in self.segments)
+        self.active = None
+        self.active_size = 0
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.log")
+
+    def __bool__(self):
+        return self.size > 0
+
+    def append(self, data, points):
+        """ Append a batch. Returns the points of old segments deleted to stay under
+        max_size. """
+        dropped = 0
+        if self.active is None or self.active_size >= self.segment_size:
+            self._rotate()
+
+        while self.size + len(data) > self.max_size and len(self.segments) > 1:
+            dropped += self._delete_oldest()
+
+        self.active.write(_RECORD.pack(len(data), points))
+        self.active.write(data)
+        self.active.flush()
+        self.active_size += _RECORD.size + len(data)
+        self.size += _RECORD.size + len(data)
+        return dropped
+
+    def read_segment(self):
+        """ Read and delete the oldest segment. Returns a list of (data, points). """
+        if not self.segments:
+            return []
+        if self.active is not None and len(self.segments) == 1:
+            self._close_active()
+
+        seq = self.segments[0]
+        batches = []
+        with open(self._path(seq), "rb") as segment:
+            while True:
+                header = segment.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                length, points = _RECORD.unpack(header)
+                data = segment.read(length)
+                if len(data) < length:
+                    break  # Torn write from a crash
+                batches.append((data, points))
+
+        self._remove(seq)
+        return batches
+
+    def close(self):
+        """ Close the active segment. Its content is replayed by the next run. """
+        self._close_active()
+
+    def _rotate(self):
+        self._close_active()
+        seq = self.segments[-1] + 1 if self.segments else 0
+        self.active = open(self._path(seq), "ab")  # pylint: disable=R1732
+        self.active_size = 0
+        self.segments.append(seq)
+
+    def _close_active(self):
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    def _delete_oldest(self):
+        """ Delete the oldest segment and return its points """
+        seq = self.segments[0]
+        points = 0
+        with open(self._path(seq), "rb") as segment:
+            while True:
+                header = segment.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                length, batch_points = _RECORD.unpack(header)
+                points += batch_points
+                segment.seek(length, os.SEEK_CUR)
+        self._remove(seq)
+        return points
+
+    def _remove(self, seq):
+        self.size -= os.path.getsize(self._path(seq))
+        os.remove(self._path(seq))
+        self.segments.remove(seq)
+
+
+class EventBuffer(object):
+    """ Bounded FIFO of encoded batches (bytes in line protocol and their number of points) """
+
+    def __init__(self, max_bytes, max_points, policy="drop-oldest", spill_dir=None,
+                 spill_max_bytes=4096 * 1024 * 1024):
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid buffer policy {policy}")
+        if policy == "spill" and not spill_dir:
+            raise ValueError("The spill policy requires a spill directory")
+
+        self.max_bytes = max_bytes
+        self.max_points = max_points
+        self.policy = policy
+        self.spill = SpillLog(spill_dir, max_size=spill_max_bytes) if policy == "spill" else None
+
+        self.lock = threading.Lock()
+        self.batches = collections.deque()
+        self.bytes = 0
+        self.points = 0
+
+        # Counters, in points
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    def _is_full(self, size, points):
+        return self.bytes + size > self.max_bytes or self.points + points > self.max_points
+
+    def put(self, data, points):
+        """ Add a batch, applying the overflow policy if the buffer is full """
+        if not points:
+            return
+
+        with self.lock:
+            if self._is_full(len(data), points):
+                if self.policy == "drop-newest":
+                    self.dropped += points
+                    return
+
+                if self.policy == "spill":
+                    self._spill(data, points)
+                    return
+
+                while self.batches and self._is_full(len(data), points):
+                    old_data, old_points = self.batches.popleft()
+                    self.bytes -= len(old_data)
+                    self.points -= old_points
+                    self.dropped += old_points
+
+            self.batches.append((data, points))
+            self.bytes += len(data)
+            self.points += points
+
+    def requeue(self, data, points):
+        """ Take back a batch that couldn't be written. With the spill policy, it goes to disk
+        to be replayed later; otherwise it goes back to the front of the buffer, and the oldest
+        or the newest batches are dropped if the buffer overflows. """
+        if not points:
+            return
+
+        with self.lock:
+            if self.policy == "spill":
+                self._spill(data, points)
+                return
+
+            self.batches.appendleft((data, points))
+            self.bytes += len(data)
+            self.points += points
+
+            while self.batches and self._is_full(0, 0):
+                if self.policy == "drop-newest":
+                    old_data, old_points = self.batches.pop()
+                else:
+                    old_data, old_points = self.batches.popleft()
+                self.bytes -= len(old_data)
+                self.points -= old_points
+                self.dropped += old_points
+
+    def _spill(self, data, points):
+        """ Caller must hold the lock """
+        self.dropped += self.spill.append(data, points)
+        self.spilled += points
+
+    def get(self, max_points, replay=False):
+        """ Remove and return up to max_points points (at least one batch) as (data, points).
+        When the memory is empty and replay is True, batches spilled to disk are returned.
+        Returns None when there is nothing to return. """
+        with self.lock:
+            if not self.batches and replay and self.spill:
+                for data, points in self.spill.read_segment():
+                    self.batches.append((data, points))
+                    self.bytes += len(data)
+                    self.points += points
+                    self.replayed += points
+
+            if not self.batches:
+                return None
+
+            chunks = []
+            points = 0
+            while self.batches and (not chunks or points + self.batches[0][1] <= max_points):
+                data, batch_points = self.batches.popleft()
+                chunks.append(data)
+                points += batch_points
+                self.bytes -= len(data)
+                self.points -= batch_points
+
+        return b"".join(chunks), points
+
+    def close(self):
+        """ Keep the spilled data for the next run """
+        if self.spill:
+            self.spill.close()
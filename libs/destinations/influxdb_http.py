@@ -0,0 +1,223 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module writes line protocol points to InfluxDB 1.x over HTTP. Points are grouped in
+batches and several batches are written at the same time over keep-alive connections. """
+
+import gzip
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from libs.destinations import Destination
+
+
+class InfluxDBWriter(object):
+    """ Asynchronous InfluxDB writer.
+
+    write() only appends to the pending batch. A batch is sent when it reaches batch_size
+    points or when it is batch_age seconds old. Up to workers batches are in flight; when all
+    workers are busy, write() blocks until one of them finishes.
+
+    Batches that still fail after all retries are handed to on_failure(data, points), if
+    provided. healthy tells if the last batch was written. """
+
+    def __init__(self, host, database, port=8086, workers=2, batch_size=5000, batch_age=0.1,
+                 use_gzip=False, retries=3, timeout=5.0, backoff=0.1, on_failure=None):
+
+        self.url = f"http://{host}:{port}/write"
+        self.params = {"db": database, "precision": "n"}
+        self.batch_size = batch_size
+        self.batch_age = batch_age
+        self.use_gzip = use_gzip
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.on_failure = on_failure
+
+        # Stats
+        self.points_written = 0
+        self.points_failed = 0
+        self.retried = 0
+        self.healthy = True
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+
+        self.lock = threading.Condition()
+        self.pending = []
+        self.pending_points = 0
+        self.pending_since = None
+        self.in_flight = threading.BoundedSemaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="influxdb")
+
+        self.stop_flag = threading.Event()
+        self.age_flusher = threading.Thread(target=self._flush_aged, daemon=True)
+        self.age_flusher.start()
+
+    def write(self, data, points):
+        """ Queue encoded points. data is bytes in line protocol, one point per line. """
+        if not points:
+            return
+
+        with self.lock:
+            self.pending.append(data)
+            self.pending_points += points
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+                self.lock.notify()
+
+            if self.pending_points < self.batch_size:
+                return
+            batch = self._take_pending()
+
+        self._submit(*batch)
+
+    def flush(self):
+        """ Send the pending batch now """
+        with self.lock:
+            batch = self._take_pending()
+        self._submit(*batch)
+
+    def close(self):
+        """ Send the pending batch and wait for all batches in flight """
+        self.stop_flag.set()
+        with self.lock:
+            self.lock.notify()
+        self.age_flusher.join()
+        self.flush()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def _take_pending(self):
+        """ Detach the pending batch. Caller must hold the lock. """
+        data, points = b"".join(self.pending), self.pending_points
+        self.pending = []
+        self.pending_points = 0
+        self.pending_since = None
+        return data, points
+
+    def _flush_aged(self):
+        """ Send batches that are older than batch_age even if they are not full """
+        while not self.stop_flag.is_set():
+            with self.lock:
+                if self.pending_since is None:
+                    self.lock.wait()
+                    continue
+
+                age = time.monotonic() - self.pending_since
+                if age < self.batch_age:
+                    self.lock.wait(self.batch_age - age)
+                    continue
+                batch = self._take_pending()
+
+            self._submit(*batch)
+
+    def _submit(self, data, points):
+        """ Hand a batch to a worker, waiting for a free one """
+        if not points:
+            return
+        self.in_flight.acquire()
+        self.executor.submit(self._send, data, points)
+
+    def _send(self, data, points):
+        """ POST a batch. Server errors, throttling and connection errors are retried with
+        exponential backoff; other client errors are not. """
+        headers = {"Content-Type": "application/octet-stream"}
+        body = data
+        if self.use_gzip:
+            body = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    with self.lock:
+                        self.retried += 1
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+
+                try:
+                    response = self.session.post(self.url, params=self.params, data=body,
+                                                 headers=headers, timeout=self.timeout)
+                except requests.exceptions.RequestException as error:
+                    print(f"InfluxDB write failed: {error}")
+                    continue
+
+                if response.status_code == 204:
+                    with self.lock:
+                        self.points_written += points
+                        self.healthy = True
+                    return True
+
+                print(f"InfluxDB write failed: {response.status_code} {response.text.strip()}")
+                if response.status_code < 500 and response.status_code != 429:
+                    # The database rejected the points, writing them again won't help
+                    with self.lock:
+                        self.points_failed += points
+                    return False
+
+            with self.lock:
+                self.points_failed += points
+                self.healthy = False
+            if self.on_failure is not None:
+                self.on_failure(data, points)
+            return False
+
+        finally:
+            self.in_flight.release()
+
+
+class InfluxDBHTTP(Destination):
+    """ InfluxDB 1.x destination. The database is created when missing. """
+
+    def __init__(self, host, database, port=8086, drop_db=False, **options):
+        self.host = host
+        self.database = database
+        self.port = port
+        self.drop_db = drop_db
+        self.options = options
+        self.writer = None
+
+    @property
+    def healthy(self):
+        """ If the last batch was written """
+        return self.writer is None or self.writer.healthy
+
+    def _query(self, query):
+        response = requests.post(f"http://{self.host}:{self.port}/query", params={"q": query},
+                                 timeout=self.options.get("timeout", 5.0))
+        response.raise_for_status()
+
+    def open(self):
+        # Failed writes are buffered, so an unreachable server doesn't prevent starting
+        try:
+            if self.drop_db:
+                self._query(f'DROP DATABASE "{self.database}"')
+            self._query(f'CREATE DATABASE "{self.database}"')
+        except requests.exceptions.RequestException as error:
+            print(f"Could not create InfluxDB database {self.database}: {error}")
+
+        self.writer = InfluxDBWriter(self.host, self.database, port=self.port,
+                                     on_failure=self.on_failure, **self.options)
+
+    def write(self, batch):
+        self.writer.write(batch.data, batch.points)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,51 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module writes line protocol points to the InfluxDB 1.x UDP listener. The database is
+set by the listener configuration. Writes are not acknowledged. """
+
+import socket
+from libs.destinations import Destination
+
+
+class InfluxDBUDP(Destination):
+    """ Sends batches in datagrams of up to payload_size bytes, split at line boundaries """
+
+    def __init__(self, host, port=8089, payload_size=8192):
+        self.address = (host, port)
+        self.payload_size = payload_size
+        self.sock = None
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, batch):
+        data = memoryview(batch.data)
+        size = len(data)
+        start = 0
+        while start < size:
+            end = start + self.payload_size
+            if end < size:
+                cut = batch.data.rfind(b"\n", start, end) + 1
+                # A single line longer than the payload size is sent alone
+                end = cut if cut > start else batch.data.find(b"\n", end) + 1 or size
+            self.sock.sendto(data[start:end], self.address)
+            start = end
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,63 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module publishes line protocol points to a Kafka topic, one message per batch.
+It requires kafka-python, which is not installed by default. """
+
+from libs.destinations import Destination
+
+try:
+    from kafka import KafkaProducer
+except ImportError:
+    KafkaProducer = None
+
+
+class KafkaDestination(Destination):
+    """ Kafka producer. Messages are sent asynchronously; failed messages are reported to
+    on_failure. """
+
+    def __init__(self, servers, topic, linger_ms=5):
+        if KafkaProducer is None:
+            raise ImportError("The kafka destination requires kafka-python")
+        self.servers = servers.split(",")
+        self.topic = topic
+        self.linger_ms = linger_ms
+        self.producer = None
+        self.healthy = True
+
+    def open(self):
+        self.producer = KafkaProducer(bootstrap_servers=self.servers, linger_ms=self.linger_ms,
+                                      max_request_size=16 * 1024 * 1024)
+
+    def write(self, batch):
+        future = self.producer.send(self.topic, batch.data)
+        future.add_callback(self._sent)
+        future.add_errback(self._failed, batch)
+
+    def _sent(self, _):
+        self.healthy = True
+
+    def _failed(self, batch, error):
+        print(f"Kafka write failed: {error}")
+        self.healthy = False
+        if self.on_failure is not None:
+            self.on_failure(batch.data, batch.points)
+
+    def close(self):
+        if self.producer is not None:
+            self.producer.flush()
+            self.producer.close()
@@ -0,0 +1,47 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module has an in-process destination, used to test and benchmark the collector
+without external services """
+
+import threading
+import time
+from libs.destinations import Destination
+
+
+class MemoryDestination(Destination):
+    """ Counts the batches it receives and keeps them if keep is True. delay seconds are spent
+    in each write to act as a slow destination. """
+
+    def __init__(self, keep=False, delay=0.0):
+        self.keep = keep
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.batches = []
+        self.points = 0
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, batch):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            if self.keep:
+                self.batches.append(batch)
+            self.points += batch.points
+            self.bytes += len(batch.data)
+            self.writes += 1
@@ -0,0 +1,152 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module fans batches out to all destinations. Each destination has its own buffer and
+worker thread, so a slow or unreachable destination only fills its own buffer. """
+
+import threading
+import time
+from libs.destinations import Batch
+
+
+# Longest wait between two probes of an unhealthy destination, in seconds
+MAX_BACKOFF = 5.0
+
+
+class SinkWorker(threading.Thread):
+    """ Writes the batches of one buffer to one destination """
+
+    def __init__(self, name, destination, buffer, batch_size=5000, interval=0.1, debug=False):
+        super().__init__(name=name, daemon=True)
+        self.destination = destination
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.interval = interval
+        self.debug = debug
+        self.healthy = True
+        self.backoff = interval
+        self.probe_at = 0.0
+        self.ready = threading.Event()
+        self.stop_flag = threading.Event()
+
+        destination.on_failure = buffer.requeue
+
+    def run(self):
+        opened = False
+        try:
+            while True:
+                self.ready.wait(self.interval)
+                self.ready.clear()
+                stopping = self.stop_flag.is_set()
+                opened = opened or self._open()
+                if opened:
+                    self._drain(stopping)
+                if stopping:
+                    break
+        finally:
+            if opened:
+                self.destination.close()
+            self.buffer.close()
+
+    def _open(self):
+        """ Open the destination. Batches stay buffered until it opens; it is retried every
+        interval. """
+        try:
+            self.destination.open()
+        except Exception as error:  # pylint: disable=W0703
+            if self.healthy:
+                print(f"{self.name} open failed: {error}")
+            self.healthy = False
+            return False
+        self.healthy = True
+        return True
+
+    def _drain(self, stopping=False):
+        """ Write batches until the buffer is empty or a write fails. While the destination is
+        unhealthy, a single batch probes it, with a delay doubled after each failed probe, and
+        spilled batches are not replayed. """
+        probing = not (self.healthy and self.destination.healthy)
+        if probing and not stopping and time.monotonic() < self.probe_at:
+            return
+
+        while True:
+            batch = self.buffer.get(self.batch_size, replay=not probing)
+            if batch is None:
+                break
+
+            if self.debug:
+                print(f"{self.name}: {batch[1]} points")
+
+            try:
+                self.destination.write(Batch(*batch))
+            except Exception as error:  # pylint: disable=W0703
+                print(f"{self.name} write failed: {error}")
+                self.healthy = False
+                self.buffer.requeue(*batch)
+                self._back_off()
+                return
+            self.healthy = True
+
+            # Asynchronous destinations report failures through healthy
+            if not self.destination.healthy:
+                break
+            probing = False
+
+        self.destination.flush()
+        if self.destination.healthy:
+            self.backoff = self.interval
+        else:
+            self._back_off()
+
+    def _back_off(self):
+        """ Delay the next probe """
+        self.probe_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+
+class Outputs(object):
+    """ Fan-out of encoded batches to destinations """
+
+    def __init__(self, batch_size=5000, interval=0.1, debug=False):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.debug = debug
+        self.sinks = []
+
+    def add(self, name, destination, buffer):
+        """ Add a destination and the buffer of its pending batches """
+        self.sinks.append(SinkWorker(name, destination, buffer, self.batch_size, self.interval,
+                                     self.debug))
+
+    def start(self):
+        """ Start a worker per destination """
+        for sink in self.sinks:
+            sink.start()
+
+    def put(self, data, points):
+        """ Queue a batch for all destinations. The bytes are shared, not copied. """
+        for sink in self.sinks:
+            sink.buffer.put(data, points)
+            sink.ready.set()
+
+    def close(self):
+        """ Write what is buffered and close the destinations """
+        for sink in self.sinks:
+            sink.stop_flag.set()
+            sink.ready.set()
+        for sink in self.sinks:
+            sink.join()
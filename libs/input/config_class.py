@@ -21,12 +21,59 @@
 import distutils.core
 import sys
 
+from libs.destinations import DESTINATIONS
+from libs.destinations.event_buffer import POLICIES
+
+
+def parse_cpu_list(value):
+    """ CPUs of a list like "2-5,8" """
+    cpus = []
+    for part in value.split(","):
+        first, _, last = part.strip().partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        if first < 0 or last < first:
+            raise ValueError(f"Invalid CPU range {part}")
+        cpus.extend(range(first, last + 1))
+    if len(set(cpus)) != len(cpus):
+        raise ValueError(f"Duplicate CPUs in {value}")
+    return cpus
+
+
+# Options left out of the CLI string when they have their default value
+CLI_DEFAULTS = {
+    "int_port": 5900,
+    "db_host": "localhost",
+    "db_workers": 2,
+    "db_batch_size": 5000,
+    "db_batch_age": 0.1,
+    "db_retries": 3,
+    "db_timeout": 5.0,
+    "buffer_max_mb": 256,
+    "buffer_max_points": 2000000,
+    "buffer_policy": "drop-oldest",
+    "buffer_spill_dir": "/var/lib/int_collector",
+    "buffer_spill_max_mb": 4096,
+    "destinations": "influxdb",
+    "udp_port": 8089,
+    "kafka_topic": "int_collector",
+    "counters_refresh": 60.0,
+    "flow_map_size": 10000,
+    "queue_map_size": 3200,
+    "vlan_util_map_size": 5120,
+    "queue_util_map_size": 520,
+    "interface_util_map_size": 400,
+    "bpf_cache_dir": "/var/cache/int_collector",
+    "pin_dir": "/sys/fs/bpf/int_collector",
+}
+
 
 class MyDefaultConfig(object):
     """ Default attributes as of version 1.1 """
 
     def __init__(self, section_name, section_config):
         self.name = section_name
+        self._config_file = None
         self._enable = False
         self._interface = None
         self._mode = 0
@@ -39,11 +86,45 @@ class MyDefaultConfig(object):
         self._db_name = None
         self._drop_db = False
         self._counters_interval = 0.5
+        self._counters_refresh = 60.0
+        self._counters_rates = False
         self._flow_keepalive = 3
         self._queue_occ = 225
         self._flow_latency = 100000
         self._hop_latency = 50000
         self._promisc = False
+        self._db_workers = 2
+        self._db_batch_size = 5000
+        self._db_batch_age = 0.1
+        self._db_gzip = False
+        self._db_retries = 3
+        self._db_timeout = 5.0
+        self._buffer_max_mb = 256
+        self._buffer_max_points = 2000000
+        self._buffer_policy = "drop-oldest"
+        self._buffer_spill_dir = "/var/lib/int_collector"
+        self._buffer_spill_max_mb = 4096
+        self._destinations = "influxdb"
+        self._udp_port = 8089
+        self._file_path = None
+        self._kafka_servers = None
+        self._kafka_topic = "int_collector"
+        self._bpf_cache_dir = "/var/cache/int_collector"
+        self._pin_maps = False
+        self._pin_dir = "/sys/fs/bpf/int_collector"
+        self._steer_cpus = None
+        self._stage_stats = False
+        self._flow_map_size = 10000
+        self._queue_map_size = 3200
+        self._vlan_util_map_size = 5120
+        self._queue_util_map_size = 520
+        self._interface_util_map_size = 400
+        self._map_stats = False
+        self._latency_hist = False
+        self._latency_hist_width = 0
+        self._queue_peaks = False
+        self._event_workers = 0
+        self._event_worker_cpus = None
 
         self.import_config(section_config)
 
@@ -57,6 +138,16 @@ class MyDefaultConfig(object):
         """ Setter """
         self._name = value
 
+    @property
+    def config_file(self):
+        """ Getter """
+        return self._config_file
+
+    @config_file.setter
+    def config_file(self, value):
+        """ Setter """
+        self._config_file = value
+
     @property
     def enable(self):
         """ Getter """
@@ -176,6 +267,29 @@ class MyDefaultConfig(object):
         """ Setter """
         self._counters_interval = float(value)
 
+    @property
+    def counters_refresh(self):
+        """ Getter """
+        return self._counters_refresh
+
+    @counters_refresh.setter
+    def counters_refresh(self, value):
+        """ Setter """
+        value = float(value)
+        if value < 0:
+            raise ValueError("Invalid counters_refresh Value Provided")
+        self._counters_refresh = value
+
+    @property
+    def counters_rates(self):
+        """ Getter """
+        return self._counters_rates
+
+    @counters_rates.setter
+    def counters_rates(self, value):
+        """ Setter """
+        self._counters_rates = bool(distutils.util.strtobool(value))
+
     @property
     def save_interval(self):
         """ Getter """
@@ -236,6 +350,371 @@ class MyDefaultConfig(object):
         """ Setter """
         self._promisc = bool(distutils.util.strtobool(value))
 
+    @property
+    def db_workers(self):
+        """ Getter """
+        return self._db_workers
+
+    @db_workers.setter
+    def db_workers(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid db_workers Value Provided")
+        self._db_workers = value
+
+    @property
+    def db_batch_size(self):
+        """ Getter """
+        return self._db_batch_size
+
+    @db_batch_size.setter
+    def db_batch_size(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid db_batch_size Value Provided")
+        self._db_batch_size = value
+
+    @property
+    def db_batch_age(self):
+        """ Getter """
+        return self._db_batch_age
+
+    @db_batch_age.setter
+    def db_batch_age(self, value):
+        """ Setter """
+        self._db_batch_age = float(value)
+
+    @property
+    def db_gzip(self):
+        """ Getter """
+        return self._db_gzip
+
+    @db_gzip.setter
+    def db_gzip(self, value):
+        """ Setter """
+        self._db_gzip = bool(distutils.util.strtobool(value))
+
+    @property
+    def db_retries(self):
+        """ Getter """
+        return self._db_retries
+
+    @db_retries.setter
+    def db_retries(self, value):
+        """ Setter """
+        self._db_retries = int(value)
+
+    @property
+    def db_timeout(self):
+        """ Getter """
+        return self._db_timeout
+
+    @db_timeout.setter
+    def db_timeout(self, value):
+        """ Setter """
+        self._db_timeout = float(value)
+
+    @property
+    def buffer_max_mb(self):
+        """ Getter """
+        return self._buffer_max_mb
+
+    @buffer_max_mb.setter
+    def buffer_max_mb(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid buffer_max_mb Value Provided")
+        self._buffer_max_mb = value
+
+    @property
+    def buffer_max_points(self):
+        """ Getter """
+        return self._buffer_max_points
+
+    @buffer_max_points.setter
+    def buffer_max_points(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid buffer_max_points Value Provided")
+        self._buffer_max_points = value
+
+    @property
+    def buffer_policy(self):
+        """ Getter """
+        return self._buffer_policy
+
+    @buffer_policy.setter
+    def buffer_policy(self, value):
+        """ Setter """
+        if value not in POLICIES:
+            raise ValueError("Invalid buffer_policy Value Provided")
+        self._buffer_policy = value
+
+    @property
+    def buffer_spill_dir(self):
+        """ Getter """
+        return self._buffer_spill_dir
+
+    @buffer_spill_dir.setter
+    def buffer_spill_dir(self, value):
+        """ Setter """
+        self._buffer_spill_dir = value
+
+    @property
+    def buffer_spill_max_mb(self):
+        """ Getter """
+        return self._buffer_spill_max_mb
+
+    @buffer_spill_max_mb.setter
+    def buffer_spill_max_mb(self, value):
+        """ Setter """
+        self._buffer_spill_max_mb = int(value)
+
+    @property
+    def destinations(self):
+        """ Getter """
+        return self._destinations
+
+    @destinations.setter
+    def destinations(self, value):
+        """ Setter """
+        value = ",".join(name.strip() for name in value.split(","))
+        for name in value.split(","):
+            if name not in DESTINATIONS:
+                raise ValueError(f"Invalid destination {name} Provided")
+        self._destinations = value
+
+    @property
+    def udp_port(self):
+        """ Getter """
+        return self._udp_port
+
+    @udp_port.setter
+    def udp_port(self, value):
+        """ Setter """
+        self._udp_port = int(value)
+
+    @property
+    def file_path(self):
+        """ Getter """
+        return self._file_path
+
+    @file_path.setter
+    def file_path(self, value):
+        """ Setter """
+        self._file_path = value
+
+    @property
+    def kafka_servers(self):
+        """ Getter """
+        return self._kafka_servers
+
+    @kafka_servers.setter
+    def kafka_servers(self, value):
+        """ Setter """
+        self._kafka_servers = value
+
+    @property
+    def kafka_topic(self):
+        """ Getter """
+        return self._kafka_topic
+
+    @kafka_topic.setter
+    def kafka_topic(self, value):
+        """ Setter """
+        self._kafka_topic = value
+
+    @property
+    def bpf_cache_dir(self):
+        """ Getter """
+        return self._bpf_cache_dir
+
+    @bpf_cache_dir.setter
+    def bpf_cache_dir(self, value):
+        """ Setter """
+        self._bpf_cache_dir = value
+
+    @property
+    def pin_maps(self):
+        """ Getter """
+        return self._pin_maps
+
+    @pin_maps.setter
+    def pin_maps(self, value):
+        """ Setter """
+        self._pin_maps = bool(distutils.util.strtobool(value))
+
+    @property
+    def pin_dir(self):
+        """ Getter """
+        return self._pin_dir
+
+    @pin_dir.setter
+    def pin_dir(self, value):
+        """ Setter """
+        self._pin_dir = value
+
+    @property
+    def steer_cpus(self):
+        """ Getter """
+        return self._steer_cpus
+
+    @steer_cpus.setter
+    def steer_cpus(self, value):
+        """ Setter """
+        value = value.replace(" ", "")
+        if value:
+            parse_cpu_list(value)
+        self._steer_cpus = value or None
+
+    @property
+    def stage_stats(self):
+        """ Getter """
+        return self._stage_stats
+
+    @stage_stats.setter
+    def stage_stats(self, value):
+        """ Setter """
+        self._stage_stats = bool(distutils.util.strtobool(value))
+
+    @property
+    def flow_map_size(self):
+        """ Getter """
+        return self._flow_map_size
+
+    @flow_map_size.setter
+    def flow_map_size(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid flow_map_size Value Provided")
+        self._flow_map_size = value
+
+    @property
+    def queue_map_size(self):
+        """ Getter """
+        return self._queue_map_size
+
+    @queue_map_size.setter
+    def queue_map_size(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid queue_map_size Value Provided")
+        self._queue_map_size = value
+
+    @property
+    def vlan_util_map_size(self):
+        """ Getter """
+        return self._vlan_util_map_size
+
+    @vlan_util_map_size.setter
+    def vlan_util_map_size(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid vlan_util_map_size Value Provided")
+        self._vlan_util_map_size = value
+
+    @property
+    def queue_util_map_size(self):
+        """ Getter """
+        return self._queue_util_map_size
+
+    @queue_util_map_size.setter
+    def queue_util_map_size(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid queue_util_map_size Value Provided")
+        self._queue_util_map_size = value
+
+    @property
+    def interface_util_map_size(self):
+        """ Getter """
+        return self._interface_util_map_size
+
+    @interface_util_map_size.setter
+    def interface_util_map_size(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 1:
+            raise ValueError("Invalid interface_util_map_size Value Provided")
+        self._interface_util_map_size = value
+
+    @property
+    def map_stats(self):
+        """ Getter """
+        return self._map_stats
+
+    @map_stats.setter
+    def map_stats(self, value):
+        """ Setter """
+        self._map_stats = bool(distutils.util.strtobool(value))
+
+    @property
+    def latency_hist(self):
+        """ Getter """
+        return self._latency_hist
+
+    @latency_hist.setter
+    def latency_hist(self, value):
+        """ Setter """
+        self._latency_hist = bool(distutils.util.strtobool(value))
+
+    @property
+    def latency_hist_width(self):
+        """ Getter """
+        return self._latency_hist_width
+
+    @latency_hist_width.setter
+    def latency_hist_width(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 0 or value >= 2 ** 32:
+            raise ValueError("Invalid latency_hist_width Value Provided")
+        self._latency_hist_width = value
+
+    @property
+    def queue_peaks(self):
+        """ Getter """
+        return self._queue_peaks
+
+    @queue_peaks.setter
+    def queue_peaks(self, value):
+        """ Setter """
+        self._queue_peaks = bool(distutils.util.strtobool(value))
+
+    @property
+    def event_workers(self):
+        """ Getter """
+        return self._event_workers
+
+    @event_workers.setter
+    def event_workers(self, value):
+        """ Setter """
+        value = int(value)
+        if value < 0 or value > 8:
+            raise ValueError("Invalid event_workers Value Provided")
+        self._event_workers = value
+
+    @property
+    def event_worker_cpus(self):
+        """ Getter """
+        return self._event_worker_cpus
+
+    @event_worker_cpus.setter
+    def event_worker_cpus(self, value):
+        """ Setter """
+        value = value.replace(" ", "")
+        if value:
+            parse_cpu_list(value)
+        self._event_worker_cpus = value or None
+
     def import_config(self, configs):
         """ Import configs from dictionary """
 
@@ -260,6 +739,12 @@ class MyDefaultConfig(object):
         if "counters_interval" in configs:
             self.counters_interval = configs["counters_interval"]
 
+        if "counters_refresh" in configs:
+            self.counters_refresh = configs["counters_refresh"]
+
+        if "counters_rates" in configs:
+            self.counters_rates = configs["counters_rates"]
+
         if "debug" in configs:
             self.debug = configs["debug"]
 
@@ -293,6 +778,102 @@ class MyDefaultConfig(object):
         if "promisc" in configs:
             self.promisc = configs["promisc"]
 
+        if "db_workers" in configs:
+            self.db_workers = configs["db_workers"]
+
+        if "db_batch_size" in configs:
+            self.db_batch_size = configs["db_batch_size"]
+
+        if "db_batch_age" in configs:
+            self.db_batch_age = configs["db_batch_age"]
+
+        if "db_gzip" in configs:
+            self.db_gzip = configs["db_gzip"]
+
+        if "db_retries" in configs:
+            self.db_retries = configs["db_retries"]
+
+        if "db_timeout" in configs:
+            self.db_timeout = configs["db_timeout"]
+
+        if "buffer_max_mb" in configs:
+            self.buffer_max_mb = configs["buffer_max_mb"]
+
+        if "buffer_max_points" in configs:
+            self.buffer_max_points = configs["buffer_max_points"]
+
+        if "buffer_policy" in configs:
+            self.buffer_policy = configs["buffer_policy"]
+
+        if "buffer_spill_dir" in configs:
+            self.buffer_spill_dir = configs["buffer_spill_dir"]
+
+        if "buffer_spill_max_mb" in configs:
+            self.buffer_spill_max_mb = configs["buffer_spill_max_mb"]
+
+        if "destinations" in configs:
+            self.destinations = configs["destinations"]
+
+        if "udp_port" in configs:
+            self.udp_port = configs["udp_port"]
+
+        if "file_path" in configs:
+            self.file_path = configs["file_path"]
+
+        if "kafka_servers" in configs:
+            self.kafka_servers = configs["kafka_servers"]
+
+        if "kafka_topic" in configs:
+            self.kafka_topic = configs["kafka_topic"]
+
+        if "bpf_cache_dir" in configs:
+            self.bpf_cache_dir = configs["bpf_cache_dir"]
+
+        if "pin_maps" in configs:
+            self.pin_maps = configs["pin_maps"]
+
+        if "pin_dir" in configs:
+            self.pin_dir = configs["pin_dir"]
+
+        if "steer_cpus" in configs:
+            self.steer_cpus = configs["steer_cpus"]
+
+        if "stage_stats" in configs:
+            self.stage_stats = configs["stage_stats"]
+
+        if "flow_map_size" in configs:
+            self.flow_map_size = configs["flow_map_size"]
+
+        if "queue_map_size" in configs:
+            self.queue_map_size = configs["queue_map_size"]
+
+        if "vlan_util_map_size" in configs:
+            self.vlan_util_map_size = configs["vlan_util_map_size"]
+
+        if "queue_util_map_size" in configs:
+            self.queue_util_map_size = configs["queue_util_map_size"]
+
+        if "interface_util_map_size" in configs:
+            self.interface_util_map_size = configs["interface_util_map_size"]
+
+        if "map_stats" in configs:
+            self.map_stats = configs["map_stats"]
+
+        if "latency_hist" in configs:
+            self.latency_hist = configs["latency_hist"]
+
+        if "latency_hist_width" in configs:
+            self.latency_hist_width = configs["latency_hist_width"]
+
+        if "queue_peaks" in configs:
+            self.queue_peaks = configs["queue_peaks"]
+
+        if "event_workers" in configs:
+            self.event_workers = configs["event_workers"]
+
+        if "event_worker_cpus" in configs:
+            self.event_worker_cpus = configs["event_worker_cpus"]
+
     def is_config_accurate(self):
         """ Other than validating the inputs in the setter methods, here we evaluate what is
         mandatory. """
@@ -302,6 +883,10 @@ class MyDefaultConfig(object):
 
         if not self.enable:
             return False
+
+        # The file destination has no default path
+        if "file" in self.destinations.split(",") and not self.file_path:
+            return False
         return True
 
     def __str__(self):
@@ -330,14 +915,14 @@ class MyDefaultConfig(object):
                 # Boolean options have no values
                 params.append("--%s" % method.replace("_", "-"))
 
-            # Remove default values
-            elif (value and
-                  not (method == "int_port" and value == 5900) and
-                  not (method == "db_host" and value == "localhost")):
+            # Remove default values. Options with a default in the CLI are kept when they are 0.
+            elif (value != CLI_DEFAULTS[method]) if method in CLI_DEFAULTS else value:
 
                 if ((self.mode == 1 and
                      method not in ["queue_occ", "flow_latency", "hop_latency", "save_interval"]) or
-                        (self.mode == 2 and method not in ["counters_interval"]) or self.mode == 0):
+                        (self.mode == 2 and method not in ["counters_interval",
+                                                           "counters_refresh"]) or
+                        self.mode == 0):
 
                     params.append("--%s=%s" % (method.replace("_", "-"), value))
 
@@ -19,6 +19,7 @@
 
 
 import argparse
+from libs.destinations.event_buffer import POLICIES
 
 
 def parse_params():
@@ -41,6 +42,10 @@ def parse_params():
     parser.add_argument("-c", "--config-file",
                         help="Use configs from file.")
 
+    parser.add_argument("--reload", action="store_true",
+                        help="Reload the thresholds and mode of the running instances in "
+                             "--config-file. Instances also reload on SIGHUP.")
+
     parser.add_argument("--numa-group",
                         help="Set the proper NUMA_GROUP for CPU affinity/better performance")
 
@@ -53,6 +58,117 @@ def parse_params():
     parser.add_argument("--save-interval", default=0.1, type=float,
                         help="Interval in seconds to save data to database. Default: 0.1 seconds.")
 
+    parser.add_argument("--db-workers", default=2, type=int,
+                        help="Number of batches written to the database at the same time. "
+                             "Default: 2.")
+
+    parser.add_argument("--db-batch-size", default=5000, type=int,
+                        help="Points per database write. Default: 5000.")
+
+    parser.add_argument("--db-batch-age", default=0.1, type=float,
+                        help="Seconds before a batch smaller than --db-batch-size is written. "
+                             "Default: 0.1.")
+
+    parser.add_argument("--db-gzip", action="store_true",
+                        help="Compress database writes with gzip")
+
+    parser.add_argument("--db-retries", default=3, type=int,
+                        help="Retries of a failed database write. Default: 3.")
+
+    parser.add_argument("--db-timeout", default=5.0, type=float,
+                        help="Timeout in seconds of a database write. Default: 5 seconds.")
+
+    parser.add_argument("--buffer-max-mb", default=256, type=int,
+                        help="Memory in MB for points waiting to be written. Default: 256 MB.")
+
+    parser.add_argument("--buffer-max-points", default=2000000, type=int,
+                        help="Points waiting to be written. Default: 2000000.")
+
+    parser.add_argument("--buffer-policy", default="drop-oldest",
+                        choices=POLICIES,
+                        help="What to do with new points when the buffer is full. "
+                             "Default: drop-oldest.")
+
+    parser.add_argument("--buffer-spill-dir", default="/var/lib/int_collector",
+                        help="Directory of the points spilled to disk. "
+                             "Default: /var/lib/int_collector.")
+
+    parser.add_argument("--buffer-spill-max-mb", default=4096, type=int,
+                        help="Disk space in MB for spilled points. Default: 4096 MB.")
+
+    parser.add_argument("--destinations", default="influxdb",
+                        help="Comma-separated destinations of the points: influxdb, influxdb-udp, "
+                             "file, kafka, or memory. Default: influxdb.")
+
+    parser.add_argument("--udp-port", default=8089, type=int,
+                        help="Port of the InfluxDB UDP listener on --host. Default: 8089.")
+
+    parser.add_argument("--file-path",
+                        help="File the points are appended to by the file destination.")
+
+    parser.add_argument("--kafka-servers",
+                        help="Comma-separated Kafka bootstrap servers. Default: --host port 9092.")
+
+    parser.add_argument("--kafka-topic", default="int_collector",
+                        help="Kafka topic of the points. Default: int_collector.")
+
+    parser.add_argument("--bpf-cache-dir", default="/var/cache/int_collector",
+                        help="Directory of the compiled XDP code, reused when the source, the "
+                             "kernel and bcc didn't change. Default: /var/cache/int_collector.")
+
+    parser.add_argument("--pin-maps", action="store_true",
+                        help="Pin the flow and counter maps in bpffs, so a restart keeps them")
+
+    parser.add_argument("--pin-dir", default="/sys/fs/bpf/int_collector",
+                        help="bpffs directory of the pinned maps. Default: "
+                             "/sys/fs/bpf/int_collector.")
+
+    parser.add_argument("--steer-cpus",
+                        help="CPUs processing the reports, like 2-5,8. Reports are spread over "
+                             "them by flow. Default: the CPU receiving them.")
+
+    parser.add_argument("--stage-stats", action="store_true",
+                        help="Export the runs and time spent by each stage of the XDP code")
+
+    parser.add_argument("--flow-map-size", default=10000, type=int,
+                        help="Flows tracked by threshold mode. Default: 10000.")
+
+    parser.add_argument("--queue-map-size", default=3200, type=int,
+                        help="Queues tracked by threshold mode. Default: 3200.")
+
+    parser.add_argument("--vlan-util-map-size", default=5120, type=int,
+                        help="Utilization counters per switch, port, queue and VLAN. "
+                             "Default: 5120.")
+
+    parser.add_argument("--queue-util-map-size", default=520, type=int,
+                        help="Utilization counters per switch, port and queue. Default: 520.")
+
+    parser.add_argument("--interface-util-map-size", default=400, type=int,
+                        help="Utilization counters per switch and port. Default: 400.")
+
+    parser.add_argument("--map-stats", action="store_true",
+                        help="Export the entries, inserts and evictions of the maps above")
+
+    parser.add_argument("--latency-hist", action="store_true",
+                        help="Count every hop latency in histograms per switch, port and queue, "
+                             "exported every --counters-interval")
+
+    parser.add_argument("--latency-hist-width", default=0, type=int,
+                        help="Bucket width of the latency histograms in nanoseconds. "
+                             "Default: 0, log2 buckets.")
+
+    parser.add_argument("--queue-peaks", action="store_true",
+                        help="Export the maximum, minimum, and last occupancy of each queue every "
+                             "--counters-interval instead of queue occupancy events")
+
+    parser.add_argument("--event-workers", default=0, type=int,
+                        help="Processes decoding threshold events, each draining its own ring "
+                             "buffer. Default: 0, events are decoded by the collector process.")
+
+    parser.add_argument("--event-worker-cpus",
+                        help="CPUs the event workers are pinned to, like 2-5,8. Default: not "
+                             "pinned.")
+
     parser.add_argument("-d", "--debug-mode", action="store_true",
                         help="Enable debug mode")
 
@@ -75,6 +191,13 @@ def parse_params():
     parser.add_argument("--counters-interval", default=0.5, type=float,
                         help="Interval in seconds between recording interface egress utilization")
 
+    parser.add_argument("--counters-refresh", default=60.0, type=float,
+                        help="Interval in seconds between exports of all utilization counters. "
+                             "In between, only counters that changed are exported. Default: 60.")
+
+    parser.add_argument("--counters-rates", action="store_true",
+                        help="Also export bits and packets per second of the utilization counters")
+
     # Threshold mode options
     parser.add_argument("--run-threshold-mode-only", action="store_true",
                         help="Run on Threshold mode (only queues and delays)")
@@ -88,4 +211,8 @@ def parse_params():
     parser.add_argument("--queue-occ", default=80, type=int,
                         help="Queue Occupancy threshold to monitor in cells of 80 bytes")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    # The width is a u32 of the XDP code
+    if not 0 <= args.latency_hist_width < 2 ** 32:
+        parser.error("--latency-hist-width must be between 0 and 4294967295")
+    return args
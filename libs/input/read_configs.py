@@ -16,6 +16,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 """ This module reads the configuration file and returns MyDefaultConfig class per section """
+import os
 import sys
 from configparser import ConfigParser, DuplicateOptionError
 from libs.input.config_class import MyDefaultConfig
@@ -50,6 +51,8 @@ def read_config_file(config_file):
 
         if section != 'DEFAULT':
             my_config = MyDefaultConfig(section, dict(config[section]))
+            # Instances read their section again when reloaded
+            my_config.config_file = os.path.abspath(config_file)
             if my_config.is_config_accurate():
                 my_configs.append(my_config)
             del my_config
@@ -59,3 +62,24 @@ def read_config_file(config_file):
         sys.exit(1)
 
     return my_configs
+
+
+def read_config_section(config_file, section):
+    """ Read a single section of the configuration file. Used by running instances to reload
+    their configs. Returns None if the section is missing or invalid. """
+    config = ConfigParser()
+    try:
+        config.read(config_file)
+    except DuplicateOptionError as error:
+        print(error)
+        return None
+
+    if not config.has_section(section):
+        print("Error: section %s not found in %s." % (section, config_file))
+        return None
+
+    try:
+        return MyDefaultConfig(section, dict(config[section]))
+    except ValueError as error:
+        print("Error reading section %s: %s" % (section, error))
+        return None
@@ -0,0 +1,74 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Replay pcap or pcapng files and write the points in InfluxDB line protocol """
+
+import argparse
+import sys
+from libs.input.config_class import MyDefaultConfig
+from libs.input.read_configs import read_config_section
+from libs.replay.engine import Replay
+
+
+class FileOutputs(object):
+    """ Outputs writing batches to a file """
+
+    def __init__(self, file):
+        self.file = file
+        self.points = 0
+
+    def put(self, data, points):
+        self.file.write(data)
+        self.points += points
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay INT reports captured in pcap or pcapng "
+                                                 "files through the collector's logic.")
+    parser.add_argument("captures", nargs="+", help="Files replayed in order, as one capture")
+    parser.add_argument("-c", "--config-file",
+                        help="Config file with the thresholds, mode, and int_port. Default: the "
+                             "defaults of the collector.")
+    parser.add_argument("-s", "--section", default="generic",
+                        help="Section of the config file. Default: generic")
+    parser.add_argument("-o", "--output", help="File of the points. Default: stdout")
+    args = parser.parse_args()
+
+    if args.config_file:
+        config = read_config_section(args.config_file, args.section)
+        if config is None:
+            sys.exit(1)
+    else:
+        config = MyDefaultConfig(args.section, {})
+
+    with open(args.output, "wb") if args.output else sys.stdout.buffer as output:
+        outputs = FileOutputs(output)
+        replay = Replay(config, outputs)
+        for capture in args.captures:
+            replay.replay(capture)
+
+    # Summary on stderr, so stdout only has points
+    print(f"{replay.packets} packets, {replay.reports} reports, {outputs.points} points in "
+          f"{replay.duration:.2f}s ({replay.packets / max(replay.duration, 1e-9):.0f} packets/s). "
+          f"tb_flow: {len(replay.flows)} entries, {replay.flows.inserts} inserts, "
+          f"{replay.flows.evictions} evictions. tb_queue: {len(replay.queues)} entries, "
+          f"{replay.queues.inserts} inserts, {replay.queues.evictions} evictions.",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
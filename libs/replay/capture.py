@@ -0,0 +1,153 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module reads pcap and pcapng files through mmap. Records are located with one pass over
+their headers; packets stay in the mapped file and are gathered into NumPy arrays by the parser,
+so captures larger than memory can be replayed. """
+
+import mmap
+import struct
+import numpy as np
+
+
+LINKTYPE_ETHERNET = 1
+
+# pcap magic numbers: microsecond and nanosecond timestamps
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER = 0x1a2b3c4d
+PCAPNG_IDB = 1
+PCAPNG_EPB = 6
+PCAPNG_IF_TSRESOL = 9
+
+
+class Capture(object):
+    """ Packets of a pcap or pcapng file of Ethernet frames. timestamps are in ns since the
+    epoch; offsets and lengths locate the captured bytes of each packet in data. """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")  # pylint: disable=R1732
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self._file.close()
+            raise ValueError(f"{path} is empty") from None
+        self.data = np.frombuffer(self._map, dtype=np.uint8)
+
+        magic = self._map[:4]
+        if magic == struct.pack("<I", PCAPNG_SHB):
+            timestamps, offsets, lengths = self._read_pcapng()
+        else:
+            timestamps, offsets, lengths = self._read_pcap()
+        self.timestamps = np.array(timestamps, dtype=np.uint64)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _read_pcap(self):
+        data = self._map
+        for order in "<>":
+            magic, = struct.unpack_from(order + "I", data, 0)
+            if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                break
+        else:
+            raise ValueError(f"{self.path} is not a pcap or pcapng file")
+        scale = 1 if magic == PCAP_MAGIC_NS else 1000
+        linktype, = struct.unpack_from(order + "I", data, 20)
+        if linktype & 0xffff != LINKTYPE_ETHERNET:
+            raise ValueError(f"{self.path} doesn't have Ethernet frames")
+
+        record = struct.Struct(order + "IIII")
+        timestamps, offsets, lengths = [], [], []
+        offset = 24
+        end = len(data)
+        while offset + record.size <= end:
+            seconds, fraction, captured, _ = record.unpack_from(data, offset)
+            offset += record.size
+            captured = min(captured, end - offset)
+            timestamps.append(seconds * 1000000000 + fraction * scale)
+            offsets.append(offset)
+            lengths.append(captured)
+            offset += captured
+        return timestamps, offsets, lengths
+
+    def _read_pcapng(self):
+        data = self._map
+        timestamps, offsets, lengths = [], [], []
+        # Timestamp units of the interfaces of the current section, as ns = ts * mul // div
+        units = []
+        order = "<"
+        offset = 0
+        end = len(data)
+        while offset + 12 <= end:
+            block_type, = struct.unpack_from(order + "I", data, offset)
+            if block_type == PCAPNG_SHB:
+                magic, = struct.unpack_from("<I", data, offset + 8)
+                order = "<" if magic == PCAPNG_BYTE_ORDER else ">"
+                units = []
+            block_length, = struct.unpack_from(order + "I", data, offset + 4)
+            if block_length < 12 or offset + block_length > end:
+                break
+
+            if block_type == PCAPNG_IDB:
+                linktype, = struct.unpack_from(order + "H", data, offset + 8)
+                units.append(self._idb_unit(order, offset, block_length)
+                             if linktype == LINKTYPE_ETHERNET else None)
+            elif block_type == PCAPNG_EPB:
+                interface, high, low, captured = struct.unpack_from(order + "IIII", data,
+                                                                    offset + 8)
+                unit = units[interface] if interface < len(units) else None
+                if unit is not None:
+                    mul, div = unit
+                    timestamps.append(((high << 32) | low) * mul // div)
+                    offsets.append(offset + 28)
+                    lengths.append(min(captured, block_length - 32))
+            offset += block_length
+        return timestamps, offsets, lengths
+
+    def _idb_unit(self, order, offset, block_length):
+        """ Timestamp unit of an interface description block as (mul, div), ns being
+        ts * mul // div. Default: microseconds. """
+        option = offset + 16
+        end = offset + block_length - 4
+        while option + 4 <= end:
+            code, length = struct.unpack_from(order + "HH", self._map, option)
+            if code == 0:
+                break
+            if code == PCAPNG_IF_TSRESOL and length >= 1:
+                resolution = self._map[option + 4]
+                if resolution & 0x80:
+                    return 1000000000, 2 ** (resolution & 0x7f)
+                return 1000000000, 10 ** resolution
+            option += 4 + (length + 3) // 4 * 4
+        return 1000, 1
+
+    def close(self):
+        """ Unmap the file. Arrays gathered from data must not be used afterwards. """
+        self.data = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
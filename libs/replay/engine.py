@@ -0,0 +1,302 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module replays captured INT reports through the logic of BPFCollector.c in user space:
+parsing, report counters, utilization counters, and thresholds on tb_flow and tb_queue. It
+encodes the points the collector would export, timestamped with the capture time. Parsing and
+counters are vectorized; thresholds keep state per flow and queue, so they run report by
+report. """
+
+import collections
+import time
+import numpy as np
+from libs.replay.capture import Capture
+from libs.replay.parser import DAMAGED, VALID, parse
+from libs.xdp_code.decoder import EGR_INTERFACE_KEY_DTYPE, EGR_QUEUE_KEY_DTYPE, \
+    EGR_VLAN_KEY_DTYPE, FLOW_EVENT_DTYPE, HOP_LATENCY_EVENT_DTYPE, INT_REPORTS, MAX_INT_HOP, \
+    QUEUE_OCCUP_EVENT_DTYPE, TX_INFO_DTYPE, UTILIZATION, encode_events
+from libs.xdp_code.deltas import SnapshotDelta, encode_utilization
+from libs.xdp_code.extensions import load_extension
+
+
+LineBuffer = load_extension("LineProtocol").LineBuffer  # pylint: disable=C0103
+
+# Types of the report counters, as in BPFCollector.c
+RECEIVED, EVENTS, DAMAGED_REPORTS, MISSING = 0, 2, 3, 4
+EVENT_FLOW = 1  # Same as BPFCollector.c
+
+# Key dtypes of the utilization maps, in the order of UTILIZATION
+UTILIZATION_KEYS = [EGR_VLAN_KEY_DTYPE, EGR_QUEUE_KEY_DTYPE, EGR_INTERFACE_KEY_DTYPE]
+
+
+class LRUMap(object):
+    """ Map of at most max_entries entries evicting the least recently used one, like the
+    lru_hash maps. The kernel's LRU is approximate, so it may evict other entries when full. """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.inserts = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        """ Value of key or None, marking it as used """
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def update(self, key, value):
+        """ Set key, evicting the least recently used entry if the map is full """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        elif len(self.entries) >= self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = value
+
+
+def _accumulate(keys, values, new_keys, octets):
+    """ Add a packet of octets to the counters of new_keys, one per row. Returns the keys and
+    values of all counters. """
+    width = keys.dtype.itemsize
+    both = np.concatenate([keys, new_keys])
+    unique, first, inverse = np.unique(both.view(f"V{width}"), return_index=True,
+                                       return_inverse=True)
+    inverse = inverse.reshape(-1)
+    totals = np.zeros(len(unique), dtype=TX_INFO_DTYPE)
+    for field in values.dtype.names:
+        np.add.at(totals[field], inverse[:len(keys)], values[field])
+    np.add.at(totals["octets"], inverse[len(keys):], octets)
+    np.add.at(totals["packets"], inverse[len(keys):], 1)
+    return both[first], totals
+
+
+class Replay(object):
+    """ Replays reports with the options of a MyDefaultConfig and puts the encoded points to
+    outputs, a single batch per chunk of packets. Counters are exported every
+    counters_interval of capture time, like the collector reading its maps. """
+
+    def __init__(self, config, outputs, chunk_size=16384):
+        self.int_port = config.int_port
+        self.outputs = outputs
+        self.chunk_size = chunk_size
+        self.hop_latency = config.hop_latency
+        self.flow_latency = config.flow_latency
+        self.queue_occ = config.queue_occ
+        self.keepalive = config.flow_keepalive * 1000000000
+        self.counter_mode = config.mode != 2
+        self.threshold_mode = config.mode != 1
+        self.queue_events = not config.queue_peaks
+        self.counters_rates = config.counters_rates
+        self.interval = int(config.counters_interval * 1e9)
+
+        self.flows = LRUMap(config.flow_map_size)
+        self.queues = LRUMap(config.queue_map_size)
+        self.counters = collections.Counter()
+        self.last_seq = None
+        self.utilization = [(np.zeros(0, dtype=dtype), np.zeros(0, dtype=TX_INFO_DTYPE))
+                            for dtype in UTILIZATION_KEYS]
+        self.deltas = [SnapshotDelta(config.counters_refresh) for _ in UTILIZATION]
+        self.next_export = None
+
+        self.lines = LineBuffer()
+        self.packets = 0
+        self.reports = 0
+        self.duration = 0.0
+
+    def replay(self, path):
+        """ Replay the packets of a pcap or pcapng file """
+        start = time.perf_counter()
+        with Capture(path) as capture:
+            for first in range(0, len(capture), self.chunk_size):
+                last = first + self.chunk_size
+                self.process(capture.data, capture.offsets[first:last],
+                             capture.lengths[first:last], capture.timestamps[first:last])
+        self.finish()
+        self.duration += time.perf_counter() - start
+
+    def process(self, data, offsets, lengths, timestamps):
+        """ Replay packets of data received at timestamps (ns) """
+        if not len(offsets):
+            return
+        timestamps = np.asarray(timestamps, dtype=np.uint64)
+        status, seqs, reports = parse(data, offsets, lengths, timestamps, self.int_port)
+        # Reports of each packet, to split them along the packets
+        report_ends = np.cumsum(status == VALID)
+        if self.next_export is None:
+            self.next_export = int(timestamps[0]) + self.interval
+
+        # Packets are processed in runs ending at the next export of the counters
+        arrival = np.maximum.accumulate(timestamps)
+        first = 0
+        while first < len(offsets):
+            last = int(np.searchsorted(arrival, self.next_export))
+            if last > first:
+                reports_first = int(report_ends[first - 1]) if first else 0
+                self._process_run(status[first:last], seqs[first:last],
+                                  reports[reports_first:int(report_ends[last - 1])])
+            if last < len(offsets):
+                self._export_counters()
+            first = last
+
+        self._flush()
+
+    def finish(self):
+        """ Export the counters a last time """
+        if self.next_export is not None:
+            self._export_counters()
+            self._flush()
+
+    def _process_run(self, status, seqs, reports):
+        self.packets += len(status)
+        self.reports += len(reports)
+        self.counters[RECEIVED] += len(status)
+        damaged = int(np.count_nonzero(status == DAMAGED))
+        if damaged:
+            self.counters[DAMAGED_REPORTS] += damaged
+
+        # Sequence numbers of the reports parsed up to the telemetry report
+        seqs = seqs[seqs >= 0]
+        if len(seqs):
+            previous = np.concatenate([[seqs[0] if self.last_seq is None else self.last_seq],
+                                       seqs[:-1]])
+            gaps = np.abs(seqs - previous)
+            missing = int((gaps[gaps > 1] - 1).sum())
+            if missing:
+                self.counters[MISSING] += missing
+            self.last_seq = int(seqs[-1])
+
+        if self.counter_mode and len(reports):
+            self._count(reports)
+        if self.threshold_mode and len(reports):
+            self._thresholds(reports)
+
+    def _count(self, reports):
+        """ counters(): bytes and packets per VLAN and queue, queue, and interface """
+        hops = np.arange(MAX_INT_HOP) < reports["loop_hops"][:, None]
+        rows = np.nonzero(hops)
+        octets = np.repeat(reports["packet_len"], hops.sum(axis=1))
+        columns = {"sw_id": reports["sw_ids"][rows], "p_id": reports["e_port_ids"][rows],
+                   "q_id": reports["queue_ids"][rows],
+                   "v_id": np.repeat(reports["vlan_id"], hops.sum(axis=1))}
+
+        for index, dtype in enumerate(UTILIZATION_KEYS):
+            new_keys = np.zeros(len(octets), dtype=dtype)
+            for field in dtype.names:
+                new_keys[field] = columns[field]
+            keys, values = self.utilization[index]
+            self.utilization[index] = _accumulate(keys, values, new_keys, octets)
+
+    def _thresholds(self, reports):
+        """ thresholds(): change detection on tb_flow and tb_queue, and events """
+        flows, hop_latencies, queue_occups = [], [], []
+        hop_threshold, flow_threshold = self.hop_latency, self.flow_latency
+        queue_threshold, keepalive = self.queue_occ, self.keepalive
+
+        # Python ints, so differences don't wrap around like the u32 fields
+        columns = [reports[field].tolist() for field in reports.dtype.names]
+        for (sink_time, _, vlan_id, num_hops, loop_hops, flow_latency, _, sw_ids, in_port_ids,
+             e_port_ids, queue_ids, queue_occups_, hop_latencies_) in zip(*columns):
+            flow_id = (vlan_id, sw_ids[0], e_port_ids[0])
+            is_n_flow = is_flow = is_update = 0
+            is_hop_latency = is_queue_occup = 0
+
+            state = self.flows.lookup(flow_id)
+            if state is None:
+                is_n_flow = is_update = 1
+                self.flows.inserts += 1
+                is_hop_latency = (1 << num_hops) - 1
+            else:
+                last_sw_ids, last_latencies, last_flow_latency, last_time = state
+                if abs(flow_latency - last_flow_latency) > flow_threshold:
+                    is_flow = is_update = 1
+                for i in range(loop_hops):
+                    if sw_ids[i] != last_sw_ids[i]:
+                        is_update = is_flow = 1
+                        is_hop_latency |= 1 << i
+                    if abs(hop_latencies_[i] - last_latencies[i]) > hop_threshold:
+                        is_update = 1
+                        is_hop_latency |= 1 << i
+                    if not is_update and last_time + keepalive < sink_time:
+                        is_update = is_flow = 1
+                        is_hop_latency |= 1 << i
+            if is_update:
+                self.flows.update(flow_id, (sw_ids, hop_latencies_, flow_latency, sink_time))
+
+            # The queue loop stops before its first hop when there is none. queue_info_t keeps
+            # 16 bits of the occupancy, so both sides of the comparison are truncated.
+            for i in range(num_hops if self.queue_events else 0):
+                queue_id = (sw_ids[i], e_port_ids[i], queue_ids[i])
+                occup = queue_occups_[i] & 0xffff
+                queue = self.queues.lookup(queue_id)
+                is_update = 0
+                if queue is None:
+                    is_update = 1
+                    self.queues.inserts += 1
+                else:
+                    if abs(occup - queue[0]) > queue_threshold:
+                        is_update = 1
+                    if not is_update and queue[1] + keepalive < sink_time:
+                        is_update = 1
+                if is_update:
+                    is_queue_occup |= 1 << i
+                    self.queues.update(queue_id, (occup, sink_time))
+
+            if not (is_n_flow | is_flow | is_hop_latency | is_queue_occup):
+                continue
+            self.counters[EVENTS] += 1
+            hops = (1 << num_hops) - 1
+            if is_n_flow | is_flow:
+                path = list(zip(sw_ids, in_port_ids, e_port_ids, queue_ids, [0] * MAX_INT_HOP))
+                flows.append((sink_time, sw_ids[0], flow_latency, vlan_id, e_port_ids[0],
+                              EVENT_FLOW, num_hops, 0, path))
+            for i in range(num_hops):
+                if (is_hop_latency & hops) >> i & 1:
+                    hop_latencies.append((sink_time, sw_ids[0], vlan_id, e_port_ids[0],
+                                          sw_ids[i], hop_latencies_[i]))
+                if (is_queue_occup & hops) >> i & 1:
+                    queue_occups.append((sink_time, sw_ids[i], e_port_ids[i], queue_ids[i],
+                                         queue_occups_[i]))
+
+        # Sink times are capture times already
+        encode_events(np.array(flows, dtype=FLOW_EVENT_DTYPE),
+                      np.array(hop_latencies, dtype=HOP_LATENCY_EVENT_DTYPE),
+                      np.array(queue_occups, dtype=QUEUE_OCCUP_EVENT_DTYPE),
+                      self.lines, lambda sink_time: sink_time)
+
+    def _export_counters(self):
+        """ What the collector exports every counters_interval """
+        now = self.next_export
+        types = sorted(self.counters)
+        self.lines.add_points(INT_REPORTS, (np.array(types, dtype=np.uint64),), b"value",
+                              [self.counters[counter_type] for counter_type in types],
+                              np.full(len(types), now, dtype=np.uint64))
+        if self.counter_mode:
+            for utilization, delta, (keys, values) in zip(UTILIZATION, self.deltas,
+                                                          self.utilization):
+                encode_utilization(self.lines, delta, utilization, keys, values, now,
+                                   self.counters_rates)
+        self.next_export += self.interval
+
+    def _flush(self):
+        if self.lines.points:
+            self.outputs.put(self.lines.getvalue(), self.lines.points)
+        self.lines.clear()
@@ -26,14 +26,70 @@
 
 #define MAX_INT_HOP 10  // Noviflow only supports reports with 10 metadata
 
-// User Variables
+// Size of the events ring buffer in pages. It has to be a power of 2.
+#ifndef EVENTS_RING_PAGES
+#define EVENTS_RING_PAGES 4096
+#endif
+
+// Ring buffers of events, each drained by its own user-space worker. Set by
+// user space with -DEVENT_RINGS.
+#ifndef EVENT_RINGS
+#define EVENT_RINGS 1
+#endif
+#define MAX_EVENT_RINGS 8
+
+// User Variables. Thresholds and modes are in tb_config.
 #define INT_DST_PORT _INT_DST_PORT
-#define HOP_LATENCY _HOP_LATENCY
-#define FLOW_LATENCY _FLOW_LATENCY
-#define QUEUE_OCCUP _QUEUE_OCCUP
-#define TIME_GAP_W _TIME_GAP_W
-#define ENABLE_COUNTER_MODE _ENABLE_COUNTER_MODE
-#define ENABLE_THRESHOLD_MODE _ENABLE_THRESHOLD_MODE
+
+// Reports can be steered to CPUs 0 to MAX_STEER_CPUS - 1
+#define MAX_STEER_CPUS 256
+
+// Entries of the maps. Set by user space with -D<MAP NAME>_SIZE.
+#ifndef TB_FLOW_SIZE
+#define TB_FLOW_SIZE 10000
+#endif
+#ifndef TB_QUEUE_SIZE
+#define TB_QUEUE_SIZE 3200
+#endif
+#ifndef TB_EGR_VLAN_UTIL_SIZE
+#define TB_EGR_VLAN_UTIL_SIZE 5120
+#endif
+#ifndef TB_EGR_QUEUE_UTIL_SIZE
+#define TB_EGR_QUEUE_UTIL_SIZE 520
+#endif
+#ifndef TB_EGR_INTERFACE_UTIL_SIZE
+#define TB_EGR_INTERFACE_UTIL_SIZE 400
+#endif
+#ifndef TB_LATENCY_HIST_SIZE
+#define TB_LATENCY_HIST_SIZE 16384
+#endif
+// Two intervals of each queue
+#ifndef TB_QUEUE_PEAKS_SIZE
+#define TB_QUEUE_PEAKS_SIZE (2 * TB_QUEUE_SIZE)
+#endif
+
+// Buckets of the hop latency histograms: log2 of the latency, or the latency
+// divided by the bucket width. Latencies past the last bucket are counted in it.
+#define MAX_HIST_BUCKETS 64
+
+// Maps whose inserts are counted in tb_map_inserts
+#define MAP_FLOW 0
+#define MAP_QUEUE 1
+#define MAP_EGR_VLAN_UTIL 2
+#define MAP_EGR_QUEUE_UTIL 3
+#define MAP_EGR_INTERFACE_UTIL 4
+#define MAP_LATENCY_HIST 5
+#define MAP_QUEUE_PEAKS 6
+#define MAX_MAPS 7
+
+// Stages of a report. collector() parses it and tail-calls the stages in
+// tb_stages in index order, skipping the empty slots.
+#define STAGE_PARSE 0
+#define STAGE_COUNTERS 1
+#define STAGE_THRESHOLDS 2
+#define STAGE_HISTOGRAMS 3
+#define STAGE_QUEUE_PEAKS 4
+#define MAX_STAGES 8
 
 // __packet__ numbers
 #define ETHTYPE_IP 0x0800
@@ -192,12 +248,56 @@ struct egress_util_id_t {
     u16 p_id;  // Egress Port ID
 };
 
+/* Hop latency histogram bucket of an egress queue */
+struct hist_key_t {
+    u32 sw_id;  // Switch ID
+    u16 p_id;  // Egress Port ID
+    u16 q_id;  // Egress Queue ID
+    u32 bucket;
+};
+
+/* Queue occupancy of an egress queue during an interval. Intervals alternate
+   between two slots, so user space reads one while the other is written. */
+struct peak_key_t {
+    u32 sw_id;  // Switch ID
+    u16 p_id;  // Egress Port ID
+    u16 q_id;  // Egress Queue ID
+    u32 slot;  // Interval modulo 2
+};
+
+struct queue_peak_t {
+    u32 interval;  // Interval of the values, older values are stale
+    u32 max;
+    u32 min;
+    u32 last;
+    u64 last_time;  // Sink time of the last report
+};
+
 /* Egress Interface utilization */
 struct egr_tx_info_t {
     u64 octets;
     u64 packets;
 };
 
+/* Thresholds and options. Set by user space, read on every packet, and changed while running.
+   Modes are the stages installed in tb_stages. */
+struct config_t {
+    u64 hop_latency;  // nanoseconds
+    u64 flow_latency;  // nanoseconds
+    u64 queue_occup;  // cells of 80 bytes
+    u64 time_gap_w;  // flow keepalive in nanoseconds
+    u32 steer_cpus;  // CPUs in tb_steer_cpus, 0 when reports aren't steered
+    u32 stage_stats;  // Measure the stages in tb_stage_stats
+    u32 hist_width;  // Bucket width of the latency histograms in ns, 0 for log2 buckets
+    u32 queue_events;  // Track tb_queue and send queue occupancy events
+};
+
+/* Runs and time spent by a stage */
+struct stage_stats_t {
+    u64 runs;
+    u64 ns;
+};
+
 struct last_tm_report_t {
   int value;
 };
@@ -224,31 +324,351 @@ struct flow_info_t {
     u32 metadata;  // For debugs and future use
 };
 
-BPF_PERF_OUTPUT(events);
+/* Last reported state of a flow: what the thresholds are compared to */
+struct flow_state_t {
+    u32 sw_ids[MAX_INT_HOP];
+    u32 hop_latencies[MAX_INT_HOP];
+    u32 flow_latency;
+    u64 flow_sink_time;
+};
+
+// Event records sent to user space. A report raising events emits one record
+// per type, carrying only the hops that fired. Same layout as EventRecords.pyx.
+#define EVENT_FLOW 1  // New flow, path or flow latency change: all hops
+#define EVENT_HOP_LATENCY 2  // Hops whose latency changed
+#define EVENT_QUEUE_OCCUP 3  // Queues whose occupancy changed
+
+struct event_hdr_t {
+    u64 sink_time;
+    u32 last_sw_id;
+    u32 flow_latency;  // EVENT_FLOW only
+    u16 vlan_id;
+    u16 last_egr_id;
+    u8 type;
+    u8 num_entries;  // Entries following the header
+    u16 reserved;
+};
+
+struct path_hop_t {
+    u32 sw_id;
+    u16 in_port_id;
+    u16 e_port_id;
+    u16 queue_id;
+    u16 reserved;
+};
+
+struct hop_latency_t {
+    u32 sw_id;
+    u32 hop_latency;
+};
+
+struct queue_occup_t {
+    u32 sw_id;
+    u16 e_port_id;
+    u16 queue_id;
+    u32 occup;
+};
+
+struct event_t {
+    struct event_hdr_t hdr;
+    union {
+        struct path_hop_t path[MAX_INT_HOP];
+        struct hop_latency_t hop_latencies[MAX_INT_HOP];
+        struct queue_occup_t queue_occups[MAX_INT_HOP];
+    };
+};
+
+/* Report being processed, passed from a stage to the next one */
+struct scratch_t {
+    struct flow_info_t flow_info;
+    u64 packet_len;  // Inner frame, for the utilization counters
+    struct event_t event;  // Record being built
+};
+
+// Ring buffers shared by all CPUs let user space drain many events per wakeup.
+// Flows are spread over EVENT_RINGS ring buffers, so the events of a flow stay
+// in order in a single one.
+BPF_RINGBUF_OUTPUT(events, EVENTS_RING_PAGES);
+#if EVENT_RINGS > 1
+BPF_RINGBUF_OUTPUT(events1, EVENTS_RING_PAGES);
+#endif
+#if EVENT_RINGS > 2
+BPF_RINGBUF_OUTPUT(events2, EVENTS_RING_PAGES);
+#endif
+#if EVENT_RINGS > 3
+BPF_RINGBUF_OUTPUT(events3, EVENTS_RING_PAGES);
+#endif
+#if EVENT_RINGS > 4
+BPF_RINGBUF_OUTPUT(events4, EVENTS_RING_PAGES);
+#endif
+#if EVENT_RINGS > 5
+BPF_RINGBUF_OUTPUT(events5, EVENTS_RING_PAGES);
+#endif
+#if EVENT_RINGS > 6
+BPF_RINGBUF_OUTPUT(events6, EVENTS_RING_PAGES);
+#endif
+#if EVENT_RINGS > 7
+BPF_RINGBUF_OUTPUT(events7, EVENTS_RING_PAGES);
+#endif
+
+// Maps keeping state between packets are pinned in _PIN_DIR when it is defined,
+// so a restarted collector finds its flows and counters where it left them.
+// Changing any of them requires a new MAP_LAYOUT in pinning.py.
+#ifdef _PIN_DIR
+#define STATE_TABLE(_type, _key, _leaf, _name, _size) \
+    BPF_TABLE_PINNED(_type, _key, _leaf, _name, _size, _PIN_DIR "/" #_name)
+#else
+#define STATE_TABLE(_type, _key, _leaf, _name, _size) \
+    BPF_TABLE(_type, _key, _leaf, _name, _size)
+#endif
 
 // Maps
-BPF_TABLE("lru_hash", struct flow_id_t, struct flow_info_t, tb_flow, 10000);
-BPF_TABLE("lru_hash", struct queue_id_t, struct queue_info_t, tb_queue, 3200);
-BPF_TABLE("lru_hash", struct egress_eg_q_vlan_id_t, struct egr_tx_info_t, tb_egr_vlan_util, 5120);
-BPF_TABLE("lru_hash", struct egress_queue_util_id_t, struct egr_tx_info_t, tb_egr_queue_util, 520);
-BPF_TABLE("lru_hash", struct egress_util_id_t, struct egr_tx_info_t, tb_egr_interface_util, 400);
-BPF_HASH(tb_report_seq, int, struct last_tm_report_t, 1);
-
-BPF_HISTOGRAM(counter_all, u64);
-BPF_HISTOGRAM(counter_int, u64);
-BPF_HISTOGRAM(counter_error, u64);
-BPF_HISTOGRAM(counter_missing, u64);
+STATE_TABLE("lru_hash", struct flow_id_t, struct flow_state_t, tb_flow, TB_FLOW_SIZE);
+STATE_TABLE("lru_hash", struct queue_id_t, struct queue_info_t, tb_queue, TB_QUEUE_SIZE);
+// Counters are per CPU: each CPU increments its own copy without atomics and
+// user space sums the copies when exporting them.
+STATE_TABLE("lru_percpu_hash", struct egress_eg_q_vlan_id_t, struct egr_tx_info_t, tb_egr_vlan_util, TB_EGR_VLAN_UTIL_SIZE);
+STATE_TABLE("lru_percpu_hash", struct egress_queue_util_id_t, struct egr_tx_info_t, tb_egr_queue_util, TB_EGR_QUEUE_UTIL_SIZE);
+STATE_TABLE("lru_percpu_hash", struct egress_util_id_t, struct egr_tx_info_t, tb_egr_interface_util, TB_EGR_INTERFACE_UTIL_SIZE);
+STATE_TABLE("hash", int, struct last_tm_report_t, tb_report_seq, 1);
+BPF_ARRAY(tb_config, struct config_t, 1);
+
+// Hop latency histograms. Not pinned: buckets depend on the width of the
+// instance, so counts of a previous width would be mixed with the new ones.
+BPF_TABLE("lru_percpu_hash", struct hist_key_t, u64, tb_latency_hist, TB_LATENCY_HIST_SIZE);
+
+// Queue occupancy per interval. The interval is incremented by user space
+// before reading the slot of the previous one. It starts at 1, so the zeroed
+// copies of other CPUs are stale. Not pinned: intervals restart with the
+// collector.
+BPF_TABLE("lru_percpu_hash", struct peak_key_t, struct queue_peak_t, tb_queue_peaks, TB_QUEUE_PEAKS_SIZE);
+BPF_ARRAY(tb_peak_interval, u32, 1);
+
+// Steering: index -> CPU, and the cpumap running collector() on each CPU
+struct cpumap_val_t {  // struct bpf_cpumap_val
+    u32 qsize;
+    int prog_fd;
+};
+BPF_ARRAY(tb_steer_cpus, u32, MAX_STEER_CPUS);
+BPF_XDP_REDIRECT_MAP("cpumap", struct cpumap_val_t, tb_cpumap, MAX_STEER_CPUS);
+
+STATE_TABLE("percpu_hash", u64, u64, counter_all, 64);
+STATE_TABLE("percpu_hash", u64, u64, counter_int, 64);
+STATE_TABLE("percpu_hash", u64, u64, counter_error, 64);
+STATE_TABLE("percpu_hash", u64, u64, counter_missing, 64);
+
+// Stages: a report stays on its CPU from collector() to the last stage, so a
+// per-CPU slot holds it in between.
+BPF_PERCPU_ARRAY(tb_scratch, struct scratch_t, 1);
+BPF_PROG_ARRAY(tb_stages, MAX_STAGES);
+BPF_PERCPU_ARRAY(tb_stage_stats, struct stage_stats_t, MAX_STAGES);
+
+// New entries per map. LRU maps evict entries silently, so user space derives
+// evictions from the inserts and the entries left.
+BPF_PERCPU_ARRAY(tb_map_inserts, u64, MAX_MAPS);
+
+//--------------------------------------------------------------------
+
+// Track the telemetry report sequence number searching for missing reports.
+static __always_inline void track_report_seq(struct telemetry_report_v10_t *tm_rp) {
+    u64 value = 4;  // Report missing received == 0
+    u32 current_seq_number = ntohl(tm_rp->seqNumber), one = 1;
+    struct last_tm_report_t *last_seq_number = tb_report_seq.lookup(&one);
+
+    if (unlikely(!last_seq_number)){
+        tb_report_seq.update(&one, &current_seq_number);
+    }
+    else {
+        u32 diff = ABS(current_seq_number, last_seq_number->value);
+        if (diff > 1) {
+                counter_missing.increment(value, diff - 1);
+        }
+        tb_report_seq.update(&one, &current_seq_number);
+    }
+}
+
+// Account a run of stage started at start, when stage stats are enabled.
+static __always_inline void stage_done(struct config_t *config, u32 stage, u64 start) {
+    if (likely(!config->stage_stats))
+        return;
+
+    struct stage_stats_t *stats = tb_stage_stats.lookup(&stage);
+    if (likely(stats != NULL)) {
+        stats->runs++;
+        stats->ns += bpf_ktime_get_ns() - start;
+    }
+}
+
+// Count a new entry of map.
+static __always_inline void count_insert(u32 map) {
+    u64 *inserts = tb_map_inserts.lookup(&map);
+    if (likely(inserts != NULL))
+        (*inserts)++;
+}
+
+// Point entry to the value of key in table. A missing key is inserted with init
+// and entry is left NULL, as init already holds the first update. Another CPU may
+// have created the entry in the meantime, so it is looked up again if the insert
+// fails.
+#define LOOKUP_OR_INSERT(entry, table, key, init, map)     \
+    do {                                                   \
+        entry = table.lookup(key);                         \
+        if (unlikely(!entry)) {                            \
+            if (likely(table.insert(key, init) == 0))      \
+                count_insert(map);                         \
+            else                                           \
+                entry = table.lookup(key);                 \
+        }                                                  \
+    } while (0)
+
+// Hash of struct flow_id_t
+static __always_inline u32 flow_hash(u16 vlan_id, u32 last_sw_id, u32 last_egr_id) {
+    u32 hash = vlan_id * 0x9e3779b1;
+    hash = (hash ^ last_sw_id) * 0x85ebca6b;
+    hash = (hash ^ last_egr_id) * 0xc2b2ae35;
+    return hash ^ (hash >> 16);
+}
+
+// Send the header of event and its first num_entries entries of entry_size
+// bytes to the ring buffer ring. Returns 0 on success.
+static __always_inline int emit_event(struct event_t *event, u32 ring, u8 type,
+                                      u8 num_entries, u32 entry_size) {
+    event->hdr.type = type;
+    event->hdr.num_entries = num_entries;
+    u32 size = sizeof(event->hdr) + num_entries * entry_size;
+    if (size > sizeof(*event))
+        size = sizeof(*event);
+
+    switch (ring) {
+#if EVENT_RINGS > 1
+        case 1: return events1.ringbuf_output(event, size, 0);
+#endif
+#if EVENT_RINGS > 2
+        case 2: return events2.ringbuf_output(event, size, 0);
+#endif
+#if EVENT_RINGS > 3
+        case 3: return events3.ringbuf_output(event, size, 0);
+#endif
+#if EVENT_RINGS > 4
+        case 4: return events4.ringbuf_output(event, size, 0);
+#endif
+#if EVENT_RINGS > 5
+        case 5: return events5.ringbuf_output(event, size, 0);
+#endif
+#if EVENT_RINGS > 6
+        case 6: return events6.ringbuf_output(event, size, 0);
+#endif
+#if EVENT_RINGS > 7
+        case 7: return events7.ringbuf_output(event, size, 0);
+#endif
+        default: return events.ringbuf_output(event, size, 0);
+    }
+}
+
+// Tail-call the first stage installed after stage. Tail calls don't return
+// when they succeed; reports are consumed once no stage is left.
+static __always_inline int next_stage(struct xdp_md *ctx, u32 stage) {
+    #pragma unroll
+    for (u32 next = STAGE_PARSE + 1; next < MAX_STAGES; next++) {
+        if (next > stage)
+            tb_stages.call(ctx, next);
+    }
+    return XDP_DROP;
+}
+
+/*
+    Optional first stage, attached to the interface instead of collector().
+    All reports of a switch share the outer 5-tuple, so RSS delivers them to
+    a single CPU. steer() redirects each report to a CPU chosen by hashing
+    its flow, where collector() runs from the cpumap. Reports of a flow keep
+    their order and their flow state is updated by a single CPU. Sequence
+    numbers are tracked here, before reports are spread over CPUs.
+*/
+int steer(struct xdp_md *ctx) {
+
+    u64 value = 0;  // Packets received == 0
+    counter_all.increment(value);
+
+    int config_key = 0;
+    struct config_t *config = tb_config.lookup(&config_key);
+    if (unlikely(!config || !config->steer_cpus))
+        return XDP_PASS;
+
+    void* data_end = (void*)(long)ctx->data_end;
+    void* cursor = (void*)(long)ctx->data;
+
+    // Outer: Ether->[VLAN]->IP->UDP->TelemetryReport, as in collector()
+    struct eth_tp *eth;
+    CURSOR_ADVANCE(eth, cursor, sizeof(*eth), data_end);
+    if (unlikely(ntohs(eth->type) != ETHTYPE_IP))
+        return XDP_PASS;
+
+    struct iphdr *ip;
+    CURSOR_ADVANCE(ip, cursor, sizeof(*ip), data_end);
+    if (unlikely(ip->protocol != IPPROTO_UDP))
+        return XDP_PASS;
+
+    struct udphdr *udp;
+    CURSOR_ADVANCE(udp, cursor, sizeof(*udp), data_end);
+    if (unlikely(ntohs(udp->dest) != INT_DST_PORT))
+        return XDP_PASS;
+
+    struct telemetry_report_v10_t *tm_rp;
+    CURSOR_ADVANCE(tm_rp, cursor, sizeof(*tm_rp), data_end);
+    track_report_seq(tm_rp);
+
+    // Inner: Ether->Vlan->[Vlan]->IP->UDP/TCP->INT shim->INT header->first hop
+    struct vlan_tp *vlan;
+    CURSOR_ADVANCE_NO_PARSE(cursor, ETH_SIZE, data_end);
+    CURSOR_ADVANCE(vlan, cursor, sizeof(*vlan), data_end);
+    u16 vlan_id = ntohs(vlan->vid) & 0x0fff;
+    if (unlikely(ntohs(vlan->type) == ETHTYPE_VLAN))
+        CURSOR_ADVANCE_NO_PARSE(cursor, sizeof(*vlan), data_end);
+
+    struct iphdr *in_ip;
+    CURSOR_ADVANCE(in_ip, cursor, sizeof(*in_ip), data_end);
+    u8 remain_size = (in_ip->protocol == IPPROTO_UDP)?
+                      (UDPHDR_SIZE):(TCPHDR_SIZE);
+    CURSOR_ADVANCE_NO_PARSE(cursor, remain_size, data_end);
+    CURSOR_ADVANCE_NO_PARSE(cursor, sizeof(struct INT_shim_v10_t), data_end);
+    CURSOR_ADVANCE_NO_PARSE(cursor, sizeof(struct INT_md_hdr_v10_t), data_end);
+
+    // The first metadata is from the last switch: its ID and its egress port
+    u32 *INT_data;
+    CURSOR_ADVANCE(INT_data, cursor, sizeof(*INT_data), data_end);
+    u32 last_sw_id = ntohl(*INT_data);
+    CURSOR_ADVANCE(INT_data, cursor, sizeof(*INT_data), data_end);
+    u32 last_egr_id = ntohl(*INT_data) & 0xffff;
+
+    u32 index = flow_hash(vlan_id, last_sw_id, last_egr_id) % config->steer_cpus;
+    u32 *cpu = tb_steer_cpus.lookup(&index);
+    if (unlikely(!cpu))
+        return XDP_PASS;
+
+    return tb_cpumap.redirect_map(*cpu, 0);
+}
 
 //--------------------------------------------------------------------
 
+/*
+    Parse stage. Validates the report and copies it to tb_scratch for the
+    counters and thresholds stages, which are separate programs so each can
+    be left out, measured, or replaced without touching the others.
+*/
 int collector(struct xdp_md *ctx) {
 
     /* Timestamp when packet was received */
     u64 current_time_ns = bpf_ktime_get_ns();
 
-    // Counter
-    u64 value = 0;  // Packets received == 0
-    counter_all.increment(value);
+    u64 value = 0;
+    int config_key = 0;
+    struct config_t *config = tb_config.lookup(&config_key);
+    if (unlikely(!config))
+        goto PASS;
+
+    // Steered reports were counted by steer()
+    if (likely(!config->steer_cpus))
+        counter_all.increment(value);  // Packets received == 0
 
     void* data_end = (void*)(long)ctx->data_end;
     void* cursor = (void*)(long)ctx->data;
@@ -280,21 +700,9 @@ int collector(struct xdp_md *ctx) {
     struct telemetry_report_v10_t *tm_rp;
     CURSOR_ADVANCE(tm_rp, cursor, sizeof(*tm_rp), data_end);
 
-    // Track the telemetry report sequence number searching for missing reports.
-    u32 current_seq_number = ntohl(tm_rp->seqNumber), one = 1;
-    struct last_tm_report_t *last_seq_number = tb_report_seq.lookup(&one);
-
-    if (unlikely(!last_seq_number)){
-        tb_report_seq.update(&one, &current_seq_number);
-    }
-    else {
-        u32 diff = ABS(current_seq_number, last_seq_number->value);
-        if (diff > 1) {
-                value = 4;  // Report missing received == 0
-                counter_missing.increment(value, diff - 1);
-        }
-        tb_report_seq.update(&one, &current_seq_number);
-    }
+    // Steered reports were tracked by steer(), in order
+    if (likely(!config->steer_cpus))
+        track_report_seq(tm_rp);
 
     /*
         Parse Inner: Ether->Vlan->[Vlan]->IP->UDP/TCP->INT.
@@ -404,35 +812,153 @@ int collector(struct xdp_md *ctx) {
 
     }
 
+    /*************** Hand the report to the next stages  ***************/
+    struct scratch_t *scratch = tb_scratch.lookup(&config_key);
+    if (unlikely(!scratch))
+        goto DROP;
+
+    scratch->flow_info = flow_info;
+    scratch->packet_len = 18 + ntohs(in_ip->tot_len);
+
+    stage_done(config, STAGE_PARSE, current_time_ns);
+    return next_stage(ctx, STAGE_PARSE);
+
+DROP:
+    return XDP_DROP;
+
+PASS:
+    return XDP_PASS;
+
+ERROR:
+    value = 3;
+    counter_error.increment(value);
+    // Send to user-space for further investigation.
+    return XDP_PASS;
+}
+
+//--------------------------------------------------------------------
+
+/*
+    Egress info and flow bandwidth
+*/
+int counters(struct xdp_md *ctx) {
+
+    int zero = 0;
+    struct config_t *config = tb_config.lookup(&zero);
+    struct scratch_t *scratch = tb_scratch.lookup(&zero);
+    if (unlikely(!config || !scratch))
+        return XDP_DROP;
+
+    u64 start = config->stage_stats ? bpf_ktime_get_ns() : 0;
+    struct flow_info_t *flow_info = &scratch->flow_info;
+
+    struct egr_tx_info_t *egr_info_p;
+    struct egr_tx_info_t egr_info;
+    struct egress_eg_q_vlan_id_t egr_id = {};
+    struct egress_queue_util_id_t egr_q_id = {};
+    struct egress_util_id_t egr_int_id = {};
+    u64 packet_len = scratch->packet_len;
+
+    // First values of new entries
+    egr_info.octets = packet_len;
+    egr_info.packets = 1;
+
+    u8 _num_INT_hop = flow_info->num_INT_hop;
+    #pragma unroll
+    for (u8 i = 0; i < MAX_INT_HOP; i++) {
+
+        // Full details: interface + queue + vlan
+        egr_id.sw_id  = flow_info->sw_ids[i];
+        egr_id.p_id = flow_info->e_port_ids[i];
+        egr_id.q_id = flow_info->queue_ids[i];
+        egr_id.v_id = flow_info->vlan_id;
+
+        LOOKUP_OR_INSERT(egr_info_p, tb_egr_vlan_util, &egr_id, &egr_info, MAP_EGR_VLAN_UTIL);
+        if (likely(egr_info_p != NULL)) {
+            egr_info_p->octets += packet_len;
+            egr_info_p->packets++;
+        }
+
+        // interface + queue details
+        egr_q_id.sw_id  = flow_info->sw_ids[i];
+        egr_q_id.p_id = flow_info->e_port_ids[i];
+        egr_q_id.q_id = flow_info->queue_ids[i];
+
+        LOOKUP_OR_INSERT(egr_info_p, tb_egr_queue_util, &egr_q_id, &egr_info, MAP_EGR_QUEUE_UTIL);
+        if (likely(egr_info_p != NULL)) {
+            egr_info_p->octets += packet_len;
+            egr_info_p->packets++;
+        }
+
+        // interface details
+        egr_int_id.sw_id  = flow_info->sw_ids[i];
+        egr_int_id.p_id = flow_info->e_port_ids[i];
+
+        LOOKUP_OR_INSERT(egr_info_p, tb_egr_interface_util, &egr_int_id, &egr_info,
+                         MAP_EGR_INTERFACE_UTIL);
+        if (likely(egr_info_p != NULL)) {
+            egr_info_p->octets += packet_len;
+            egr_info_p->packets++;
+        }
+
+        if (i < MAX_INT_HOP - 1) {
+            _num_INT_hop--;
+            if (_num_INT_hop <= 0)
+                break;
+        }
+    }
+
+    stage_done(config, STAGE_COUNTERS, start);
+    return next_stage(ctx, STAGE_COUNTERS);
+}
+
+//--------------------------------------------------------------------
+
+/*
+    Path store and change-detection, queue occupancy, and events
+*/
+int thresholds(struct xdp_md *ctx) {
+
+    int zero = 0;
+    struct config_t *config = tb_config.lookup(&zero);
+    struct scratch_t *scratch = tb_scratch.lookup(&zero);
+    if (unlikely(!config || !scratch))
+        return XDP_DROP;
+
+    u64 start = config->stage_stats ? bpf_ktime_get_ns() : 0;
+    struct flow_info_t *flow_info = &scratch->flow_info;
+    u8 num_INT_hop = flow_info->num_INT_hop;
+    u8 _num_INT_hop;
+    u64 value;
+
     /*************** flow data structure  ***************/
     struct flow_id_t flow_id = {};
 
-    flow_id.vlan_id = flow_info.vlan_id;
-    flow_id.last_sw_id = flow_info.sw_ids[0];
-    flow_id.last_egr_id = flow_info.e_port_ids[0];
+    flow_id.vlan_id = flow_info->vlan_id;
+    flow_id.last_sw_id = flow_info->sw_ids[0];
+    flow_id.last_egr_id = flow_info->e_port_ids[0];
 
     /***************  Path store and change-detection  ***************/
     u8 is_update = 0;
 
-#if ENABLE_THRESHOLD_MODE == 1
-
-    struct flow_info_t *flow_info_p = tb_flow.lookup(&flow_id);
-    if (unlikely(!flow_info_p)) {
+    struct flow_state_t *flow_state_p = tb_flow.lookup(&flow_id);
+    if (unlikely(!flow_state_p)) {
 
-        flow_info.is_n_flow = 1;
+        flow_info->is_n_flow = 1;
         is_update = 1;
+        count_insert(MAP_FLOW);
 
         switch (num_INT_hop) {
-            case 1: flow_info.is_hop_latency = 0x01; break;
-            case 2: flow_info.is_hop_latency = 0x03; break;
-            case 3: flow_info.is_hop_latency = 0x07; break;
-            case 4: flow_info.is_hop_latency = 0x0f; break;
-            case 5: flow_info.is_hop_latency = 0x1f; break;
-            case 6: flow_info.is_hop_latency = 0x3f; break;
-            case 7: flow_info.is_hop_latency = 0x7f; break;
-            case 8: flow_info.is_hop_latency = 0xff; break;
-            case 9: flow_info.is_hop_latency = 0x1ff; break;
-            case 10: flow_info.is_hop_latency = 0x3ff; break;
+            case 1: flow_info->is_hop_latency = 0x01; break;
+            case 2: flow_info->is_hop_latency = 0x03; break;
+            case 3: flow_info->is_hop_latency = 0x07; break;
+            case 4: flow_info->is_hop_latency = 0x0f; break;
+            case 5: flow_info->is_hop_latency = 0x1f; break;
+            case 6: flow_info->is_hop_latency = 0x3f; break;
+            case 7: flow_info->is_hop_latency = 0x7f; break;
+            case 8: flow_info->is_hop_latency = 0xff; break;
+            case 9: flow_info->is_hop_latency = 0x1ff; break;
+            case 10: flow_info->is_hop_latency = 0x3ff; break;
             default: break;
         }
 
@@ -440,8 +966,8 @@ int collector(struct xdp_md *ctx) {
     } else {
 
         // If flow latency changed over the threshold, record it.
-        if (ABS(flow_info.flow_latency, flow_info_p->flow_latency) > FLOW_LATENCY){
-            flow_info.is_flow = 1;
+        if (ABS(flow_info->flow_latency, flow_state_p->flow_latency) > config->flow_latency){
+            flow_info->is_flow = 1;
             is_update = 1;
         }
 
@@ -451,24 +977,25 @@ int collector(struct xdp_md *ctx) {
         for (u8 i = 0; i < MAX_INT_HOP; i++) {
 
             // Check if path changed
-            if (unlikely(flow_info.sw_ids[i] != flow_info_p->sw_ids[i])) {
+            if (unlikely(flow_info->sw_ids[i] != flow_state_p->sw_ids[i])) {
                 is_update = 1;
-                flow_info.is_flow = 1;
-                flow_info.is_hop_latency |= 1 << i;
+                flow_info->is_flow = 1;
+                flow_info->is_hop_latency |= 1 << i;
             }
 
             // If hop latency changed over the threshold, record it.
-            if (unlikely(ABS(flow_info.hop_latencies[i], flow_info_p->hop_latencies[i]) > HOP_LATENCY)) {
+            if (unlikely(ABS(flow_info->hop_latencies[i], flow_state_p->hop_latencies[i]) > config->hop_latency)) {
                 is_update = 1;
-                flow_info.is_hop_latency |= 1 << i;
+                flow_info->is_hop_latency |= 1 << i;
             }
 
-            // Interval between the current and last packet is more than TIME_GAP_W
+            // Interval between the current and last packet is more than time_gap_w
             // even if it doesn't reach the thresholds (keepalive)
-            if (unlikely(!is_update) & (flow_info_p->flow_sink_time + TIME_GAP_W < flow_info.flow_sink_time)){
+            if (unlikely(!is_update) &
+                (flow_state_p->flow_sink_time + config->time_gap_w < flow_info->flow_sink_time)){
                 is_update = 1;
-                flow_info.is_hop_latency |= 1 << i;
-                flow_info.is_flow = 1;
+                flow_info->is_hop_latency |= 1 << i;
+                flow_info->is_flow = 1;
             }
 
             if (i < MAX_INT_HOP - 1) {
@@ -480,8 +1007,18 @@ int collector(struct xdp_md *ctx) {
         }
     }
 
-    if (is_update)
-        tb_flow.update(&flow_id, &flow_info);
+    if (is_update) {
+        struct flow_state_t flow_state = {
+            .flow_latency = flow_info->flow_latency,
+            .flow_sink_time = flow_info->flow_sink_time
+        };
+        #pragma unroll
+        for (u8 i = 0; i < MAX_INT_HOP; i++) {
+            flow_state.sw_ids[i] = flow_info->sw_ids[i];
+            flow_state.hop_latencies[i] = flow_info->hop_latencies[i];
+        }
+        tb_flow.update(&flow_id, &flow_state);
+    }
 
     /*****************  Queue info  *****************/
 
@@ -489,34 +1026,38 @@ int collector(struct xdp_md *ctx) {
     struct queue_id_t queue_id = {};
     struct queue_info_t queue_info = {};
 
-    _num_INT_hop = num_INT_hop;
+    // Skipped when queue occupancy is tracked by the queue peaks stage instead
+    _num_INT_hop = config->queue_events ? num_INT_hop : 0;
     #pragma unroll
     for (u8 i = 0; i < MAX_INT_HOP; i++) {
+        if (_num_INT_hop == 0)
+            break;
 
-        queue_id.sw_id = flow_info.sw_ids[i];
-        queue_id.p_id = flow_info.e_port_ids[i];
-        queue_id.q_id = flow_info.queue_ids[i];
+        queue_id.sw_id = flow_info->sw_ids[i];
+        queue_id.p_id = flow_info->e_port_ids[i];
+        queue_id.q_id = flow_info->queue_ids[i];
 
-        queue_info.occup = flow_info.queue_occups[i];
-        queue_info.q_time = flow_info.flow_sink_time;
+        queue_info.occup = flow_info->queue_occups[i];
+        queue_info.q_time = flow_info->flow_sink_time;
 
         is_update = 0;
 
         queue_info_p = tb_queue.lookup(&queue_id);
         if(unlikely(!queue_info_p)) {
-            flow_info.is_queue_occup |= 1 << i;
+            flow_info->is_queue_occup |= 1 << i;
             is_update = 1;
+            count_insert(MAP_QUEUE);
         } else {
 
             // Threshold for queue occupancy
-            if (unlikely(ABS(queue_info.occup, queue_info_p->occup) > QUEUE_OCCUP)) {
-                flow_info.is_queue_occup |= 1 << i;
+            if (unlikely(ABS(queue_info.occup, queue_info_p->occup) > config->queue_occup)) {
+                flow_info->is_queue_occup |= 1 << i;
                 is_update = 1;
             }
 
             // Flow keepalive if threshold is not reached
-            if (unlikely((!is_update) & (queue_info_p->q_time + TIME_GAP_W < flow_info.flow_sink_time))){
-                flow_info.is_queue_occup |= 1 << i;
+            if (unlikely((!is_update) & (queue_info_p->q_time + config->time_gap_w < flow_info->flow_sink_time))){
+                flow_info->is_queue_occup |= 1 << i;
                 is_update = 1;
             }
         }
@@ -531,74 +1072,119 @@ int collector(struct xdp_md *ctx) {
         }
     }
 
-#endif
+    // submit event records to user space
+    if (unlikely(flow_info->is_n_flow |
+                 flow_info->is_hop_latency |
+                 flow_info->is_queue_occup |
+                 flow_info->is_flow)){
+        struct event_t *event = &scratch->event;
+        event->hdr.sink_time = flow_info->flow_sink_time;
+        event->hdr.last_sw_id = flow_info->sw_ids[0];
+        event->hdr.flow_latency = flow_info->flow_latency;
+        event->hdr.vlan_id = flow_info->vlan_id;
+        event->hdr.last_egr_id = flow_info->e_port_ids[0];
+        event->hdr.reserved = 0;
+
+        // Bits beyond the hops of the report are ignored
+        u16 hops = (1 << num_INT_hop) - 1;
+        u16 is_hop_latency = flow_info->is_hop_latency & hops;
+        u16 is_queue_occup = flow_info->is_queue_occup & hops;
+        u32 ring = flow_hash(flow_id.vlan_id, flow_id.last_sw_id, flow_id.last_egr_id)
+                   % EVENT_RINGS;
+        int lost = 0;
+        u8 n;
+
+        if (flow_info->is_n_flow | flow_info->is_flow) {
+            #pragma unroll
+            for (u8 i = 0; i < MAX_INT_HOP; i++) {
+                event->path[i].sw_id = flow_info->sw_ids[i];
+                event->path[i].in_port_id = flow_info->in_port_ids[i];
+                event->path[i].e_port_id = flow_info->e_port_ids[i];
+                event->path[i].queue_id = flow_info->queue_ids[i];
+                event->path[i].reserved = 0;
+            }
+            lost |= emit_event(event, ring, EVENT_FLOW, num_INT_hop, sizeof(event->path[0]));
+        }
 
-    /*****************  Egress info and flow bandwidth *****************/
+        if (is_hop_latency) {
+            n = 0;
+            #pragma unroll
+            for (u8 i = 0; i < MAX_INT_HOP; i++) {
+                if ((is_hop_latency >> i) & 1) {
+                    event->hop_latencies[n].sw_id = flow_info->sw_ids[i];
+                    event->hop_latencies[n].hop_latency = flow_info->hop_latencies[i];
+                    n++;
+                }
+            }
+            lost |= emit_event(event, ring, EVENT_HOP_LATENCY, n, sizeof(event->hop_latencies[0]));
+        }
 
-#if ENABLE_COUNTER_MODE == 1
+        if (is_queue_occup) {
+            n = 0;
+            #pragma unroll
+            for (u8 i = 0; i < MAX_INT_HOP; i++) {
+                if ((is_queue_occup >> i) & 1) {
+                    event->queue_occups[n].sw_id = flow_info->sw_ids[i];
+                    event->queue_occups[n].e_port_id = flow_info->e_port_ids[i];
+                    event->queue_occups[n].queue_id = flow_info->queue_ids[i];
+                    event->queue_occups[n].occup = flow_info->queue_occups[i];
+                    n++;
+                }
+            }
+            lost |= emit_event(event, ring, EVENT_QUEUE_OCCUP, n, sizeof(event->queue_occups[0]));
+        }
 
-    struct egr_tx_info_t *egr_info_p_v;
-    struct egr_tx_info_t *egr_info_p_q;
-    struct egr_tx_info_t *egr_info_p_i;
-    struct egr_tx_info_t egr_info_v;
-    struct egr_tx_info_t egr_info_q;
-    struct egr_tx_info_t egr_info_i;
-    struct egress_eg_q_vlan_id_t egr_id = {};
-    struct egress_queue_util_id_t egr_q_id = {};
-    struct egress_util_id_t egr_int_id = {};
-    u64 packet_len = 18 + ntohs(in_ip->tot_len);
+        if (likely(!lost)) {
+            value = 2;  // Events sent to user space
+        } else {
+            value = 5;  // Events lost because the ring buffer was full
+        }
+        counter_int.increment(value);
+    }
 
-    _num_INT_hop = num_INT_hop;
-    #pragma unroll
-    for (u8 i = 0; i < MAX_INT_HOP; i++) {
+    stage_done(config, STAGE_THRESHOLDS, start);
+    return next_stage(ctx, STAGE_THRESHOLDS);
+}
 
-        // Full details: interface + queue + vlan
-        egr_id.sw_id  = flow_info.sw_ids[i];
-        egr_id.p_id = flow_info.e_port_ids[i];
-        egr_id.q_id = flow_info.queue_ids[i];
-        egr_id.v_id = flow_info.vlan_id;
-
-        egr_info_p_v = tb_egr_vlan_util.lookup(&egr_id);
-        if(unlikely(!egr_info_p_v)) {
-            egr_info_v.octets = 0;
-            egr_info_v.packets = 0;
-        }
-        else {
-            egr_info_v.octets = packet_len + egr_info_p_v->octets;
-            egr_info_v.packets = 1 + egr_info_p_v->packets;
-        }
-        tb_egr_vlan_util.update(&egr_id, &egr_info_v);
+//--------------------------------------------------------------------
 
-        // interface + queue details
-        egr_q_id.sw_id  = flow_info.sw_ids[i];
-        egr_q_id.p_id = flow_info.e_port_ids[i];
-        egr_q_id.q_id = flow_info.queue_ids[i];
-
-        egr_info_p_q = tb_egr_queue_util.lookup(&egr_q_id);
-        if(unlikely(!egr_info_p_q)) {
-            egr_info_q.octets = 0;
-            egr_info_q.packets = 0;
-        }
-        else {
-            egr_info_q.octets = packet_len + egr_info_p_q->octets;
-            egr_info_q.packets = 1 + egr_info_p_q->packets;
-        }
-        tb_egr_queue_util.update(&egr_q_id, &egr_info_q);
+/*
+    Hop latency histograms per egress queue. Every report is counted, so the
+    distribution doesn't depend on the thresholds and costs the same to export
+    whatever the report rate.
+*/
+int histograms(struct xdp_md *ctx) {
+
+    int zero = 0;
+    struct config_t *config = tb_config.lookup(&zero);
+    struct scratch_t *scratch = tb_scratch.lookup(&zero);
+    if (unlikely(!config || !scratch))
+        return XDP_DROP;
+
+    u64 start = config->stage_stats ? bpf_ktime_get_ns() : 0;
+    struct flow_info_t *flow_info = &scratch->flow_info;
+    struct hist_key_t hist_key = {};
+    u32 hist_width = config->hist_width;
+    u64 one = 1;
+    u64 *count;
+
+    u8 _num_INT_hop = flow_info->num_INT_hop;
+    #pragma unroll
+    for (u8 i = 0; i < MAX_INT_HOP; i++) {
 
-        // interface details
-        egr_int_id.sw_id  = flow_info.sw_ids[i];
-        egr_int_id.p_id = flow_info.e_port_ids[i];
+        hist_key.sw_id = flow_info->sw_ids[i];
+        hist_key.p_id = flow_info->e_port_ids[i];
+        hist_key.q_id = flow_info->queue_ids[i];
+        if (hist_width)
+            hist_key.bucket = flow_info->hop_latencies[i] / hist_width;
+        else
+            hist_key.bucket = bpf_log2l(flow_info->hop_latencies[i]);
+        if (hist_key.bucket >= MAX_HIST_BUCKETS)
+            hist_key.bucket = MAX_HIST_BUCKETS - 1;
 
-        egr_info_p_i = tb_egr_interface_util.lookup(&egr_int_id);
-        if(unlikely(!egr_info_p_i)) {
-            egr_info_i.octets = 0;
-            egr_info_i.packets = 0;
-        }
-        else {
-            egr_info_i.octets = packet_len + egr_info_p_i->octets;
-            egr_info_i.packets = 1 + egr_info_p_i->packets;
-        }
-        tb_egr_interface_util.update(&egr_int_id, &egr_info_i);
+        LOOKUP_OR_INSERT(count, tb_latency_hist, &hist_key, &one, MAP_LATENCY_HIST);
+        if (likely(count != NULL))
+            (*count)++;
 
         if (i < MAX_INT_HOP - 1) {
             _num_INT_hop--;
@@ -607,27 +1193,69 @@ int collector(struct xdp_md *ctx) {
         }
     }
 
-#endif
+    stage_done(config, STAGE_HISTOGRAMS, start);
+    return next_stage(ctx, STAGE_HISTOGRAMS);
+}
 
-    // submit event info to user space
-    if (unlikely(flow_info.is_n_flow |
-                 flow_info.is_hop_latency |
-                 flow_info.is_queue_occup |
-                 flow_info.is_flow)){
-        events.perf_submit(ctx, &flow_info, sizeof(flow_info));
-        value = 2;
-        counter_int.increment(value);
-    }
+//--------------------------------------------------------------------
 
-DROP:
-    return XDP_DROP;
+/*
+    Maximum, minimum, and last occupancy of each egress queue per interval.
+    Bursts between two reports of user space are seen whatever their size,
+    without sending events.
+*/
+int queue_peaks(struct xdp_md *ctx) {
+
+    int zero = 0;
+    struct config_t *config = tb_config.lookup(&zero);
+    struct scratch_t *scratch = tb_scratch.lookup(&zero);
+    u32 *interval_p = tb_peak_interval.lookup(&zero);
+    if (unlikely(!config || !scratch || !interval_p))
+        return XDP_DROP;
+
+    u64 start = config->stage_stats ? bpf_ktime_get_ns() : 0;
+    struct flow_info_t *flow_info = &scratch->flow_info;
+    u32 interval = *interval_p;
+    struct peak_key_t peak_key = {.slot = interval & 1};
+    struct queue_peak_t fresh = {.interval = interval};
+    struct queue_peak_t *peak;
+    u32 occup;
+
+    u8 _num_INT_hop = flow_info->num_INT_hop;
+    #pragma unroll
+    for (u8 i = 0; i < MAX_INT_HOP; i++) {
 
-PASS:
-    return XDP_PASS;
+        peak_key.sw_id = flow_info->sw_ids[i];
+        peak_key.p_id = flow_info->e_port_ids[i];
+        peak_key.q_id = flow_info->queue_ids[i];
+        occup = flow_info->queue_occups[i];
+
+        fresh.max = occup;
+        fresh.min = occup;
+        fresh.last = occup;
+        fresh.last_time = flow_info->flow_sink_time;
+
+        LOOKUP_OR_INSERT(peak, tb_queue_peaks, &peak_key, &fresh, MAP_QUEUE_PEAKS);
+        if (likely(peak != NULL)) {
+            if (peak->interval != interval) {
+                *peak = fresh;
+            } else {
+                if (occup > peak->max)
+                    peak->max = occup;
+                if (occup < peak->min)
+                    peak->min = occup;
+                peak->last = occup;
+                peak->last_time = fresh.last_time;
+            }
+        }
 
-ERROR:
-    value = 3;
-    counter_error.increment(value);
-    // Send to user-space for further investigation.
-    return XDP_PASS;
+        if (i < MAX_INT_HOP - 1) {
+            _num_INT_hop--;
+            if (_num_INT_hop <= 0)
+                break;
+        }
+    }
+
+    stage_done(config, STAGE_QUEUE_PEAKS, start);
+    return next_stage(ctx, STAGE_QUEUE_PEAKS);
 }
@@ -0,0 +1,231 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Decoder of the event records sent by BPFCollector.c through the events ring buffer. Records
+have a header and only the hops that fired, so their size varies. The ring buffer callback sorts
+them into preallocated NumPy arrays, one per record type, without going through Python. """
+
+import numpy as np
+from libc.stdint cimport uint8_t, uint16_t, uint32_t, uint64_t, uintptr_t
+from libc.string cimport memcpy
+from libs.xdp_code.decoder import FLOW_EVENT_DTYPE, HOP_LATENCY_EVENT_DTYPE, \
+    QUEUE_OCCUP_EVENT_DTYPE
+
+
+cdef enum: __MAX_INT_HOP = 10  # 10 is the max for noviflow
+cdef enum: __EVENT_BATCH = 4096  # records drained from the ring buffer before processing them
+
+# Record types. Same as BPFCollector.c
+cdef enum:
+    EVENT_FLOW = 1
+    EVENT_HOP_LATENCY = 2
+    EVENT_QUEUE_OCCUP = 3
+
+# Records, same layout as BPFCollector.c
+cdef struct EventHdr:
+    uint64_t sink_time
+    uint32_t last_sw_id
+    uint32_t flow_latency
+    uint16_t vlan_id
+    uint16_t last_egr_id
+    uint8_t type
+    uint8_t num_entries
+    uint16_t reserved
+
+cdef struct PathHop:
+    uint32_t sw_id
+    uint16_t in_port_id
+    uint16_t e_port_id
+    uint16_t queue_id
+    uint16_t reserved
+
+cdef struct HopLatency:
+    uint32_t sw_id
+    uint32_t hop_latency
+
+cdef struct QueueOccup:
+    uint32_t sw_id
+    uint16_t e_port_id
+    uint16_t queue_id
+    uint32_t occup
+
+# Rows of the arrays, same layout as the dtypes of decoder.py. Flow records are kept whole.
+cdef struct FlowEvent:
+    EventHdr hdr
+    PathHop path[__MAX_INT_HOP]
+
+cdef struct HopLatencyEvent:
+    uint64_t sink_time
+    uint32_t last_sw_id
+    uint16_t vlan_id
+    uint16_t last_egr_id
+    uint32_t sw_id
+    uint32_t hop_latency
+
+cdef struct QueueOccupEvent:
+    uint64_t sink_time
+    uint32_t sw_id
+    uint16_t e_port_id
+    uint16_t queue_id
+    uint32_t occup
+
+
+cdef struct EventRing:
+    FlowEvent *flows
+    HopLatencyEvent *hop_latencies
+    QueueOccupEvent *queue_occups
+    size_t capacity  # records
+    size_t records
+    size_t num_flows
+    size_t num_hop_latencies
+    size_t num_queue_occups
+    size_t malformed
+
+
+cdef int _ringbuf_sample(void *ctx, void *data, size_t size) noexcept nogil:
+    """ libbpf ring buffer callback. It sorts the record into the arrays of the batch. Returning
+    -1 stops the drain once the batch is full; the remaining records stay in the ring buffer
+    for the next call. """
+    cdef EventRing *ring = <EventRing*> ctx
+    cdef EventHdr *hdr = <EventHdr*> data
+    cdef size_t i, num_entries
+    cdef HopLatency *hop_latency
+    cdef HopLatencyEvent *hop_latency_row
+    cdef QueueOccup *queue_occup
+    cdef QueueOccupEvent *queue_occup_row
+
+    if size < sizeof(EventHdr):
+        ring.malformed += 1
+        return 0
+    num_entries = hdr.num_entries
+    if num_entries > __MAX_INT_HOP:
+        num_entries = __MAX_INT_HOP
+
+    if hdr.type == EVENT_FLOW and size >= sizeof(EventHdr) + num_entries * sizeof(PathHop):
+        memcpy(&ring.flows[ring.num_flows], data, sizeof(EventHdr) + num_entries * sizeof(PathHop))
+        ring.flows[ring.num_flows].hdr.num_entries = <uint8_t> num_entries
+        ring.num_flows += 1
+
+    elif hdr.type == EVENT_HOP_LATENCY and \
+            size >= sizeof(EventHdr) + num_entries * sizeof(HopLatency):
+        hop_latency = <HopLatency*> (<char*> data + sizeof(EventHdr))
+        for i in range(num_entries):
+            hop_latency_row = &ring.hop_latencies[ring.num_hop_latencies]
+            hop_latency_row.sink_time = hdr.sink_time
+            hop_latency_row.last_sw_id = hdr.last_sw_id
+            hop_latency_row.vlan_id = hdr.vlan_id
+            hop_latency_row.last_egr_id = hdr.last_egr_id
+            hop_latency_row.sw_id = hop_latency[i].sw_id
+            hop_latency_row.hop_latency = hop_latency[i].hop_latency
+            ring.num_hop_latencies += 1
+
+    elif hdr.type == EVENT_QUEUE_OCCUP and \
+            size >= sizeof(EventHdr) + num_entries * sizeof(QueueOccup):
+        queue_occup = <QueueOccup*> (<char*> data + sizeof(EventHdr))
+        for i in range(num_entries):
+            queue_occup_row = &ring.queue_occups[ring.num_queue_occups]
+            queue_occup_row.sink_time = hdr.sink_time
+            queue_occup_row.sw_id = queue_occup[i].sw_id
+            queue_occup_row.e_port_id = queue_occup[i].e_port_id
+            queue_occup_row.queue_id = queue_occup[i].queue_id
+            queue_occup_row.occup = queue_occup[i].occup
+            ring.num_queue_occups += 1
+
+    else:
+        ring.malformed += 1
+        return 0
+
+    # A record adds at most one flow or __MAX_INT_HOP rows, so the arrays can't overflow
+    ring.records += 1
+    if ring.records == ring.capacity:
+        return -1
+    return 0
+
+
+cdef class EventBatch:
+    """ Preallocated arrays of events filled by the ring buffer callback: flow records, and hop
+    latencies and queue occupancies with a row per hop. A batch is encoded without accessing
+    events one by one from Python. """
+
+    cdef EventRing ring
+    cdef readonly object flow_array
+    cdef readonly object hop_latency_array
+    cdef readonly object queue_occup_array
+
+    def __cinit__(self, size_t capacity=__EVENT_BATCH):
+        if (FLOW_EVENT_DTYPE.itemsize != sizeof(FlowEvent) or
+                HOP_LATENCY_EVENT_DTYPE.itemsize != sizeof(HopLatencyEvent) or
+                QUEUE_OCCUP_EVENT_DTYPE.itemsize != sizeof(QueueOccupEvent)):
+            raise TypeError("Event dtypes don't match the event records")
+        self.flow_array = np.zeros(capacity, dtype=FLOW_EVENT_DTYPE)
+        self.hop_latency_array = np.zeros(capacity * __MAX_INT_HOP, dtype=HOP_LATENCY_EVENT_DTYPE)
+        self.queue_occup_array = np.zeros(capacity * __MAX_INT_HOP, dtype=QUEUE_OCCUP_EVENT_DTYPE)
+        self.ring.flows = <FlowEvent*> <uintptr_t> self.flow_array.ctypes.data
+        self.ring.hop_latencies = <HopLatencyEvent*> <uintptr_t> self.hop_latency_array.ctypes.data
+        self.ring.queue_occups = <QueueOccupEvent*> <uintptr_t> self.queue_occup_array.ctypes.data
+        self.ring.capacity = capacity
+        self.ring.malformed = 0
+        self.clear()
+
+    def __len__(self):
+        return self.ring.records
+
+    @property
+    def ctx(self):
+        """ Address handed to libbpf as the callback context """
+        return <uintptr_t> &self.ring
+
+    @property
+    def callback(self):
+        """ Address of the C callback handed to libbpf """
+        return <uintptr_t> &_ringbuf_sample
+
+    @property
+    def flows(self):
+        """ Flow records of the batch """
+        return self.flow_array[:self.ring.num_flows]
+
+    @property
+    def hop_latencies(self):
+        """ Hop latencies of the batch, a row per hop """
+        return self.hop_latency_array[:self.ring.num_hop_latencies]
+
+    @property
+    def queue_occups(self):
+        """ Queue occupancies of the batch, a row per queue """
+        return self.queue_occup_array[:self.ring.num_queue_occups]
+
+    @property
+    def malformed(self):
+        """ Records dropped because of an unknown type or a wrong size """
+        return self.ring.malformed
+
+    def add(self, const uint8_t[:] record):
+        """ Add a record as the ring buffer does. Returns False once the batch is full. """
+        if record.shape[0] == 0:
+            self.ring.malformed += 1
+            return True
+        return _ringbuf_sample(&self.ring, <void*> &record[0], record.shape[0]) == 0
+
+    def is_full(self):
+        return self.ring.records == self.ring.capacity
+
+    def clear(self):
+        self.ring.records = 0
+        self.ring.num_flows = 0
+        self.ring.num_hop_latencies = 0
+        self.ring.num_queue_occups = 0
@@ -17,33 +17,52 @@
 #
 
 
-import threading
-import time
+import ctypes as ct
+import errno
+import numpy as np
 from bcc import BPF
-from influxdb import InfluxDBClient
-from libc.stdint cimport uintptr_t
-
-
-cdef enum: __MAX_INT_HOP = 10  # 10 is the max for noviflow
-cdef struct Event:
-    unsigned int seqNumber
-    unsigned short vlan_id
-    unsigned char  num_INT_hop
-    unsigned int   sw_ids[__MAX_INT_HOP]
-    unsigned short in_port_ids[__MAX_INT_HOP]
-    unsigned short e_port_ids[__MAX_INT_HOP]
-    unsigned int   hop_latencies[__MAX_INT_HOP]
-    unsigned short  queue_ids[__MAX_INT_HOP]
-    unsigned int   queue_occups[__MAX_INT_HOP]
-    unsigned int   ingr_times[__MAX_INT_HOP]
-    unsigned int   egr_times[__MAX_INT_HOP]
-    unsigned int   flow_latency
-    unsigned long int   flow_sink_time
-    unsigned char  is_n_flow
-    unsigned char  is_flow
-    unsigned short  is_hop_latency
-    unsigned short  is_queue_occup
-    unsigned int metadata
+from bcc.libbcc import lib
+from libs.xdp_code import bpf_cache
+from libs.xdp_code.clock import KernelClock
+from libs.xdp_code.decoder import encode_events, EGR_VLAN_KEY_DTYPE, \
+    EGR_QUEUE_KEY_DTYPE, EGR_INTERFACE_KEY_DTYPE, TX_INFO_DTYPE, COUNTER_KEY_DTYPE, COUNTER_DTYPE, \
+    STAGE_KEY_DTYPE, STAGE_STATS_DTYPE, FLOW_ID_DTYPE, FLOW_STATE_DTYPE, QUEUE_ID_DTYPE, \
+    QUEUE_INFO_DTYPE, MAP_KEY_DTYPE, MAPS, HIST_KEY_DTYPE, PEAK_KEY_DTYPE, QUEUE_PEAK_DTYPE, \
+    merge_peaks
+from libs.xdp_code.maps import BPFMap, bpf_error
+from libs.xdp_code.syscall import BPF_XDP_CPUMAP
+from libs.xdp_code.handoff import Handoff
+from libs.xdp_code.extensions import load_extension
+
+
+MAX_STEER_CPUS = 256  # Same as BPFCollector.c
+MAX_EVENT_RINGS = 8  # Same as BPFCollector.c
+STEER_QUEUE_SIZE = 2048  # Packets queued per CPU of the cpumap
+
+EventBatch = load_extension("EventRecords").EventBatch
+
+# Indexes in tb_stages. Same as BPFCollector.c
+STAGE_COUNTERS, STAGE_THRESHOLDS, STAGE_HISTOGRAMS, STAGE_QUEUE_PEAKS = 1, 2, 3, 4
+
+
+def _print_events(batch):
+    """ Print the events of a batch for debug """
+    for name, events in [("flow", batch.flows), ("hop latency", batch.hop_latencies),
+                         ("queue occupancy", batch.queue_occups)]:
+        for event in events:
+            print("*********")
+            print(f"{name}: " + ", ".join(f"{field}: {event[field]}"
+                                         for field in events.dtype.names
+                                         if field != "reserved"))
+
+
+def _sum_tx_info(values):
+    """ Sum the per-CPU copies of a struct egr_tx_info_t """
+    total = type(values[0])()
+    for value in values:
+        total.octets += value.octets
+        total.packets += value.packets
+    return total
 
 
 class Collector(object):
@@ -52,58 +71,166 @@ class Collector(object):
     def __init__(self,
                  int_dst_port,
                  debug_int,
-                 host,
-                 database,
                  flags,
                  hop_latency,
                  flow_latency,
                  queue_occ,
                  flow_keepalive,
                  enable_counter_mode,
-                 enable_threshold_mode):
+                 enable_threshold_mode,
+                 outputs,
+                 cache_dir=None,
+                 pinned_maps=None,
+                 steer_cpus=None,
+                 stage_stats=False,
+                 map_sizes=None,
+                 map_stats=False,
+                 latency_hist=False,
+                 latency_hist_width=0,
+                 queue_peaks=False,
+                 event_rings=1):
 
         super(Collector, self).__init__()
 
         self.int_dst_port = int_dst_port
-        self.hop_latency = hop_latency
-        self.flow_latency = flow_latency
-        self.queue_occ = queue_occ
-        self.flow_keepalive = flow_keepalive * 1000000000  # convert to nanoseconds
-        self.enable_counter_mode = enable_counter_mode
-        self.enable_threshold_mode = enable_threshold_mode
 
         self.ifaces = set()
 
-        #load eBPF program
-        self.bpf_collector = BPF(src_file="./libs/xdp_code/BPFCollector.c", debug=0,
-                                 cflags=["-w",
-                                         "-D_INT_DST_PORT=%s" % self.int_dst_port,
-                                         "-D_HOP_LATENCY=%s" % self.hop_latency,
-                                         "-D_FLOW_LATENCY=%s" % self.flow_latency,
-                                         "-D_QUEUE_OCCUP=%s" % self.queue_occ,
-                                         "-D_TIME_GAP_W=%s" % self.flow_keepalive,
-                                         "-D_ENABLE_COUNTER_MODE=%s" % self.enable_counter_mode,
-                                         "-D_ENABLE_THRESHOLD_MODE=%s" % self.enable_threshold_mode
-                                         ])
-
-        self.fn_collector = self.bpf_collector.load_func("collector", BPF.XDP)
+        # Reports are steered to these CPUs by steer(), collector() running from a cpumap
+        self.steer_cpus = list(steer_cpus or [])
+        if any(cpu < 0 or cpu >= MAX_STEER_CPUS for cpu in self.steer_cpus):
+            raise ValueError(f"Reports can only be steered to CPUs 0 to {MAX_STEER_CPUS - 1}")
+        # Events are spread over event_rings ring buffers by flow
+        if event_rings < 1 or event_rings > MAX_EVENT_RINGS:
+            raise ValueError(f"Events can only be sent to 1 to {MAX_EVENT_RINGS} ring buffers")
+        self.event_rings = event_rings
+        # Stages are tail-called by collector(), so they share its attach type
+        attach_type = BPF_XDP_CPUMAP if self.steer_cpus else -1
+        self.functions = {name: (BPF.XDP, attach_type)
+                          for name in ["collector", "counters", "thresholds", "histograms",
+                                       "queue_peaks"]}
+        if self.steer_cpus:
+            self.functions["steer"] = (BPF.XDP, -1)
+
+        #load eBPF program. The bytecode is cached in cache_dir, so restarts don't compile it.
+        cflags = ["-w", "-D_INT_DST_PORT=%s" % self.int_dst_port,
+                  "-DEVENT_RINGS=%d" % self.event_rings]
+        # Map entries, e.g. {"tb_flow": 100000} becomes -DTB_FLOW_SIZE=100000
+        for name, size in sorted((map_sizes or {}).items()):
+            cflags.append("-D%s_SIZE=%d" % (name.upper(), size))
+        pinned = None
+        if pinned_maps is not None:
+            pinned_maps.prepare()
+            cflags += pinned_maps.cflags
+            pinned = pinned_maps.paths
+
+        self.bpf_collector = bpf_cache.load("./libs/xdp_code/BPFCollector.c", cflags,
+                                            self.functions, cache_dir, pinned)
+
+        # Maps pinned by a build with other map sizes can't be reused
+        if pinned_maps is not None:
+            mismatches = pinned_maps.mismatches(bpf_cache.table_specs(self.bpf_collector))
+            if mismatches:
+                print(f"Pinned maps {', '.join(mismatches)} don't match the XDP code. "
+                      "Starting with new maps.")
+                self.bpf_collector.cleanup()
+                pinned_maps.clear()
+                self.bpf_collector = bpf_cache.load("./libs/xdp_code/BPFCollector.c", cflags,
+                                                    self.functions, cache_dir, pinned)
+
+        self.fn_collector = self._load_func("collector")
+        self.fn_counters = self._load_func("counters")
+        self.fn_thresholds = self._load_func("thresholds")
+        self.fn_histograms = self._load_func("histograms")
+        self.fn_queue_peaks = self._load_func("queue_peaks")
+        self.fn_steer = None
+        if self.steer_cpus:
+            self.fn_steer = self._load_func("steer")
+            tb_steer_cpus = self.bpf_collector.get_table("tb_steer_cpus")
+            tb_cpumap = self.bpf_collector.get_table("tb_cpumap")
+            for index, cpu in enumerate(self.steer_cpus):
+                tb_steer_cpus[tb_steer_cpus.Key(index)] = tb_steer_cpus.Leaf(cpu)
+                tb_cpumap[tb_cpumap.Key(cpu)] = tb_cpumap.Leaf(STEER_QUEUE_SIZE,
+                                                               self.fn_collector.fd)
+
+        # Thresholds are read by the XDP code on every packet, and modes are the stages
+        # collector() tail-calls
+        self.stage_stats = stage_stats
+        # Hop latency histograms are counted whatever the mode
+        self.latency_hist = latency_hist
+        self.latency_hist_width = latency_hist_width
+        # Queue peaks replace the queue occupancy events of threshold mode
+        self.queue_peaks = queue_peaks
+        self.tb_config = self.bpf_collector.get_table("tb_config")
+        self.tb_stages = self.bpf_collector.get_table("tb_stages")
+        self.configure(hop_latency, flow_latency, queue_occ, flow_keepalive,
+                       enable_counter_mode, enable_threshold_mode)
 
         # Table maps
         self.tb_flow  = self.bpf_collector.get_table("tb_flow")
         self.tb_queue = self.bpf_collector.get_table("tb_queue")
-        self.tb_egr   = self.bpf_collector.get_table("tb_egr_vlan_util")
-        self.tb_egr_q   = self.bpf_collector.get_table("tb_egr_queue_util")
-        self.tb_egr_int   = self.bpf_collector.get_table("tb_egr_interface_util")
-
-        self.packet_counter_all = self.bpf_collector.get_table("counter_all")
-        self.packet_counter_int = self.bpf_collector.get_table("counter_int")
-        self.packet_counter_errors = self.bpf_collector.get_table("counter_error")
-        self.packet_counter_missing = self.bpf_collector.get_table("counter_missing")
-
-        self.lock = threading.Lock()
-        self.event_data = []
-
-        self.client = InfluxDBClient(host=host, database=database)
+        # Counters are per CPU. Reading an entry returns the sum of all CPUs.
+        get_table = self.bpf_collector.get_table
+        self.tb_egr   = get_table("tb_egr_vlan_util", reducer=_sum_tx_info)
+        self.tb_egr_q   = get_table("tb_egr_queue_util", reducer=_sum_tx_info)
+        self.tb_egr_int   = get_table("tb_egr_interface_util", reducer=_sum_tx_info)
+
+        self.packet_counter_all = get_table("counter_all", reducer=sum)
+        self.packet_counter_int = get_table("counter_int", reducer=sum)
+        self.packet_counter_errors = get_table("counter_error", reducer=sum)
+        self.packet_counter_missing = get_table("counter_missing", reducer=sum)
+
+        # Snapshots of whole maps for the export
+        self.egr_vlan_map = BPFMap(self.tb_egr, EGR_VLAN_KEY_DTYPE, TX_INFO_DTYPE)
+        self.egr_queue_map = BPFMap(self.tb_egr_q, EGR_QUEUE_KEY_DTYPE, TX_INFO_DTYPE)
+        self.egr_interface_map = BPFMap(self.tb_egr_int, EGR_INTERFACE_KEY_DTYPE, TX_INFO_DTYPE)
+        self.counter_maps = [BPFMap(table, COUNTER_KEY_DTYPE, COUNTER_DTYPE)
+                             for table in [self.packet_counter_all, self.packet_counter_int,
+                                           self.packet_counter_errors,
+                                           self.packet_counter_missing]]
+        # Runs and time of each stage, when measured
+        self.stage_map = None
+        if self.stage_stats:
+            self.stage_map = BPFMap(get_table("tb_stage_stats"), STAGE_KEY_DTYPE,
+                                    STAGE_STATS_DTYPE)
+        # Bucket counts of the hop latency histograms, when counted
+        self.latency_hist_map = None
+        if self.latency_hist:
+            self.latency_hist_map = BPFMap(get_table("tb_latency_hist"), HIST_KEY_DTYPE,
+                                           COUNTER_DTYPE)
+        # Queue occupancy per interval, when tracked. Interval 0 marks the zeroed copies of
+        # the other CPUs, so intervals start at 1.
+        self.queue_peaks_map = None
+        self.tb_peak_interval = get_table("tb_peak_interval")
+        self.peak_interval = 1
+        if self.queue_peaks:
+            self.queue_peaks_map = BPFMap(get_table("tb_queue_peaks"), PEAK_KEY_DTYPE,
+                                          QUEUE_PEAK_DTYPE)
+            self._set_peak_interval(self.peak_interval)
+        # Entries of the maps filled by the XDP code, in the order of MAPS, when measured.
+        # Pinned maps may start with entries.
+        self.usage_maps = None
+        if map_stats:
+            self.usage_maps = [BPFMap(self.tb_flow, FLOW_ID_DTYPE, FLOW_STATE_DTYPE),
+                               BPFMap(self.tb_queue, QUEUE_ID_DTYPE, QUEUE_INFO_DTYPE),
+                               BPFMap(self.tb_egr, EGR_VLAN_KEY_DTYPE, TX_INFO_DTYPE),
+                               BPFMap(self.tb_egr_q, EGR_QUEUE_KEY_DTYPE, TX_INFO_DTYPE),
+                               BPFMap(self.tb_egr_int, EGR_INTERFACE_KEY_DTYPE, TX_INFO_DTYPE),
+                               BPFMap(get_table("tb_latency_hist"), HIST_KEY_DTYPE,
+                                      COUNTER_DTYPE),
+                               BPFMap(get_table("tb_queue_peaks"), PEAK_KEY_DTYPE,
+                                      QUEUE_PEAK_DTYPE)]
+            self.inserts_map = BPFMap(get_table("tb_map_inserts"), MAP_KEY_DTYPE, COUNTER_DTYPE)
+            self.initial_entries = [len(table.snapshot()[0]) for table in self.usage_maps]
+
+        # Encoded points are handed to the destinations, one bytes object per batch
+        self.outputs = outputs
+        self.handoff = None
+        self.clock = KernelClock()
+
+        self.batch = EventBatch()
+        self._ringbuf = None
+        self._ringbuf_cb = None
 
         self.debug_mode = debug_int
 
@@ -111,12 +238,86 @@ class Collector(object):
         # Refer to issue #31
         self.flags = 4
 
+    def configure(self, hop_latency, flow_latency, queue_occ, flow_keepalive,
+                  enable_counter_mode, enable_threshold_mode):
+        """ Set the thresholds and modes. They apply to the next packet, without reloading the
+        XDP code. Modes install or remove their stage. """
+        self.hop_latency = hop_latency
+        self.flow_latency = flow_latency
+        self.queue_occ = queue_occ
+        self.flow_keepalive = flow_keepalive * 1000000000  # convert to nanoseconds
+        self.enable_counter_mode = enable_counter_mode
+        self.enable_threshold_mode = enable_threshold_mode
+
+        self.tb_config[self.tb_config.Key(0)] = self.tb_config.Leaf(self.hop_latency,
+                                                                    self.flow_latency,
+                                                                    self.queue_occ,
+                                                                    self.flow_keepalive,
+                                                                    len(self.steer_cpus),
+                                                                    int(self.stage_stats),
+                                                                    self.latency_hist_width,
+                                                                    int(not self.queue_peaks))
+        self._set_stage(STAGE_COUNTERS, self.fn_counters if enable_counter_mode else None)
+        self._set_stage(STAGE_THRESHOLDS, self.fn_thresholds if enable_threshold_mode else None)
+        self._set_stage(STAGE_HISTOGRAMS, self.fn_histograms if self.latency_hist else None)
+        self._set_stage(STAGE_QUEUE_PEAKS, self.fn_queue_peaks if self.queue_peaks else None)
+
+    def map_usage(self):
+        """ (map, entries, max entries, inserts, evictions) of the maps filled by the XDP code.
+        Inserts and evictions are counted since the collector started. LRU maps evict entries
+        silently, so evictions are the entries inserted that are gone. """
+        keys, values = self.inserts_map.snapshot()
+        inserts = np.zeros(len(MAPS), dtype=np.uint64)
+        valid = keys["map"] < len(MAPS)
+        inserts[keys["map"][valid]] = values["value"][valid]
+
+        usage = []
+        for index, table in enumerate(self.usage_maps):
+            entries = len(table.snapshot()[0])
+            evictions = max(0, self.initial_entries[index] + int(inserts[index]) - entries)
+            usage.append((MAPS[index], entries, table.max_entries, int(inserts[index]), evictions))
+        return usage
+
+    def read_queue_peaks(self):
+        """ Start a new interval of the queue peaks and return the queues seen during the
+        previous one: keys, maximum, minimum, and last occupancy. The XDP code writes the other
+        slot of tb_queue_peaks meanwhile. """
+        interval = self.peak_interval
+        self.peak_interval = interval % 0xffffffff + 1
+        self._set_peak_interval(self.peak_interval)
+        keys, values = self.queue_peaks_map.snapshot(per_cpu=True)
+        return merge_peaks(keys, values, interval)
+
+    def _set_peak_interval(self, interval):
+        """ Set the interval written by the queue peaks stage """
+        table = self.tb_peak_interval
+        table[table.Key(0)] = table.Leaf(interval)
+
+    def _set_stage(self, index, function):
+        """ Install function as the stage at index of tb_stages, or remove the stage if
+        function is None """
+        key = self.tb_stages.Key(index)
+        if function is not None:
+            self.tb_stages[key] = self.tb_stages.Leaf(function.fd)
+            return
+        ret = lib.bpf_delete_elem(self.tb_stages.map_fd, ct.byref(key))
+        if ret < 0 and bpf_error(ret) != errno.ENOENT:  # ENOENT: not installed
+            raise OSError(bpf_error(ret), f"Could not remove stage {index}")
+
+    def _load_func(self, name):
+        """ Load a function with its program and attach types """
+        prog_type, attach_type = self.functions[name]
+        if attach_type < 0:
+            return self.bpf_collector.load_func(name, prog_type)
+        return self.bpf_collector.load_func(name, prog_type, attach_type=attach_type)
+
     def attach_iface(self, iface):
         if iface in self.ifaces:
             print("already attached to ", iface)
             return
 
-        self.bpf_collector.attach_xdp(iface, self.fn_collector, self.flags)
+        # With steering, collector() runs from the cpumap instead of the interface
+        self.bpf_collector.attach_xdp(iface, self.fn_steer or self.fn_collector, self.flags)
         self.ifaces.add(iface)
 
     def detach_iface(self, iface):
@@ -131,75 +332,52 @@ class Collector(object):
             self.bpf_collector.remove_xdp(iface, 0)
         self.ifaces = set()
 
-    def poll_events(self):
-        self.bpf_collector.kprobe_poll()
-
-    def open_events(self):
-
-        def _process_event(ctx, data, size):
-
-            cdef uintptr_t _event =  <uintptr_t> data
-            cdef Event *event = <Event*> _event
-
-            # Print event data for debug
-            if self.debug_mode==1:
-                print("*********")
-                print(f"seqNumber: {event.seqNumber}")
-                print(f"vlan: {event.vlan_id}")
-                print(f"num_INT_hop: {event.num_INT_hop}")
-                print(f"sw_ids: {event.sw_ids}")
-                print(f"in_port_ids: {event.in_port_ids}")
-                print(f"e_port_ids: {event.e_port_ids}")
-                print(f"hop_latencie: {event.hop_latencies}")
-                print(f"queue_ids: {event.queue_ids}")
-                print(f"queue_occups: {event.queue_occups}")
-                print(f"ingr_times: {event.ingr_times}")
-                print(f"egr_times: {event.egr_times}")
-                print(f"flow_latency: {event.flow_latency}")
-                print(f"flow_sink_time: {event.flow_sink_time}")
-                print("is_n_flow: %s" % format(event.is_n_flow, 'b').zfill(16))
-                print("is_flow: %s" % format(event.is_flow, 'b').zfill(16))
-                print("is_hop_latency: %s" % format(event.is_hop_latency, 'b').zfill(16))
-                print("is_queue_occup: %s" % format(event.is_queue_occup, 'b').zfill(16))
-                print(f"metadata: {event.metadata}")
-
-            event_data = []
-
-            if event.is_n_flow or event.is_flow:
-
-                path_str = ",".join(str(f"{event.in_port_ids[i]}-{event.sw_ids[i]}-{event.e_port_ids[i]}.{event.queue_ids[i]}") for i in reversed(range(0, event.num_INT_hop)))
-
-                event_data.append(u"flow_lat_path\\,vlan_id=%d\\,sw_id=%i\\,port=%d flow_latency=%d,path=\"%s\" %s" % (
-                                    event.vlan_id,
-                                    event.sw_ids[0],
-                                    event.e_port_ids[0],
-                                    event.flow_latency,
-                                    path_str,
-                                    int(round(time.time() * 1000000000))))
-
-            if event.is_hop_latency:
-                for i in range(0, event.num_INT_hop):
-                    if (event.is_hop_latency >> i) & 0x01:
-                        event_data.append(u"latency\\,vlan\\=%d\\,sw\\=%i\\,port\\=%d\\,hop\\=%i value=%d %s" %
-                                          (event.vlan_id,
-                                           event.sw_ids[0],
-                                           event.e_port_ids[0],
-                                           event.sw_ids[i],
-                                           event.hop_latencies[i],
-                                           int(round(time.time() * 1000000000))))
-
-            if event.is_queue_occup:
-                for i in range(0, event.num_INT_hop):
-                    if (event.is_queue_occup >> i) & 0x01:
-                        event_data.append(u"queue_occ\\,sw\\=%d\\,port\\=%d\\,queue\\=%d value=%d %s" %
-                                          (event.sw_ids[i],
-                                           event.e_port_ids[i],
-                                           event.queue_ids[i],
-                                           event.queue_occups[i],
-                                           int(round(time.time() * 1000000000))))
-
-            self.lock.acquire()
-            self.event_data.extend(event_data)
-            self.lock.release()
-
-        self.bpf_collector["events"].open_perf_buffer(_process_event, page_cnt=1024)
+    def poll_events(self, timeout=100):
+        """ Wait up to timeout ms for events and process everything available. Events are
+        copied to a preallocated batch by the ring buffer callback and processed once the
+        batch is full or the ring buffer is empty. """
+        lib.bpf_poll_ringbuf(self._ringbuf, timeout)
+        while self.batch.is_full():
+            self._process_batch()
+            lib.bpf_consume_ringbuf(self._ringbuf)
+        self._process_batch()
+
+    def _process_batch(self):
+        """ Convert all events in the batch to InfluxDB lines and hand them to the outputs """
+        batch = self.batch
+        if not len(batch):
+            return
+
+        if self.debug_mode==1:
+            _print_events(batch)
+
+        # Points are timestamped with the packet arrival time recorded by the XDP code.
+        self.clock.maybe_resync()
+        encode_events(batch.flows, batch.hop_latencies, batch.queue_occups, self.handoff.lines,
+                      self.clock.to_wall)
+        batch.clear()
+        self.handoff.publish()
+
+    def open_events(self, ring=0):
+        """ Attach the batch to the events ring buffer of index ring. Encoded events are
+        handed to the outputs by a thread. """
+        self.handoff = Handoff(self.outputs)
+        self.handoff.start()
+
+        # Use the callback type declared by bcc, pointing to a C function instead of Python.
+        ringbuf_cb_type = lib.bpf_new_ringbuf.argtypes[1]
+        self._ringbuf_cb = ringbuf_cb_type(self.batch.callback)
+        name = "events%d" % ring if ring else "events"
+        self._ringbuf = lib.bpf_new_ringbuf(self.bpf_collector[name].map_fd,
+                                            self._ringbuf_cb,
+                                            self.batch.ctx)
+        if not self._ringbuf:
+            raise Exception("Could not open the events ring buffer")
+
+    def close_events(self):
+        """ Release the ring buffer consumer and hand the last events to the outputs """
+        if self._ringbuf:
+            lib.bpf_free_ringbuf(self._ringbuf)
+            self._ringbuf = None
+        if self.handoff is not None:
+            self.handoff.close()
@@ -0,0 +1,235 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" InfluxDB line protocol encoder. Points of a whole batch are written to a single growable
+buffer that is sent as is as the HTTP body. """
+
+cimport cython
+import numpy as np
+from libc.stdint cimport uint64_t
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcpy
+
+
+cdef enum: __MAX_DIGITS = 20  # digits of 2 ** 64
+cdef enum: __MAX_SERIES = 65536  # distinct series keys kept per buffer
+
+# "00", "01", ..., "99": integers are converted two digits at a time
+cdef const char *_DIGIT_PAIRS = (b"00010203040506070809101112131415161718192021222324"
+                                 b"25262728293031323334353637383940414243444546474849"
+                                 b"50515253545556575859606162636465666768697071727374"
+                                 b"75767778798081828384858687888990919293949596979899")
+
+
+cdef inline uint64_t _mix(uint64_t h, uint64_t value):
+    h ^= value + <uint64_t> 0x9e3779b97f4a7c15 + (h << 6) + (h >> 2)
+    return h
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _tag_sets(tags):
+    """ Group the rows of a 2D uint64 array. Returns the first row of each distinct tag set and
+    the tag set of each row. Open addressing keeps it in C, without sorting. """
+    cdef const uint64_t[:, ::1] _tags = tags
+    cdef Py_ssize_t n = _tags.shape[0], width = _tags.shape[1]
+    cdef Py_ssize_t size = 1, count = 0, i, j, slot, first
+    cdef uint64_t h
+    cdef bint same
+
+    while size < 2 * n:
+        size <<= 1
+
+    slots = np.full(size, -1, dtype=np.intp)
+    first_rows = np.empty(n, dtype=np.intp)
+    rows = np.empty(n, dtype=np.intp)
+    cdef Py_ssize_t[::1] _slots = slots
+    cdef Py_ssize_t[::1] _first_rows = first_rows
+    cdef Py_ssize_t[::1] _rows = rows
+
+    for i in range(n):
+        h = 0
+        for j in range(width):
+            h = _mix(h, _tags[i, j])
+        slot = <Py_ssize_t> (h & <uint64_t> (size - 1))
+
+        while _slots[slot] != -1:
+            first = _first_rows[_slots[slot]]
+            same = True
+            for j in range(width):
+                if _tags[first, j] != _tags[i, j]:
+                    same = False
+                    break
+            if same:
+                break
+            slot = (slot + 1) & (size - 1)
+
+        if _slots[slot] == -1:
+            _slots[slot] = count
+            _first_rows[count] = i
+            count += 1
+        _rows[i] = _slots[slot]
+
+    return first_rows[:count], rows
+
+
+cdef class LineBuffer:
+    """ Growable buffer of InfluxDB points. Series keys are formatted and escaped once per
+    distinct tag set and reused by all points of that series. """
+
+    cdef char *data
+    cdef Py_ssize_t length
+    cdef Py_ssize_t capacity
+    cdef readonly Py_ssize_t points
+    cdef dict series
+
+    def __cinit__(self, Py_ssize_t capacity=65536):
+        self.data = <char*> malloc(capacity)
+        if self.data == NULL:
+            raise MemoryError()
+        self.capacity = capacity
+        self.length = 0
+        self.points = 0
+        self.series = {}
+
+    def __dealloc__(self):
+        free(self.data)
+
+    def __len__(self):
+        return self.length
+
+    cdef int _reserve(self, Py_ssize_t size) except -1:
+        cdef Py_ssize_t capacity = self.capacity
+        cdef char *data
+
+        if self.length + size <= capacity:
+            return 0
+
+        while capacity < self.length + size:
+            capacity *= 2
+        data = <char*> realloc(self.data, capacity)
+        if data == NULL:
+            raise MemoryError()
+        self.data = data
+        self.capacity = capacity
+        return 0
+
+    cdef inline void _write(self, const char *src, Py_ssize_t size):
+        memcpy(self.data + self.length, src, size)
+        self.length += size
+
+    cdef inline void _write_char(self, char c):
+        self.data[self.length] = c
+        self.length += 1
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef inline void _write_uint(self, uint64_t value):
+        cdef char digits[__MAX_DIGITS]
+        cdef int i = __MAX_DIGITS
+        cdef uint64_t pair
+
+        while value >= 100:
+            pair = (value % 100) * 2
+            value //= 100
+            i -= 2
+            digits[i] = _DIGIT_PAIRS[pair]
+            digits[i + 1] = _DIGIT_PAIRS[pair + 1]
+        if value >= 10:
+            i -= 2
+            digits[i] = _DIGIT_PAIRS[value * 2]
+            digits[i + 1] = _DIGIT_PAIRS[value * 2 + 1]
+        else:
+            i -= 1
+            digits[i] = <char> (48 + value)
+        self._write(&digits[i], __MAX_DIGITS - i)
+
+    cpdef bytes series_key(self, str template, tuple tags):
+        """ Series key template % tags, encoded once per distinct tag set """
+        key = (template, tags)
+        series = self.series.get(key)
+        if series is None:
+            if len(self.series) >= __MAX_SERIES:
+                self.series.clear()
+            series = (template % tags).encode()
+            self.series[key] = series
+        return series
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def add_points(self, str template, tuple tag_columns, bytes field, values, timestamps=None):
+        """ Add one point per row. template % row of tag_columns is the series key, values and
+        timestamps are integer columns. Without timestamps, InfluxDB uses its own clock. """
+        cdef const uint64_t[::1] _values = np.ascontiguousarray(values, dtype=np.uint64)
+        cdef const uint64_t[::1] _timestamps
+        cdef Py_ssize_t[::1] _rows
+        cdef bint has_timestamps = timestamps is not None
+        cdef Py_ssize_t i, n = _values.shape[0]
+        cdef Py_ssize_t field_len = len(field)
+        cdef list keys
+        cdef bytes series
+
+        if n == 0:
+            return
+        if has_timestamps:
+            _timestamps = np.ascontiguousarray(timestamps, dtype=np.uint64)
+            if _timestamps.shape[0] != n:
+                raise ValueError("values and timestamps have different lengths")
+
+        tags = np.empty((n, len(tag_columns)), dtype=np.uint64)
+        for i, column in enumerate(tag_columns):
+            tags[:, i] = column
+        first_rows, rows = _tag_sets(tags)
+        _rows = rows
+        keys = [self.series_key(template, tuple(tag_set)) for tag_set in tags[first_rows].tolist()]
+
+        for i in range(n):
+            series = <bytes> keys[_rows[i]]
+            # series, space, field, '=', value, space, timestamp, newline
+            self._reserve(len(series) + field_len + 2 * __MAX_DIGITS + 4)
+            self._write(series, len(series))
+            self._write_char(b' ')
+            self._write(field, field_len)
+            self._write_char(b'=')
+            self._write_uint(_values[i])
+            if has_timestamps:
+                self._write_char(b' ')
+                self._write_uint(_timestamps[i])
+            self._write_char(b'\n')
+
+        self.points += n
+
+    def add_line(self, bytes series, bytes fields, uint64_t timestamp):
+        """ Add a point with an already encoded field set """
+        self._reserve(len(series) + len(fields) + __MAX_DIGITS + 3)
+        self._write(series, len(series))
+        self._write_char(b' ')
+        self._write(fields, len(fields))
+        self._write_char(b' ')
+        self._write_uint(timestamp)
+        self._write_char(b'\n')
+        self.points += 1
+
+    def getvalue(self):
+        """ Encoded points """
+        return self.data[:self.length]
+
+    def clear(self):
+        """ Drop the points but keep the memory and the series keys """
+        self.length = 0
+        self.points = 0
@@ -0,0 +1,269 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module caches the programs compiled by bcc, so instances don't run clang when they
+start. A cache entry has the bytecode of the functions and the specs of the maps, keyed by the
+source, the cflags, the kernel and the bcc version. A warm start creates new maps, replaces the
+map file descriptors in the bytecode, and loads it. Anything going wrong falls back to
+compiling the source. """
+
+import ctypes as ct
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import bcc
+from bcc import BPF
+from bcc.libbcc import lib
+from bcc.utils import get_possible_cpus
+from libs.xdp_code.bytecode import map_fds, relocate_maps
+from libs.xdp_code.maps import PERCPU_TYPES, bpf_error, open_pinned, pin
+from libs.xdp_code.syscall import prog_load
+
+
+CACHE_VERSION = 2
+
+# Not declared by all bcc versions
+lib.bpf_table_key_size_id.restype = ct.c_size_t
+lib.bpf_table_key_size_id.argtypes = [ct.c_void_p, ct.c_ulonglong]
+lib.bpf_table_leaf_size_id.restype = ct.c_size_t
+lib.bpf_table_leaf_size_id.argtypes = [ct.c_void_p, ct.c_ulonglong]
+lib.bcc_create_map.restype = ct.c_int
+lib.bcc_create_map.argtypes = [ct.c_int, ct.c_char_p, ct.c_int, ct.c_int, ct.c_int, ct.c_int]
+
+
+def cache_key(src_file, cflags):
+    """ Hash of everything the bytecode depends on """
+    digest = hashlib.sha256()
+    with open(src_file, "rb") as source:
+        digest.update(source.read())
+    for part in [CACHE_VERSION, platform.release(), getattr(bcc, "__version__", ""), *cflags]:
+        digest.update(str(part).encode() + b"\0")
+    return digest.hexdigest()
+
+
+def table_specs(bpf):
+    """ Specs of the maps of a BPF compiled by bcc or of a CachedBPF """
+    if isinstance(bpf, CachedBPF):
+        return bpf.entry["tables"]
+
+    module = bpf.module
+    tables = []
+    for i in range(lib.bpf_num_tables(module)):
+        tables.append({"name": lib.bpf_table_name(module, i).decode(),
+                       "fd": lib.bpf_table_fd_id(module, i),
+                       "type": lib.bpf_table_type_id(module, i),
+                       "key_size": lib.bpf_table_key_size_id(module, i),
+                       "leaf_size": lib.bpf_table_leaf_size_id(module, i),
+                       "max_entries": lib.bpf_table_max_entries_id(module, i),
+                       "flags": lib.bpf_table_flags_id(module, i),
+                       "key_desc": lib.bpf_table_key_desc_id(module, i).decode(),
+                       "leaf_desc": lib.bpf_table_leaf_desc_id(module, i).decode()})
+    return tables
+
+
+def dump(bpf, functions, pinned=None):
+    """ Cache entry of a BPF compiled by bcc. functions is {name: (prog_type, attach_type)},
+    pinned is {table name: path} of the maps pinned by the program. """
+    module = bpf.module
+    tables = table_specs(bpf)
+    for table in tables:
+        table["pinned"] = (pinned or {}).get(table["name"])
+
+    entry = {"version": CACHE_VERSION,
+             "license": lib.bpf_module_license(module).decode(),
+             "kern_version": lib.bpf_module_kern_version(module),
+             "tables": tables,
+             "functions": {}}
+
+    known = {table["fd"] for table in tables}
+    for name, (prog_type, _) in functions.items():
+        insns = bpf.dump_func(name)
+        if not set(map_fds(insns)) <= known:
+            raise ValueError(f"{name} references maps that can't be cached")
+        entry["functions"][name] = {"prog_type": prog_type, "insns": insns.hex()}
+    return entry
+
+
+class CachedTable(object):
+    """ Map created from a cache entry. Only single lookups and updates are supported; whole
+    maps are read with BPFMap. Per-CPU lookups return the list of values, or their reduction
+    if a reducer is given. """
+
+    def __init__(self, name, map_fd, ttype, keytype, leaftype, max_entries, reducer=None):
+        self.name = name
+        self.map_fd = map_fd
+        self.ttype = ttype
+        self.Key = keytype  # pylint: disable=C0103
+        self.Leaf = leaftype  # pylint: disable=C0103
+        self.max_entries = max_entries
+        self.reducer = reducer
+        self.cpus = len(get_possible_cpus()) if ttype in PERCPU_TYPES else 1
+
+    def __getitem__(self, key):
+        leaf = (self.Leaf * self.cpus)()
+        if lib.bpf_lookup_elem(self.map_fd, ct.byref(key), ct.byref(leaf)) < 0:
+            raise KeyError(key)
+        if self.cpus == 1:
+            return leaf[0]
+        return self.reducer(leaf) if self.reducer else list(leaf)
+
+    def __setitem__(self, key, leaf):
+        if self.cpus > 1:
+            raise TypeError(f"Per-CPU map {self.name} can't be updated with a single value")
+        ret = lib.bpf_update_elem(self.map_fd, ct.byref(key), ct.byref(leaf), 0)
+        if ret < 0:
+            raise OSError(bpf_error(ret), f"Could not update {self.name}")
+
+
+class CachedBPF(object):
+    """ The part of bcc.BPF used by the collector, created from a cache entry instead of the
+    source """
+
+    attach_xdp = staticmethod(BPF.attach_xdp)
+    remove_xdp = staticmethod(BPF.remove_xdp)
+
+    def __init__(self, entry):
+        if entry.get("version") != CACHE_VERSION:
+            raise ValueError("Cache entry of another version")
+
+        self.entry = entry
+        self.specs = {table["name"]: table for table in entry["tables"]}
+        self.fds = {}  # fd when compiled: fd of the new map
+        self.tables = {}
+        self.funcs = {}
+
+        try:
+            for table in entry["tables"]:
+                self.fds[table["fd"]] = self._open_map(table)
+        except OSError:
+            self.cleanup()
+            raise
+
+    @staticmethod
+    def _open_map(table):
+        """ Reuse the pinned map of table or create a new one, pinning it if needed """
+        pinned = table.get("pinned")
+        if pinned and os.path.exists(pinned):
+            return open_pinned(pinned)
+
+        fd = lib.bcc_create_map(table["type"], table["name"].encode(), table["key_size"],
+                                table["leaf_size"], table["max_entries"], table["flags"])
+        if fd < 0:
+            raise OSError(bpf_error(fd), f"Could not create map {table['name']}")
+        if pinned:
+            try:
+                pin(fd, pinned)
+            except OSError:
+                os.close(fd)
+                raise
+        return fd
+
+    def get_table(self, name, reducer=None):
+        """ Table called name """
+        if isinstance(name, bytes):
+            name = name.decode()
+        if name not in self.tables:
+            table = self.specs[name]
+            self.tables[name] = CachedTable(
+                name, self.fds[table["fd"]], table["type"],
+                BPF._decode_table_type(json.loads(table["key_desc"])),  # pylint: disable=W0212
+                BPF._decode_table_type(json.loads(table["leaf_desc"])),  # pylint: disable=W0212
+                table["max_entries"], reducer)
+        return self.tables[name]
+
+    def __getitem__(self, name):
+        return self.get_table(name)
+
+    def load_func(self, name, prog_type, device=None, attach_type=-1):
+        """ Load a function into the kernel with the file descriptors of the new maps """
+        if device is not None:
+            raise ValueError("Offloaded programs can't be loaded from the cache")
+        if name in self.funcs:
+            return self.funcs[name]
+
+        func = self.entry["functions"][name]
+        if func["prog_type"] != prog_type:
+            raise ValueError(f"{name} was cached with another program type")
+
+        insns = relocate_maps(bytes.fromhex(func["insns"]), self.fds)
+        fd = prog_load(prog_type, insns, self.entry["license"], self.entry["kern_version"], name,
+                       max(attach_type, 0))
+
+        self.funcs[name] = BPF.Function(self, name, fd)
+        return self.funcs[name]
+
+    def cleanup(self):
+        """ Close the programs and the maps """
+        for func in self.funcs.values():
+            os.close(func.fd)
+        for fd in self.fds.values():
+            os.close(fd)
+        self.funcs = {}
+        self.fds = {}
+
+
+def _read_entry(path):
+    try:
+        with open(path, encoding="utf-8") as entry:
+            return json.load(entry)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_entry(path, entry):
+    """ Write the entry atomically, since instances may start at the same time """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as tmp:
+            json.dump(entry, tmp)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+
+def load(src_file, cflags, functions, cache_dir=None, pinned=None):
+    """ Return a CachedBPF if cache_dir has an entry for the source and the cflags, and its
+    functions load. Otherwise, compile the source with bcc and store the result. functions is
+    {name: (prog_type, attach_type)} of the functions to cache, attach_type being -1 for the
+    default. pinned is {table name: path} of the maps the source pins. """
+    if not cache_dir:
+        return BPF(src_file=src_file, debug=0, cflags=cflags)
+
+    path = os.path.join(cache_dir, cache_key(src_file, cflags) + ".json")
+    entry = _read_entry(path)
+    if entry is not None:
+        bpf = None
+        try:
+            bpf = CachedBPF(entry)
+            for name, (prog_type, attach_type) in functions.items():
+                bpf.load_func(name, prog_type, attach_type=attach_type)
+            return bpf
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            print(f"Cached BPF program not loaded ({error}). Compiling {src_file}.")
+            if bpf is not None:
+                bpf.cleanup()
+
+    bpf = BPF(src_file=src_file, debug=0, cflags=cflags)
+    try:
+        _write_entry(path, dump(bpf, functions, pinned))
+    except (OSError, ValueError) as error:
+        print(f"BPF program not cached: {error}")
+    return bpf
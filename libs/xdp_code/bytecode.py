@@ -0,0 +1,59 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module reads and relocates eBPF bytecode. bcc compiles map references to 64-bit loads
+of the map file descriptor, so a compiled program can be loaded again after replacing the file
+descriptors of the old maps with new ones. """
+
+import numpy as np
+
+
+# Same layout as struct bpf_insn. dst_reg and src_reg share a byte, src_reg in the high bits
+# on little-endian hosts.
+INSN_DTYPE = np.dtype([("code", np.uint8), ("regs", np.uint8), ("off", np.int16),
+                       ("imm", np.int32)])
+
+BPF_LD_IMM64 = 0x18  # BPF_LD | BPF_IMM | BPF_DW, takes two instructions
+BPF_PSEUDO_MAP_FD = 1
+
+
+def instructions(insns):
+    """ View of the bytes of a program as an array of instructions """
+    if len(insns) % INSN_DTYPE.itemsize:
+        raise ValueError("Program size isn't a multiple of the instruction size")
+    return np.frombuffer(insns, dtype=INSN_DTYPE)
+
+
+def _map_loads(program):
+    """ Indexes of the instructions loading a map file descriptor """
+    return np.flatnonzero((program["code"] == BPF_LD_IMM64) &
+                          ((program["regs"] >> 4) == BPF_PSEUDO_MAP_FD))
+
+
+def map_fds(insns):
+    """ Map file descriptors referenced by a program, sorted """
+    program = instructions(insns)
+    return sorted(set(program["imm"][_map_loads(program)].tolist()))
+
+
+def relocate_maps(insns, fds):
+    """ Return a copy of the program with the map file descriptors replaced as in fds
+    {old: new}. Raises KeyError if the program references a map missing from fds. """
+    program = instructions(insns).copy()
+    loads = _map_loads(program)
+    program["imm"][loads] = [fds[fd] for fd in program["imm"][loads].tolist()]
+    return program.tobytes()
@@ -0,0 +1,57 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module translates kernel timestamps (bpf_ktime_get_ns) to wall-clock time """
+
+import time
+
+
+class KernelClock(object):
+    """ bpf_ktime_get_ns() reads CLOCK_MONOTONIC. The offset to the wall clock is measured
+    once and re-measured every resync_interval seconds to follow NTP adjustments. """
+
+    def __init__(self, resync_interval=60, samples=5):
+        self.resync_interval = int(resync_interval * 1000000000)
+        self.samples = samples
+        self.offset = 0
+        self.last_sync = 0
+        self.calibrate()
+
+    def calibrate(self):
+        """ Measure the offset between CLOCK_MONOTONIC and CLOCK_REALTIME. The wall clock is read
+        between two monotonic reads and the sample with the shortest window is used. """
+        best_window = None
+        for _ in range(self.samples):
+            before = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+            wall = time.time_ns()
+            after = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+
+            if best_window is None or after - before < best_window:
+                best_window = after - before
+                self.offset = wall - (before + after) // 2
+
+        self.last_sync = after
+
+    def maybe_resync(self):
+        """ Calibrate again if resync_interval has passed """
+        if time.clock_gettime_ns(time.CLOCK_MONOTONIC) - self.last_sync >= self.resync_interval:
+            self.calibrate()
+
+    def to_wall(self, kernel_ns):
+        """ Convert kernel timestamps (an integer or a NumPy int64 array) to nanoseconds since
+        the epoch """
+        return kernel_ns + self.offset
@@ -0,0 +1,180 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module encodes batches of threshold events exported by BPFCollector.c. The event
+records are sorted by type into NumPy structured arrays by EventRecords.pyx, so a whole batch
+is encoded at once. It also has the layouts of the map keys and values read by user space. """
+
+import numpy as np
+
+
+MAX_INT_HOP = 10  # Noviflow only supports reports with 10 metadata
+
+# Same layouts as the event records in BPFCollector.c. Flow records are kept whole; hop
+# latencies and queue occupancies get a row per hop.
+PATH_HOP_DTYPE = np.dtype([("sw_id", np.uint32), ("in_port_id", np.uint16),
+                           ("e_port_id", np.uint16), ("queue_id", np.uint16),
+                           ("reserved", np.uint16)], align=True)
+FLOW_EVENT_DTYPE = np.dtype([
+    ("sink_time", np.uint64),
+    ("last_sw_id", np.uint32),
+    ("flow_latency", np.uint32),
+    ("vlan_id", np.uint16),
+    ("last_egr_id", np.uint16),
+    ("type", np.uint8),
+    ("num_entries", np.uint8),
+    ("reserved", np.uint16),
+    ("path", PATH_HOP_DTYPE, MAX_INT_HOP),
+], align=True)
+HOP_LATENCY_EVENT_DTYPE = np.dtype([("sink_time", np.uint64), ("last_sw_id", np.uint32),
+                                    ("vlan_id", np.uint16), ("last_egr_id", np.uint16),
+                                    ("sw_id", np.uint32), ("hop_latency", np.uint32)],
+                                   align=True)
+QUEUE_OCCUP_EVENT_DTYPE = np.dtype([("sink_time", np.uint64), ("sw_id", np.uint32),
+                                    ("e_port_id", np.uint16), ("queue_id", np.uint16),
+                                    ("occup", np.uint32)], align=True)
+
+# Same layout as the keys and values of the counter maps in BPFCollector.c
+EGR_VLAN_KEY_DTYPE = np.dtype([("sw_id", np.uint32), ("p_id", np.uint16), ("q_id", np.uint16),
+                               ("v_id", np.uint16)], align=True)
+EGR_QUEUE_KEY_DTYPE = np.dtype([("sw_id", np.uint32), ("p_id", np.uint16), ("q_id", np.uint16)],
+                               align=True)
+EGR_INTERFACE_KEY_DTYPE = np.dtype([("sw_id", np.uint32), ("p_id", np.uint16)], align=True)
+TX_INFO_DTYPE = np.dtype([("octets", np.uint64), ("packets", np.uint64)])
+COUNTER_KEY_DTYPE = np.dtype([("type", np.uint64)])
+COUNTER_DTYPE = np.dtype([("value", np.uint64)])
+FLOW_ID_DTYPE = np.dtype([("vlan_id", np.uint16), ("last_sw_id", np.uint32),
+                          ("last_egr_id", np.uint16)], align=True)
+FLOW_STATE_DTYPE = np.dtype([("sw_ids", np.uint32, MAX_INT_HOP),
+                             ("hop_latencies", np.uint32, MAX_INT_HOP),
+                             ("flow_latency", np.uint32), ("flow_sink_time", np.uint64)],
+                            align=True)
+QUEUE_ID_DTYPE = np.dtype([("sw_id", np.uint32), ("p_id", np.uint16), ("q_id", np.uint16)],
+                          align=True)
+QUEUE_INFO_DTYPE = np.dtype([("occup", np.uint16), ("q_time", np.uint64)], align=True)
+HIST_KEY_DTYPE = np.dtype([("sw_id", np.uint32), ("p_id", np.uint16), ("q_id", np.uint16),
+                           ("bucket", np.uint32)], align=True)
+PEAK_KEY_DTYPE = np.dtype([("sw_id", np.uint32), ("p_id", np.uint16), ("q_id", np.uint16),
+                           ("slot", np.uint32)], align=True)
+QUEUE_PEAK_DTYPE = np.dtype([("interval", np.uint32), ("max", np.uint32), ("min", np.uint32),
+                             ("last", np.uint32), ("last_time", np.uint64)], align=True)
+MAP_KEY_DTYPE = np.dtype([("map", np.uint32)])
+STAGE_KEY_DTYPE = np.dtype([("stage", np.uint32)])
+STAGE_STATS_DTYPE = np.dtype([("runs", np.uint64), ("ns", np.uint64)])
+
+# Stages of a report, by index in tb_stages
+STAGES = ("parse", "counters", "thresholds", "histograms", "queue_peaks")
+
+# Maps whose inserts are counted, by index in tb_map_inserts
+MAPS = ("tb_flow", "tb_queue", "tb_egr_vlan_util", "tb_egr_queue_util", "tb_egr_interface_util",
+        "tb_latency_hist", "tb_queue_peaks")
+
+# Series keys. Commas and equal signs are escaped, so tags are part of the measurement name.
+FLOW_LAT_PATH = "flow_lat_path\\,vlan_id=%d\\,sw_id=%i\\,port=%d"
+LATENCY = "latency\\,vlan\\=%d\\,sw\\=%i\\,port\\=%d\\,hop\\=%i"
+QUEUE_OCC = "queue_occ\\,sw\\=%d\\,port\\=%d\\,queue\\=%d"
+INT_REPORTS = "int_reports\\,type\\=%d"
+MAP_SNAPSHOT = "map_snapshot\\,map\\=%s"
+XDP_STAGE = "xdp_stage\\,stage\\=%s"
+MAP_USAGE = "map_usage\\,map\\=%s"
+LATENCY_HIST = "latency_hist\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,bucket\\=%d"
+EVENT_HANDOFF = "event_handoff\\,queue\\=%s"
+QUEUE_PEAK = "queue_peak\\,sw\\=%d\\,port\\=%d\\,queue\\=%d"
+
+# Utilization maps: Collector attribute, key fields, and the series keys of octets, packets,
+# bits per second and packets per second
+UTILIZATION = [
+    ("egr_vlan_map", ("sw_id", "p_id", "q_id", "v_id"),
+     "tx_octs\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,vlan\\=%d",
+     "tx_pkts\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,vlan\\=%d",
+     "tx_bps\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,vlan\\=%d",
+     "tx_pps\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,vlan\\=%d"),
+    ("egr_queue_map", ("sw_id", "p_id", "q_id"),
+     "tx_octs_queue\\,sw\\=%d\\,port\\=%d\\,queue\\=%d",
+     "tx_pkts_queue\\,sw\\=%d\\,port\\=%d\\,queue\\=%d",
+     "tx_bps_queue\\,sw\\=%d\\,port\\=%d\\,queue\\=%d",
+     "tx_pps_queue\\,sw\\=%d\\,port\\=%d\\,queue\\=%d"),
+    ("egr_interface_map", ("sw_id", "p_id"),
+     "tx_octs_int\\,sw\\=%d\\,port\\=%d",
+     "tx_pkts_int\\,sw\\=%d\\,port\\=%d",
+     "tx_bps_int\\,sw\\=%d\\,port\\=%d",
+     "tx_pps_int\\,sw\\=%d\\,port\\=%d"),
+]
+
+
+def hist_lower_bounds(buckets, width=0):
+    """ Lowest latency in ns of the histogram buckets. Buckets have a width in ns, or are log2
+    buckets if width is 0: bucket 0 is 0 ns and bucket i goes from 2 ** (i - 1) ns. """
+    buckets = np.asarray(buckets, dtype=np.uint64)
+    if width:
+        return buckets * np.uint64(width)
+    shifts = np.maximum(buckets, 1) - np.uint64(1)
+    return np.where(buckets == 0, np.uint64(0), np.uint64(1) << shifts)
+
+
+def merge_peaks(keys, values, interval):
+    """ Queue occupancy during interval from tb_queue_peaks, with per-CPU values shaped
+    (entries, cpus). Copies of other intervals are stale. Returns the keys of the queues seen
+    during interval, and their maximum, minimum, and last occupancy over all CPUs. """
+    current = (values["interval"] == interval) & (keys["slot"] == interval % 2)[:, None]
+    seen = current.any(axis=1)
+    keys, values, current = keys[seen], values[seen], current[seen]
+
+    maximum = np.where(current, values["max"], 0).max(axis=1)
+    minimum = np.where(current, values["min"], np.iinfo(np.uint32).max).min(axis=1)
+    last_cpu = np.where(current, values["last_time"].astype(np.int64), -1).argmax(axis=1)
+    last = values["last"][np.arange(len(keys)), last_cpu]
+    return keys, maximum, minimum, last
+
+
+def sum_cpus(values):
+    """ Sum the per-CPU copies of map values, shaped (entries, cpus), field by field """
+    total = np.empty(values.shape[0], dtype=values.dtype)
+    for field in values.dtype.names:
+        total[field] = values[field].sum(axis=1, dtype=np.uint64)
+    return total
+
+
+def flow_points(flows):
+    """ Columns for flow_lat_path: vlan, sw, port, flow latency and path """
+    paths = []
+    for num_hop, path in zip(flows["num_entries"].tolist(), flows["path"].tolist()):
+        paths.append(",".join(f"{in_port}-{sw_id}-{e_port}.{queue}"
+                              for sw_id, in_port, e_port, queue, _ in reversed(path[:num_hop])))
+
+    return flows["vlan_id"], flows["last_sw_id"], flows["last_egr_id"], flows["flow_latency"], paths
+
+
+def encode_events(flows, hop_latencies, queue_occups, lines, to_wall):
+    """ Encode a batch of events into the LineBuffer lines. to_wall converts the packet
+    arrival times of the XDP code to timestamps. """
+    vlans, sws, ports, latencies, paths = flow_points(flows)
+    timestamps = to_wall(flows["sink_time"].astype(np.int64))
+    for vlan, sw, port, latency, path, ts in zip(vlans.tolist(), sws.tolist(), ports.tolist(),
+                                                 latencies.tolist(), paths, timestamps.tolist()):
+        series = lines.series_key(FLOW_LAT_PATH, (vlan, sw, port))
+        lines.add_line(series, b'flow_latency=%d,path="%s"' % (latency, path.encode()), ts)
+
+    lines.add_points(LATENCY, (hop_latencies["vlan_id"], hop_latencies["last_sw_id"],
+                               hop_latencies["last_egr_id"], hop_latencies["sw_id"]),
+                     b"value", hop_latencies["hop_latency"],
+                     to_wall(hop_latencies["sink_time"].astype(np.int64)))
+
+    lines.add_points(QUEUE_OCC, (queue_occups["sw_id"], queue_occups["e_port_id"],
+                                 queue_occups["queue_id"]),
+                     b"value", queue_occups["occup"],
+                     to_wall(queue_occups["sink_time"].astype(np.int64)))
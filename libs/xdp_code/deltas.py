@@ -0,0 +1,104 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module compares consecutive snapshots of a counter map, so only the series that
+changed are exported. Keys are matched with NumPy, comparing their raw bytes. """
+
+import numpy as np
+
+
+class SnapshotDelta(object):
+    """ Previous snapshot of a map. Every refresh_interval seconds, all series are exported even
+    if they didn't change. A refresh_interval of 0 exports all series every time. """
+
+    def __init__(self, refresh_interval=60.0):
+        self.refresh_interval = refresh_interval
+        self.keys = None
+        self.values = None
+        self.time = None
+        self.last_refresh = None
+
+    def update(self, keys, values, now):
+        """ Compare a snapshot taken at now (ns) with the previous one and keep it.
+
+        Returns the indexes of the entries to export, the previous values of all entries (zero
+        for new entries), and the seconds since the previous snapshot (None for the first). """
+        previous = np.zeros(len(values), dtype=values.dtype)
+        elapsed = None
+
+        if self.keys is not None and len(self.keys) and len(keys):
+            width = keys.dtype.itemsize
+            both = np.concatenate([self.keys.view(f"V{width}"), keys.view(f"V{width}")])
+            _, inverse = np.unique(both, return_inverse=True)
+            inverse = inverse.reshape(-1)
+
+            # Row of each key in the previous snapshot, -1 if it wasn't there
+            rows = np.full(len(both), -1, dtype=np.intp)
+            rows[inverse[:len(self.keys)]] = np.arange(len(self.keys))
+            rows = rows[inverse[len(self.keys):]]
+            found = rows >= 0
+            previous[found] = self.values[rows[found]]
+        else:
+            found = np.zeros(len(keys), dtype=bool)
+
+        if self.time is not None:
+            elapsed = (now - self.time) / 1e9
+
+        if self.refresh_interval <= 0 or self.last_refresh is None or \
+                now - self.last_refresh >= self.refresh_interval * 1e9:
+            self.last_refresh = now
+            export = np.arange(len(keys))
+        else:
+            changed = ~found
+            for field in values.dtype.names:
+                changed |= values[field] != previous[field]
+            export = np.nonzero(changed)[0]
+
+        # The snapshot arrays are reused by the next snapshot
+        self.keys = keys.copy()
+        self.values = values.copy()
+        self.time = now
+        return export, previous, elapsed
+
+
+def rate(values, previous, elapsed, scale=1):
+    """ Per-second rate of a counter. A counter lower than before was reset, e.g. evicted and
+    created again, so its whole value is the increment. """
+    values = values.astype(np.uint64)
+    previous = previous.astype(np.uint64)
+    increment = np.where(values >= previous, values - previous, values)
+    return (increment * scale / elapsed).astype(np.uint64)
+
+
+def encode_utilization(lines, delta, utilization, keys, values, now, rates=False):
+    """ Encode the counters of a snapshot of a utilization map that changed since the previous
+    one, or all of them on full refreshes, timestamped now. utilization is an entry of
+    UTILIZATION. With rates, bits and packets per second are encoded too. """
+    _, fields, octets, packets, bps, pps = utilization
+    export, previous, elapsed = delta.update(keys, values, now)
+    keys, values, previous = keys[export], values[export], previous[export]
+
+    tags = tuple(keys[field] for field in fields)
+    timestamps = np.full(len(keys), now, dtype=np.uint64)
+    lines.add_points(octets, tags, b"value", values["octets"], timestamps)
+    lines.add_points(packets, tags, b"value", values["packets"], timestamps)
+
+    if rates and elapsed:
+        lines.add_points(bps, tags, b"value",
+                         rate(values["octets"], previous["octets"], elapsed, 8), timestamps)
+        lines.add_points(pps, tags, b"value",
+                         rate(values["packets"], previous["packets"], elapsed), timestamps)
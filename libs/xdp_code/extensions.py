@@ -0,0 +1,64 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module imports the Cython extensions. Extensions built ahead of time with
+
+    python setup.py build_ext --inplace
+
+are used when available. Otherwise, they are compiled by pyximport on first import. """
+
+import importlib
+import importlib.util
+import os
+import sys
+
+
+# Cython modules of this package
+EXTENSIONS = ["EventRecords", "InDBCollector", "LineProtocol"]
+
+
+def is_built(name):
+    """ True if the extension was built and is newer than its source """
+    spec = importlib.util.find_spec(f"{__package__}.{name}")
+    if spec is None or not spec.origin:
+        return False
+    source = os.path.join(os.path.dirname(__file__), name + ".pyx")
+    return os.path.getmtime(spec.origin) >= os.path.getmtime(source)
+
+
+def load_extension(name):
+    """ Import the extension called name. Extensions are built ahead of time by setup.py; if
+    one wasn't built or is older than its source, it is compiled by pyximport instead. The import
+    system prefers a built extension to pyximport, even an outdated one, so outdated extensions
+    are loaded from their source explicitly. """
+    fullname = f"{__package__}.{name}"
+    if fullname in sys.modules or is_built(name):
+        return importlib.import_module(fullname)
+
+    import pyximport  # pylint: disable=C0415
+    pyximport.install()
+    finder = next(finder for finder in sys.meta_path
+                  if isinstance(finder, pyximport.PyxImportMetaFinder))
+    spec = finder.find_spec(fullname, [os.path.dirname(__file__)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[fullname] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[fullname]
+        raise
+    return module
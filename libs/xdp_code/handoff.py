@@ -0,0 +1,113 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module hands encoded events from the poll loop to the destinations. The poll loop
+encodes into preallocated LineBuffers and publishes them without taking a lock, so it isn't
+held by the buffers of the destinations while a large write is prepared. """
+
+import threading
+from libs.xdp_code.extensions import load_extension
+
+
+LineBuffer = load_extension("LineProtocol").LineBuffer  # pylint: disable=C0103
+
+
+class Handoff(object):
+    """ Single-producer, single-consumer ring of LineBuffers. The producer encodes into lines
+    and publishes them; a thread puts the published buffers to outputs and gives them back.
+    Only the producer moves head and only the consumer moves tail, so the buffers from tail to
+    head belong to the consumer and the one at head to the producer. When no buffer is free,
+    the producer keeps appending to its buffer. """
+
+    def __init__(self, outputs, slots=8, interval=0.1):
+        if slots < 2:
+            raise ValueError("A handoff needs at least 2 slots")
+        self.outputs = outputs
+        self.slots = slots
+        self.interval = interval
+        self.buffers = [LineBuffer() for _ in range(slots)]
+        self.head = 0  # Buffers published
+        self.tail = 0  # Buffers put to outputs
+
+        # Gauges: the most buffers waiting since the last read, and the times the producer
+        # found no free buffer
+        self.max_depth = 0
+        self.stalls = 0
+
+        self.ready = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name="handoff", daemon=True)
+
+    @property
+    def lines(self):
+        """ Buffer of the producer """
+        return self.buffers[self.head % self.slots]
+
+    @property
+    def depth(self):
+        """ Buffers waiting for the consumer """
+        return self.head - self.tail
+
+    def gauges(self):
+        """ (depth, max depth, stalls). The max depth restarts from the current depth. """
+        depth = self.depth
+        max_depth, self.max_depth = max(self.max_depth, depth), depth
+        return depth, max_depth, self.stalls
+
+    def start(self):
+        """ Start the consumer """
+        self.thread.start()
+
+    def publish(self):
+        """ Hand lines to the consumer, unless no buffer is free. Producer side. """
+        if not self.lines.points:
+            return
+        if self.head - self.tail >= self.slots - 1:
+            self.stalls += 1
+            return
+
+        self.head += 1
+        depth = self.head - self.tail
+        self.max_depth = max(self.max_depth, depth)
+        # The consumer drains everything it sees, so it only waits when it was empty
+        if depth == 1:
+            self.ready.set()
+
+    def _run(self):
+        while True:
+            self.ready.wait(self.interval)
+            self.ready.clear()
+            stopping = self.stopping
+            while self.tail < self.head:
+                lines = self.buffers[self.tail % self.slots]
+                self.outputs.put(lines.getvalue(), lines.points)
+                lines.clear()
+                self.tail += 1
+            if stopping:
+                break
+
+    def close(self):
+        """ Put everything published, then the buffer of the producer. Called by the producer
+        once it is done. """
+        self.stopping = True
+        self.ready.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        lines = self.lines
+        if lines.points:
+            self.outputs.put(lines.getvalue(), lines.points)
+            lines.clear()
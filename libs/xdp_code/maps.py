@@ -0,0 +1,184 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module reads whole BPF maps with batched lookups. Keys and values are copied by the
+kernel into preallocated NumPy arrays, so a snapshot costs a few syscalls instead of one or two
+per key. Kernels without batched lookups fall back to walking the keys. """
+
+import ctypes as ct
+import errno
+import time
+import numpy as np
+from bcc.libbcc import lib
+from bcc.table import BPF_MAP_TYPE_PERCPU_HASH, BPF_MAP_TYPE_PERCPU_ARRAY, \
+    BPF_MAP_TYPE_LRU_PERCPU_HASH
+from bcc.utils import get_possible_cpus
+from libs.xdp_code.decoder import sum_cpus
+
+
+PERCPU_TYPES = (BPF_MAP_TYPE_PERCPU_HASH, BPF_MAP_TYPE_PERCPU_ARRAY,
+                BPF_MAP_TYPE_LRU_PERCPU_HASH)
+
+# Not declared by all bcc versions
+lib.bpf_obj_get.restype = ct.c_int
+lib.bpf_obj_get.argtypes = [ct.c_char_p]
+lib.bpf_obj_pin.restype = ct.c_int
+lib.bpf_obj_pin.argtypes = [ct.c_int, ct.c_char_p]
+lib.bpf_obj_get_info.restype = ct.c_int
+lib.bpf_obj_get_info.argtypes = [ct.c_int, ct.c_void_p, ct.POINTER(ct.c_uint32)]
+
+
+class MapInfo(ct.Structure):
+    """ First fields of struct bpf_map_info. The kernel fills what fits. """
+    _fields_ = [("type", ct.c_uint32), ("id", ct.c_uint32), ("key_size", ct.c_uint32),
+                ("value_size", ct.c_uint32), ("max_entries", ct.c_uint32),
+                ("map_flags", ct.c_uint32), ("name", ct.c_char * 16)]
+
+
+def bpf_error(ret):
+    """ errno of a failed libbcc call """
+    return -ret if ret < -1 else ct.get_errno()
+
+
+def map_info(fd):
+    """ MapInfo of the map fd """
+    info = MapInfo()
+    size = ct.c_uint32(ct.sizeof(info))
+    ret = lib.bpf_obj_get_info(fd, ct.byref(info), ct.byref(size))
+    if ret < 0:
+        raise OSError(bpf_error(ret), "Could not get map info")
+    return info
+
+
+def open_pinned(path):
+    """ File descriptor of the map pinned at path """
+    fd = lib.bpf_obj_get(path.encode())
+    if fd < 0:
+        raise OSError(bpf_error(fd), f"Could not open pinned map {path}")
+    return fd
+
+
+def pin(fd, path):
+    """ Pin the map fd at path """
+    ret = lib.bpf_obj_pin(fd, path.encode())
+    if ret < 0:
+        raise OSError(bpf_error(ret), f"Could not pin map at {path}")
+
+
+class BPFMap(object):
+    """ Snapshots of a BPF map opened by bcc. key_dtype and value_dtype must have the same
+    layout as the C structs. Per-CPU values are summed. """
+
+    def __init__(self, table, key_dtype, value_dtype):
+        if key_dtype.itemsize != ct.sizeof(table.Key):
+            raise ValueError(f"Key dtype doesn't match the key of {table.name}")
+
+        self.name = table.name.decode() if isinstance(table.name, bytes) else table.name
+        self.fd = table.map_fd
+        self.max_entries = table.max_entries
+        self.percpu = table.ttype in PERCPU_TYPES
+        self.cpus = len(get_possible_cpus()) if self.percpu else 1
+
+        # The kernel copies per-CPU values rounded up to 8 bytes
+        if self.percpu and value_dtype.itemsize % 8:
+            raise ValueError(f"Per-CPU values of {self.name} must be a multiple of 8 bytes")
+
+        self.keys = np.zeros(self.max_entries, dtype=key_dtype)
+        self.values = np.zeros((self.max_entries, self.cpus), dtype=value_dtype)
+        self.key_size = key_dtype.itemsize
+        self.value_size = value_dtype.itemsize * self.cpus
+
+        # Hash maps use a 32-bit bucket index as batch position; arrays use a key
+        self._in_batch = ct.create_string_buffer(max(8, self.key_size))
+        self._out_batch = ct.create_string_buffer(max(8, self.key_size))
+        self._in_batch_p = ct.cast(self._in_batch, ct.POINTER(ct.c_uint32))
+        self._out_batch_p = ct.cast(self._out_batch, ct.POINTER(ct.c_uint32))
+        self._count = ct.c_uint32()
+        self._count_p = ct.pointer(self._count)
+
+        self.batched = hasattr(lib, "bpf_lookup_batch")
+        self.duration = 0.0  # seconds taken by the last snapshot
+        self.entries = 0
+
+    def snapshot(self, per_cpu=False):
+        """ Return the keys and the values of all entries. The arrays are reused by the next
+        snapshot. With per_cpu, values of per-CPU maps aren't summed and are shaped
+        (entries, cpus). """
+        start = time.perf_counter()
+        count = None
+        if self.batched:
+            count = self._lookup_batch()
+        if count is None:
+            count = self._lookup_keys()
+
+        self.entries = count
+        keys = self.keys[:count]
+        values = self.values[:count]
+        if not per_cpu:
+            values = sum_cpus(values) if self.percpu else values[:, 0]
+        self.duration = time.perf_counter() - start
+        return keys, values
+
+    def _lookup_batch(self):
+        """ Copy the map with bpf_map_lookup_batch. Returns the number of entries, or None if
+        the kernel doesn't support it. """
+        keys = self.keys.ctypes.data
+        values = self.values.ctypes.data
+        total = 0
+        in_batch = None
+
+        while total < self.max_entries:
+            self._count.value = self.max_entries - total
+            ret = lib.bpf_lookup_batch(self.fd, in_batch, self._out_batch_p,
+                                       ct.c_void_p(keys + total * self.key_size),
+                                       ct.c_void_p(values + total * self.value_size),
+                                       self._count_p)
+            total += self._count.value
+            if ret < 0:
+                error = bpf_error(ret)
+                if error == errno.ENOENT:
+                    break  # Last batch
+                if total == 0 and error in (errno.EINVAL, errno.ENOTSUP, errno.ENOSYS):
+                    self.batched = False
+                    return None
+                raise OSError(error, f"Batched lookup of {self.name} failed")
+
+            ct.memmove(self._in_batch, self._out_batch, len(self._in_batch))
+            in_batch = self._in_batch_p
+
+        return total
+
+    def _lookup_keys(self):
+        """ Copy the map key by key """
+        keys = self.keys.ctypes.data
+        values = self.values.ctypes.data
+        total = 0
+        prev = None
+
+        while total < self.max_entries:
+            key = ct.c_void_p(keys + total * self.key_size)
+            if lib.bpf_get_next_key(self.fd, prev, key) < 0:
+                break
+            ct.memmove(self._in_batch, key, self.key_size)
+            prev = self._in_batch
+            # Entries may be deleted between both calls, e.g. LRU evictions. The slot is then
+            # reused by the next key.
+            value = ct.c_void_p(values + total * self.value_size)
+            if lib.bpf_lookup_elem(self.fd, key, value) == 0:
+                total += 1
+
+        return total
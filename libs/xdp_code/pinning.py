@@ -0,0 +1,84 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module keeps the maps holding flow state and counters pinned in bpffs, so a restarted
+instance reuses them instead of starting empty. Maps are pinned in a directory per instance and
+per map layout, so an upgrade changing MAP_LAYOUT starts with new maps. Pinned maps that don't
+match the compiled program anyway, e.g. after changing a map size, are replaced too. """
+
+import os
+import shutil
+from libs.xdp_code.maps import map_info, open_pinned
+
+
+# Version of the pinned maps. Bump it when a pinned map, its key or its value changes.
+MAP_LAYOUT = 3
+
+# Maps of BPFCollector.c declared with STATE_TABLE
+PINNED_MAPS = ["tb_flow", "tb_queue", "tb_egr_vlan_util", "tb_egr_queue_util",
+               "tb_egr_interface_util", "tb_report_seq", "counter_all", "counter_int",
+               "counter_error", "counter_missing"]
+
+
+class PinnedMaps(object):
+    """ Pinned maps of an instance, in root/instance/v<MAP_LAYOUT> """
+
+    def __init__(self, root, instance):
+        self.root = os.path.join(root, instance)
+        self.directory = os.path.join(self.root, f"v{MAP_LAYOUT}")
+
+    @property
+    def paths(self):
+        """ {map name: pinned path} """
+        return {name: os.path.join(self.directory, name) for name in PINNED_MAPS}
+
+    @property
+    def cflags(self):
+        """ Flags telling BPFCollector.c where to pin its maps """
+        return [f'-D_PIN_DIR="{self.directory}"']
+
+    def prepare(self):
+        """ Create the directory and unpin the maps of other layouts """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path != self.directory and name.startswith("v") and os.path.isdir(path):
+                print(f"Unpinning maps of layout {name}")
+                shutil.rmtree(path, ignore_errors=True)
+
+    def mismatches(self, tables):
+        """ Names of the pinned maps that differ from the table specs of bpf_cache """
+        names = []
+        for table in tables:
+            path = self.paths.get(table["name"])
+            if path is None or not os.path.exists(path):
+                continue
+            fd = open_pinned(path)
+            try:
+                info = map_info(fd)
+            finally:
+                os.close(fd)
+            if (info.type, info.key_size, info.value_size, info.max_entries) != \
+                    (table["type"], table["key_size"], table["leaf_size"], table["max_entries"]):
+                names.append(table["name"])
+        return names
+
+    def clear(self):
+        """ Unpin the maps, so the next load creates new ones """
+        for path in self.paths.values():
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,100 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module calls the bpf() system call directly, for commands whose libbcc wrappers differ
+between bcc versions. Structures are the prefixes of union bpf_attr used by each command; the
+kernel zero-extends them. """
+
+import ctypes as ct
+import os
+import platform
+
+
+# bpf() system call number per architecture
+SYS_BPF = {"x86_64": 321, "aarch64": 280, "i386": 357, "i686": 357, "armv7l": 386,
+           "ppc64le": 361, "s390x": 351}
+
+BPF_PROG_LOAD = 5
+BPF_PROG_TEST_RUN = 10
+
+BPF_XDP_CPUMAP = 35  # enum bpf_attach_type
+
+_libc = ct.CDLL(None, use_errno=True)
+_libc.syscall.restype = ct.c_long
+
+
+class ProgLoadAttr(ct.Structure):
+    """ union bpf_attr for BPF_PROG_LOAD """
+    _fields_ = [("prog_type", ct.c_uint32), ("insn_cnt", ct.c_uint32), ("insns", ct.c_uint64),
+                ("license", ct.c_uint64), ("log_level", ct.c_uint32), ("log_size", ct.c_uint32),
+                ("log_buf", ct.c_uint64), ("kern_version", ct.c_uint32),
+                ("prog_flags", ct.c_uint32), ("prog_name", ct.c_char * 16),
+                ("prog_ifindex", ct.c_uint32), ("expected_attach_type", ct.c_uint32)]
+
+
+class ProgTestRunAttr(ct.Structure):
+    """ union bpf_attr for BPF_PROG_TEST_RUN """
+    _fields_ = [("prog_fd", ct.c_uint32), ("retval", ct.c_uint32),
+                ("data_size_in", ct.c_uint32), ("data_size_out", ct.c_uint32),
+                ("data_in", ct.c_uint64), ("data_out", ct.c_uint64), ("repeat", ct.c_uint32),
+                ("duration", ct.c_uint32)]
+
+
+def bpf(cmd, attr):
+    """ Call bpf(cmd, &attr, sizeof(attr)). Raises OSError on failure. """
+    number = SYS_BPF.get(platform.machine())
+    if number is None:
+        raise OSError(f"bpf() system call number unknown on {platform.machine()}")
+    ret = _libc.syscall(number, cmd, ct.byref(attr), ct.sizeof(attr))
+    if ret < 0:
+        error = ct.get_errno()
+        raise OSError(error, os.strerror(error))
+    return ret
+
+
+def prog_load(prog_type, insns, license_, kern_version, name, expected_attach_type=0):
+    """ Load a program and return its file descriptor. insns is the bytecode. """
+    insns_buf = ct.create_string_buffer(bytes(insns), len(insns))
+    license_buf = ct.create_string_buffer(license_.encode())
+    log_buf = ct.create_string_buffer(65536)
+    attr = ProgLoadAttr(prog_type=prog_type, insn_cnt=len(insns) // 8,
+                        insns=ct.addressof(insns_buf), license=ct.addressof(license_buf),
+                        kern_version=kern_version, prog_name=name.encode()[:15],
+                        expected_attach_type=expected_attach_type)
+    try:
+        return bpf(BPF_PROG_LOAD, attr)
+    except OSError:
+        # Load again with the verifier log to tell why
+        attr.log_level = 1
+        attr.log_size = len(log_buf)
+        attr.log_buf = ct.addressof(log_buf)
+        try:
+            return bpf(BPF_PROG_LOAD, attr)
+        except OSError as error:
+            log = log_buf.value.decode(errors="replace").strip().splitlines()
+            raise OSError(error.errno, f"{name} rejected: {log[-1] if log else error}") \
+                from None
+
+
+def prog_test_run(prog_fd, data, repeat=1):
+    """ Run a program on the packet data repeat times without attaching it. Returns its return
+    value and the mean run time in nanoseconds, as measured by the kernel. """
+    data_buf = ct.create_string_buffer(bytes(data), len(data))
+    attr = ProgTestRunAttr(prog_fd=prog_fd, data_size_in=len(data),
+                           data_in=ct.addressof(data_buf), repeat=repeat)
+    bpf(BPF_PROG_TEST_RUN, attr)
+    return attr.retval, attr.duration
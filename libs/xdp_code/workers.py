@@ -0,0 +1,167 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module drains the event ring buffers of a collector with worker processes, one per
+ring buffer. Workers decode and encode their own events and hand the encoded lines to the
+collector process through shared memory, so threshold events use more than one core. """
+
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from multiprocessing import shared_memory
+
+
+class ShmChannel(object):
+    """ Batches handed from a worker process to the collector process in slots of shared
+    memory. Only slot numbers, lengths, and points go through queues. A worker waits for a free
+    slot when the collector process is behind. """
+
+    def __init__(self, context, slots=8, slot_size=4 * 1024 * 1024):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.free = context.Queue()
+        self.full = context.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def put(self, data, points):
+        """ Hand a batch of lines to the collector process, in several slots if it doesn't fit
+        in one. Same signature as Outputs.put, so the collector of a worker writes here. """
+        view = memoryview(data)
+        start = 0
+        while start < len(data):
+            end = start + self.slot_size
+            if end < len(data):
+                # Split on a line, one point per line
+                end = data.rfind(b"\n", start, end) + 1
+                if end <= start:
+                    raise ValueError(f"Line longer than the slots of {self.slot_size} bytes")
+                chunk_points = data.count(b"\n", start, end)
+            else:
+                end = len(data)
+                chunk_points = points if start == 0 else data.count(b"\n", start, end)
+
+            slot = self.free.get()
+            offset = slot * self.slot_size
+            self.memory.buf[offset:offset + end - start] = view[start:end]
+            self.full.put((slot, end - start, chunk_points))
+            start = end
+
+    @property
+    def depth(self):
+        """ Batches waiting for the collector process. Approximate. """
+        return self.full.qsize()
+
+    def close(self):
+        """ Tell the collector process that the worker is done """
+        self.full.put(None)
+
+    def get(self, timeout=None):
+        """ Next batch as (data, points), or None once the worker is done. Raises queue.Empty
+        after timeout seconds. """
+        item = self.full.get(timeout=timeout)
+        if item is None:
+            return None
+        slot, length, points = item
+        offset = slot * self.slot_size
+        data = bytes(self.memory.buf[offset:offset + length])
+        self.free.put(slot)
+        return data, points
+
+    def release(self):
+        """ Free the shared memory """
+        self.memory.close()
+        self.memory.unlink()
+
+
+def _drain_ring(collector, ring, cpu, channel, stop_flag):
+    """ Main loop of a worker process """
+    # Workers are stopped by the collector process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+
+    collector.outputs = channel
+    collector.open_events(ring)
+    try:
+        while not stop_flag.is_set():
+            collector.poll_events()
+    finally:
+        collector.close_events()
+        channel.close()
+
+
+class EventWorkers(object):
+    """ Worker processes draining the event ring buffers of collector, the one of index i by
+    worker i. Worker i is pinned to cpus[i % len(cpus)] when cpus are given. A thread of the
+    collector process forwards the batches of each worker to outputs. """
+
+    def __init__(self, collector, outputs, workers, cpus=None, interval=0.1):
+        self.outputs = outputs
+        self.interval = interval
+        # Forked workers inherit the XDP code and its maps
+        context = multiprocessing.get_context("fork")
+        self.stop_flag = context.Event()
+        self.channels = [ShmChannel(context) for _ in range(workers)]
+        self.processes = [context.Process(target=_drain_ring, name=f"events-{ring}", daemon=True,
+                                          args=(collector, ring,
+                                                cpus[ring % len(cpus)] if cpus else None,
+                                                channel, self.stop_flag))
+                          for ring, channel in enumerate(self.channels)]
+        self.readers = [threading.Thread(target=self._forward, args=(channel, process),
+                                         name=f"events-{ring}-reader", daemon=True)
+                        for ring, (channel, process) in enumerate(zip(self.channels,
+                                                                      self.processes))]
+
+    def start(self):
+        """ Start the workers, then the threads reading them. Workers are forked before any
+        thread is started by this object. """
+        for process in self.processes:
+            process.start()
+        for reader in self.readers:
+            reader.start()
+
+    def _forward(self, channel, process):
+        """ Forward the batches of a worker until it is done or dies """
+        while True:
+            try:
+                batch = channel.get(timeout=self.interval)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                continue
+            if batch is None:
+                break
+            self.outputs.put(*batch)
+
+    def depths(self):
+        """ Batches waiting for the collector process, per worker """
+        return [channel.depth for channel in self.channels]
+
+    def close(self):
+        """ Stop the workers once they processed what they polled """
+        self.stop_flag.set()
+        for process in self.processes:
+            process.join()
+        for reader in self.readers:
+            reader.join()
+        for channel in self.channels:
+            channel.release()
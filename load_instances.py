@@ -19,13 +19,64 @@
 It is called by int_collector.py via Popen as an independent process. """
 
 import os
+import signal
 import threading
 import time
 import sys
-import pyximport; pyximport.install()  # pylint: disable=C0321
-import libs.xdp_code.InDBCollector as Collector  # pylint: disable=C0413
+import numpy as np
+from libs.xdp_code.extensions import load_extension
+Collector = load_extension("InDBCollector")  # pylint: disable=C0103
+LineBuffer = load_extension("LineProtocol").LineBuffer  # pylint: disable=C0103
+from libs.xdp_code.decoder import EVENT_HANDOFF, INT_REPORTS, LATENCY_HIST, MAP_SNAPSHOT, \
+    MAP_USAGE, QUEUE_PEAK, STAGES, UTILIZATION, XDP_STAGE, \
+    hist_lower_bounds  # pylint: disable=C0413
+from libs.xdp_code.deltas import SnapshotDelta, encode_utilization  # pylint: disable=C0413
 from libs.input.parse_cli import parse_params  # pylint: disable=C0413
-import influxdb
+from libs.input.config_class import parse_cpu_list  # pylint: disable=C0413
+from libs.input.read_configs import read_config_section  # pylint: disable=C0413
+from libs.destinations import create  # pylint: disable=C0413
+from libs.destinations.event_buffer import EventBuffer  # pylint: disable=C0413
+from libs.destinations.outputs import Outputs  # pylint: disable=C0413
+from libs.xdp_code.pinning import PinnedMaps  # pylint: disable=C0413
+from libs.xdp_code.workers import EventWorkers  # pylint: disable=C0413
+
+
+# Types of the event_buffer measurement
+BUFFERED, DROPPED, SPILLED, REPLAYED = range(4)
+
+
+def destination_options(name, args):
+    """ Options of the destination called name """
+    if name == "influxdb":
+        return {"host": args.host, "database": args.db_name, "drop_db": args.drop_db,
+                "workers": args.db_workers, "batch_size": args.db_batch_size,
+                "batch_age": args.db_batch_age, "use_gzip": args.db_gzip,
+                "retries": args.db_retries, "timeout": args.db_timeout}
+    if name == "influxdb-udp":
+        return {"host": args.host, "port": args.udp_port}
+    if name == "file":
+        return {"path": args.file_path}
+    if name == "kafka":
+        return {"servers": args.kafka_servers or f"{args.host}:9092", "topic": args.kafka_topic}
+    return {}
+
+
+def create_outputs(args):
+    """ Destinations from the CLI, each with its own buffer """
+    outputs = Outputs(batch_size=args.db_batch_size, interval=args.save_interval,
+                      debug=args.debug_mode == 2)
+
+    for name in args.destinations.split(","):
+        # Memory is bounded; what happens when it is full depends on the policy.
+        buffer = EventBuffer(max_bytes=args.buffer_max_mb * 1024 * 1024,
+                             max_points=args.buffer_max_points,
+                             policy=args.buffer_policy,
+                             spill_dir=os.path.join(args.buffer_spill_dir,
+                                                    args.name or args.interface, name),
+                             spill_max_bytes=args.buffer_spill_max_mb * 1024 * 1024)
+        outputs.add(name, create(name, **destination_options(name, args)), buffer)
+
+    return outputs
 
 
 def start_collector_instance():
@@ -36,129 +87,209 @@ def start_collector_instance():
     enable_threshold = 0 if args.run_counter_mode_only else 1
     enable_counter = 0 if args.run_threshold_mode_only else 1
 
+    # Points are written to all destinations in parallel
+    outputs = create_outputs(args)
+
+    # Flows and counters survive restarts in pinned maps
+    pinned_maps = PinnedMaps(args.pin_dir, args.name or args.interface) if args.pin_maps else None
+
+    # Reports of a switch are spread over these CPUs instead of the one receiving them
+    steer_cpus = parse_cpu_list(args.steer_cpus) if args.steer_cpus else None
+
     collector = Collector.Collector(int_dst_port=args.int_port,
                                     debug_int=args.debug_mode,
-                                    host=args.host,
-                                    database=args.db_name,
                                     flags=args.xdp_mode,
                                     hop_latency=args.hop_latency,
                                     flow_latency=args.flow_latency,
                                     queue_occ=args.queue_occ,
                                     flow_keepalive=args.flow_keepalive,
                                     enable_counter_mode=enable_counter,
-                                    enable_threshold_mode=enable_threshold)
+                                    enable_threshold_mode=enable_threshold,
+                                    outputs=outputs,
+                                    cache_dir=args.bpf_cache_dir,
+                                    pinned_maps=pinned_maps,
+                                    steer_cpus=steer_cpus,
+                                    stage_stats=args.stage_stats,
+                                    map_sizes={"tb_flow": args.flow_map_size,
+                                               "tb_queue": args.queue_map_size,
+                                               "tb_egr_vlan_util": args.vlan_util_map_size,
+                                               "tb_egr_queue_util": args.queue_util_map_size,
+                                               "tb_egr_interface_util":
+                                                   args.interface_util_map_size},
+                                    map_stats=args.map_stats,
+                                    latency_hist=args.latency_hist,
+                                    latency_hist_width=args.latency_hist_width,
+                                    queue_peaks=args.queue_peaks,
+                                    event_rings=max(1, args.event_workers))
 
     # Attach XDP code to interface
     if args.promisc:
         _ = os.system(f"ifconfig {args.interface} promisc")
     collector.attach_iface(args.interface)
 
-    # Test if db_name is not found,create one
-    if args.db_name not in collector.client.get_list_database():
-        collector.client.create_database(args.db_name)
-
-    # If db_name is needs to be recreated
-    if args.drop_db:
-        for db_entry in collector.client.get_list_database():
-            if args.db_name in db_entry["name"]:
-                collector.client.drop_database(args.db_name)
-            collector.client.create_database(args.db_name)
-
-    push_stop_flag = threading.Event()
-
-    # A separated thread to push event data to the db_name
-    def _event_push():
-
-        while not push_stop_flag.is_set():
-
-            time.sleep(args.save_interval)
-
-            collector.lock.acquire()
-            data = collector.event_data
-            collector.event_data = []
-            collector.lock.release()
+    # Events are drained by worker processes, forked before any thread is started
+    event_workers = None
+    if args.event_workers:
+        worker_cpus = parse_cpu_list(args.event_worker_cpus) if args.event_worker_cpus else None
+        event_workers = EventWorkers(collector, outputs, args.event_workers, worker_cpus)
+        event_workers.start()
 
-            if args.debug_mode == 2:
-                print("Len of events: ", len(data))
-
-            if data:
-                try:
-                    collector.client.write_points(points=data, protocol="line")
-                except influxdb.exceptions.InfluxDBClientError as error:
-                    print(error)
-                    print(len(data))
-
-    event_push = threading.Thread(target=_event_push)
-    event_push.start()
+    outputs.start()
 
     # Collecting and exporting data from tables instead of events.
     gather_stop_flag = threading.Event()
 
     def _gather_counters():
 
+        event_data = LineBuffer()
+        # Buffer series are exported once they are not zero
+        buffer_series = set()
+        deltas = {name: SnapshotDelta(args.counters_refresh) for name, *_ in UTILIZATION}
+        hist_delta = SnapshotDelta(args.counters_refresh)
+
         while not gather_stop_flag.is_set():
 
             time.sleep(args.counters_interval)
-            event_data = []
-
-            for k, v in sorted(collector.packet_counter_all.items()):
-                event_data.append("int_reports\\,type\\=%d value=%d" % (k.value, v.value))
-
-            for k, v in sorted(collector.packet_counter_int.items()):
-                event_data.append("int_reports\\,type\\=%d value=%d" % (k.value, v.value))
-
-            for k, v in sorted(collector.packet_counter_errors.items()):
-                event_data.append("int_reports\\,type\\=%d value=%d" % (k.value, v.value))
-
-            for k, v in sorted(collector.packet_counter_missing.items()):
-                event_data.append("int_reports\\,type\\=%d value=%d" % (k.value, v.value))
-
-            for k, v in collector.tb_egr.items():
-                insert = "tx_octs\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,vlan\\=%d value=%d"
-                event_data.append(insert % (k.sw_id, k.p_id, k.q_id, k.v_id, v.octets))
-                insert = "tx_pkts\\,sw\\=%d\\,port\\=%d\\,queue\\=%d\\,vlan\\=%d value=%d"
-                event_data.append(insert % (k.sw_id, k.p_id, k.q_id, k.v_id, v.packets))
-
-            for k, v in collector.tb_egr_q.items():
-                event_data.append(
-                    "tx_octs_queue\\,sw\\=%d\\,port\\=%d\\,queue\\=%d value=%d" %
-                    (k.sw_id, k.p_id, k.q_id, v.octets))
-                event_data.append(
-                    "tx_pkts_queue\\,sw\\=%d\\,port\\=%d\\,queue\\=%d value=%d" %
-                    (k.sw_id, k.p_id, k.q_id, v.packets))
-
-            for k, v in collector.tb_egr_int.items():
-                event_data.append(
-                    "tx_octs_int\\,sw\\=%d\\,port\\=%d value=%d" %
-                    (k.sw_id, k.p_id, v.octets))
-                event_data.append(
-                    "tx_pkts_int\\,sw\\=%d\\,port\\=%d value=%d" %
-                    (k.sw_id, k.p_id, v.packets))
-
-            if event_data:
-                # TODO: handle timeouts
-                # influxdb.exceptions.InfluxDBServerError: b'{"error":"timeout"}\n'
-                collector.client.write_points(points=event_data, protocol="line")
-            del event_data
+            event_data.clear()
+
+            # Counters are timestamped when read, so they keep their time if spilled to disk
+            now = time.time_ns()
+
+            for counters in collector.counter_maps:
+                keys, values = counters.snapshot()
+                event_data.add_points(INT_REPORTS, (keys["type"],), b"value", values["value"],
+                                      np.full(len(keys), now, dtype=np.uint64))
+
+            # Utilization maps are only updated in counter mode. Only series that changed are
+            # exported, except on full refreshes.
+            utilization_maps = UTILIZATION if collector.enable_counter_mode else []
+            for utilization in utilization_maps:
+                name = utilization[0]
+                table = getattr(collector, name)
+                keys, values = table.snapshot()
+                encode_utilization(event_data, deltas[name], utilization, keys, values, now,
+                                   args.counters_rates)
+
+                # Time taken to read the map, in microseconds
+                event_data.add_line(event_data.series_key(MAP_SNAPSHOT, (table.name,)),
+                                    b"value=%d" % (table.duration * 1e6), now)
+
+            # Bucket counts of the hop latency histograms. Only buckets that changed are exported,
+            # except on full refreshes.
+            if collector.latency_hist_map is not None:
+                keys, values = collector.latency_hist_map.snapshot()
+                export, _, _ = hist_delta.update(keys, values, now)
+                keys, values = keys[export], values[export]
+                buckets = hist_lower_bounds(keys["bucket"], collector.latency_hist_width)
+                event_data.add_points(LATENCY_HIST, (keys["sw_id"], keys["p_id"], keys["q_id"],
+                                                     buckets),
+                                      b"value", values["value"],
+                                      np.full(len(keys), now, dtype=np.uint64))
+
+            # Queue occupancy during the last interval, of the queues seen
+            if collector.queue_peaks_map is not None:
+                keys, maximum, minimum, last = collector.read_queue_peaks()
+                for sw_id, p_id, q_id, max_, min_, last_ in zip(
+                        keys["sw_id"].tolist(), keys["p_id"].tolist(), keys["q_id"].tolist(),
+                        maximum.tolist(), minimum.tolist(), last.tolist()):
+                    event_data.add_line(event_data.series_key(QUEUE_PEAK, (sw_id, p_id, q_id)),
+                                        b"max=%d,min=%d,last=%d" % (max_, min_, last_), now)
+
+            # Runs and nanoseconds spent by each stage of the XDP code, since it was loaded
+            if collector.stage_map is not None:
+                keys, values = collector.stage_map.snapshot()
+                for stage, runs, nanoseconds in zip(keys["stage"], values["runs"], values["ns"]):
+                    if runs and stage < len(STAGES):
+                        event_data.add_line(event_data.series_key(XDP_STAGE, (STAGES[stage],)),
+                                            b"runs=%d,ns=%d" % (runs, nanoseconds), now)
+
+            # Occupancy of the maps, to size them
+            if collector.usage_maps is not None:
+                for name, entries, max_entries, inserts, evictions in collector.map_usage():
+                    event_data.add_line(event_data.series_key(MAP_USAGE, (name,)),
+                                        b"entries=%d,max_entries=%d,inserts=%d,evictions=%d" %
+                                        (entries, max_entries, inserts, evictions), now)
+
+            for sink in outputs.sinks:
+                buffer = sink.buffer
+                for buffer_type, value in [(BUFFERED, buffer.points), (DROPPED, buffer.dropped),
+                                           (SPILLED, buffer.spilled), (REPLAYED, buffer.replayed)]:
+                    series = event_data.series_key("event_buffer\\,destination\\=%s\\,type\\=%d",
+                                                   (sink.name, buffer_type))
+                    if value or series in buffer_series:
+                        buffer_series.add(series)
+                        event_data.add_line(series, b"value=%d" % value, now)
+
+            # Events waiting between the poll loop, or the workers, and the buffers. Like buffer
+            # series, they are exported once they are not zero.
+            handoffs = []
+            if collector.handoff is not None:
+                depth, max_depth, stalls = collector.handoff.gauges()
+                handoffs.append(("poll", b"depth=%d,max_depth=%d,stalls=%d"
+                                 % (depth, max_depth, stalls), max_depth or stalls))
+            if event_workers is not None:
+                for ring, depth in enumerate(event_workers.depths()):
+                    handoffs.append((f"events-{ring}", b"depth=%d" % depth, depth))
+            for queue_name, fields, active in handoffs:
+                series = event_data.series_key(EVENT_HANDOFF, (queue_name,))
+                if active or series in buffer_series:
+                    buffer_series.add(series)
+                    event_data.add_line(series, fields, now)
+
+            outputs.put(event_data.getvalue(), event_data.points)
 
     gather_counters = threading.Thread(target=_gather_counters)
     gather_counters.start()
 
-    # Start polling events
-    collector.open_events()
+    # Thresholds and mode are reloaded from the config file on SIGHUP
+    reload_flag = threading.Event()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_flag.set())
+
+    def _reload():
+
+        if not args.config_file:
+            print("No config file to reload. Thresholds were not changed.")
+            return
+
+        config = read_config_section(args.config_file, args.name)
+        if config is None:
+            print("Reload failed. Thresholds were not changed.")
+            return
+
+        collector.configure(hop_latency=config.hop_latency,
+                            flow_latency=config.flow_latency,
+                            queue_occ=config.queue_occ,
+                            flow_keepalive=config.flow_keepalive,
+                            enable_counter_mode=0 if config.mode == 2 else 1,
+                            enable_threshold_mode=0 if config.mode == 1 else 1)
+        print(f"Reloaded: mode={config.mode} hop_latency={config.hop_latency} "
+              f"flow_latency={config.flow_latency} queue_occ={config.queue_occ} "
+              f"flow_keepalive={config.flow_keepalive}")
+
+    # Start draining the events ring buffer, unless workers do
+    if event_workers is None:
+        collector.open_events()
 
     try:
         while 1:
-            collector.poll_events()
+            if event_workers is None:
+                collector.poll_events()
+            else:
+                reload_flag.wait(0.1)
+            if reload_flag.is_set():
+                reload_flag.clear()
+                _reload()
 
     except KeyboardInterrupt:
         pass
 
     finally:
-        push_stop_flag.set()
         gather_stop_flag.set()
-        event_push.join()
         gather_counters.join()
+        if event_workers is not None:
+            event_workers.close()
+        collector.close_events()
+        outputs.close()
 
         collector.detach_all_iface()
 
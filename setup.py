@@ -0,0 +1,39 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Builds the Cython extensions of the INT Collector with optimizations:
+
+    python setup.py build_ext --inplace
+
+Without them, instances compile the extensions with pyximport when they start. """
+
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+from libs.xdp_code.extensions import EXTENSIONS
+
+
+setup(
+    name="int_collector",
+    version="1.1",
+    ext_modules=cythonize(
+        [Extension(f"libs.xdp_code.{name}", [f"libs/xdp_code/{name}.pyx"],
+                   extra_compile_args=["-O3"])
+         for name in EXTENSIONS],
+        # Bounds checking and wraparound are disabled per function, in the hot loops
+        compiler_directives={"language_level": 3},
+    ),
+)
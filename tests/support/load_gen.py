@@ -0,0 +1,349 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" This module generates INT reports at high rates for load tests. Reports are rendered once per
+hop count with Scapy from the int_specs definitions, then whole batches are copied from these
+templates and their fields are written in place with NumPy. Batches are sent with sendmmsg over
+an AF_PACKET socket, usually to one end of a veth pair, or written to a pcap file.
+
+Traffic is described by phases of a profile and a number of packets:
+
+    python load_gen.py -i veth_0 --rate 2000000 steady:5000000 microburst:1000000:occupancy=9000
+    python load_gen.py -w reports.pcap --hops 1-10 path_flap:100000 damaged:10000:ratio=0.5
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import time
+import numpy as np
+from scapy.all import UDP
+from int_specs import IntMetadata, TelemetryReport
+from packet_gen import generate_metadata, generate_packet
+
+
+MAX_INT_HOP = 10
+HOP_SIZE = 24
+
+# Offsets of the fields of an INT metadata
+SW_ID, INGRESS_ID, EGRESS_ID, HOP_LATENCY, QUEUE, INGRESS_TS, EGRESS_TS = 0, 4, 6, 8, 12, 16, 20
+
+
+class Templates(object):
+    """ Reports with 1 to MAX_INT_HOP hops rendered by Scapy, padded to the longest one """
+
+    def __init__(self, int_port=5900):
+        packets = [generate_packet(out_udp_dst=int_port, int_shim_len=3 + 6 * hops,
+                                   int_md_hdr_rhc=MAX_INT_HOP - hops,
+                                   metadata=[generate_metadata() for _ in range(hops)])
+                   for hops in range(1, MAX_INT_HOP + 1)]
+        raw = [bytes(packet) for packet in packets]
+        self.lengths = np.array([0] + [len(data) for data in raw], dtype=np.uint32)
+        self.packets = np.zeros((MAX_INT_HOP + 1, self.lengths.max()), dtype=np.uint8)
+        for hops, data in enumerate(raw, 1):
+            self.packets[hops, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+
+        # Headers before the hops are the same for all hop counts
+        packet = packets[0]
+        outer_udp = len(packet) - len(packet[UDP])
+        inner_udp = len(packet) - len(packet.getlayer(UDP, 2))
+        self.seq = len(packet) - len(packet[TelemetryReport]) + 8
+        self.vlan = outer_udp + 8 + 16 + 14
+        self.hops = len(packet) - len(packet[IntMetadata])
+        # Fields are changed without updating the UDP checksums, so they are left out
+        self.packets[:, outer_udp + 6:outer_udp + 8] = 0
+        self.packets[:, inner_udp + 6:inner_udp + 8] = 0
+
+
+class Flows(object):
+    """ Flows of the generated reports: VLAN, path, and the hop latency and queue occupancy of
+    each hop when nothing happens. Each flow has its own VLAN, last switch, and egress port. """
+
+    def __init__(self, count, hops, rng):
+        index = np.arange(count)
+        low, high = hops
+        self.hops = rng.integers(low, high + 1, count).astype(np.uint8)
+        self.vlan = (1 + index % 4094).astype(np.uint16)
+        hop_index = np.arange(MAX_INT_HOP)
+        self.sw_ids = (((hop_index + 1) << 16) + index[:, None] % 64).astype(np.uint32)
+        self.sw_ids[:, 0] = 0x10000 + index // 4094
+        self.e_ports = np.broadcast_to(1 + hop_index, (count, MAX_INT_HOP)).astype(np.uint16)
+        self.queue_ids = (index[:, None] + hop_index) % 8
+        self.latencies = rng.integers(1000, 20000, (count, MAX_INT_HOP)).astype(np.int64)
+        self.occups = rng.integers(0, 100, (count, MAX_INT_HOP)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.hops)
+
+
+class Batch(object):
+    """ Fields of a batch of reports, changed by the profiles before rendering. index is the
+    number of each report since the start of the phase. """
+
+    def __init__(self, flows, index, seq, rng):
+        flow = index % len(flows)
+        self.rng = rng
+        self.index = index
+        self.seq = (seq + index) & 0xffffffff
+        self.hops = flows.hops[flow]
+        self.vlan = flows.vlan[flow]
+        self.sw_ids = flows.sw_ids[flow]
+        self.e_ports = flows.e_ports[flow]
+        self.queue_ids = flows.queue_ids[flow]
+        self.latencies = flows.latencies[flow]
+        self.occups = flows.occups[flow]
+        self.damaged = np.zeros(len(index), dtype=bool)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class Steady(object):
+    """ Hop latencies and queue occupancies vary within jitter """
+
+    def __init__(self, jitter=500):
+        self.jitter = int(jitter)
+
+    def apply(self, batch):
+        shape = batch.latencies.shape
+        batch.latencies = batch.latencies + batch.rng.integers(0, self.jitter + 1, shape)
+        batch.occups = batch.occups + batch.rng.integers(0, self.jitter // 100 + 1, shape)
+
+
+class Microburst(object):
+    """ The queues of the first hop fill up for length reports every period reports """
+
+    def __init__(self, period=10000, length=100, occupancy=10000, latency=200000):
+        self.period, self.length = int(period), int(length)
+        self.occupancy, self.latency = int(occupancy), int(latency)
+
+    def apply(self, batch):
+        burst = batch.index % self.period < self.length
+        batch.occups = batch.occups.copy()
+        batch.latencies = batch.latencies.copy()
+        batch.occups[burst, 0] = self.occupancy
+        batch.latencies[burst, 0] += self.latency
+
+
+class PathFlap(object):
+    """ The switch of a hop alternates between two switches every period reports """
+
+    def __init__(self, period=10000, hop=1):
+        self.period, self.hop = int(period), int(hop)
+
+    def apply(self, batch):
+        flapped = batch.index // self.period % 2 == 1
+        batch.sw_ids = batch.sw_ids.copy()
+        batch.sw_ids[flapped, self.hop] ^= 0x8000
+
+
+class Damaged(object):
+    """ A ratio of the reports have a hop leaving before it was received """
+
+    def __init__(self, ratio=0.1):
+        self.ratio = float(ratio)
+
+    def apply(self, batch):
+        batch.damaged = batch.damaged | (batch.rng.random(len(batch)) < self.ratio)
+
+
+PROFILES = {"steady": Steady, "microburst": Microburst, "path_flap": PathFlap, "damaged": Damaged}
+
+
+def _put(packets, offset, width, values):
+    """ Write big-endian values of width bytes at offset of every packet """
+    values = np.asarray(values).astype(">u4").view(np.uint8).reshape(-1, 4)
+    packets[:, offset:offset + width] = values[:, 4 - width:]
+
+
+def render(templates, batch):
+    """ Packets and lengths of the reports of batch """
+    packets = templates.packets[batch.hops]
+    _put(packets, templates.seq, 4, batch.seq)
+    _put(packets, templates.vlan, 2, batch.vlan)
+
+    latencies = np.clip(batch.latencies, 0, 0x7fffffff)
+    ingress = np.full(len(batch), 1000000)
+    for i in range(MAX_INT_HOP):
+        hop = templates.hops + i * HOP_SIZE
+        _put(packets, hop + SW_ID, 4, batch.sw_ids[:, i])
+        _put(packets, hop + EGRESS_ID, 2, batch.e_ports[:, i])
+        _put(packets, hop + HOP_LATENCY, 4, latencies[:, i])
+        _put(packets, hop + QUEUE, 4, batch.queue_ids[:, i] << 24 |
+             np.clip(batch.occups[:, i], 0, 0xffffff))
+        _put(packets, hop + INGRESS_TS, 4, ingress)
+        _put(packets, hop + EGRESS_TS, 4, np.where(batch.damaged & (i == 0), ingress,
+                                                   ingress + latencies[:, i]))
+    return packets, templates.lengths[batch.hops]
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("base", ctypes.c_void_p), ("len", ctypes.c_size_t)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("name", ctypes.c_void_p), ("namelen", ctypes.c_uint32),
+                ("iov", ctypes.POINTER(_IoVec)), ("iovlen", ctypes.c_size_t),
+                ("control", ctypes.c_void_p), ("controllen", ctypes.c_size_t),
+                ("flags", ctypes.c_int), ("len", ctypes.c_uint)]
+
+
+IOVEC_DTYPE = np.dtype({"names": ["base", "len"], "formats": [np.uint64, np.uint64],
+                        "offsets": [_IoVec.base.offset, _IoVec.len.offset],
+                        "itemsize": ctypes.sizeof(_IoVec)})
+MMSGHDR_DTYPE = np.dtype({"names": ["iov", "iovlen"], "formats": [np.uint64, np.uint64],
+                          "offsets": [_MMsgHdr.iov.offset, _MMsgHdr.iovlen.offset],
+                          "itemsize": ctypes.sizeof(_MMsgHdr)})
+
+
+class PacketSocket(object):
+    """ Sends whole batches with sendmmsg over an AF_PACKET socket bound to interface """
+
+    def __init__(self, interface):
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        self.socket.bind((interface, 0))
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 24)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+
+    def write(self, packets, lengths, _):
+        """ Send the first lengths bytes of each row of packets """
+        packets = np.ascontiguousarray(packets)
+        iovecs = np.zeros(len(packets), dtype=IOVEC_DTYPE)
+        iovecs["base"] = packets.ctypes.data + np.arange(len(packets)) * packets.strides[0]
+        iovecs["len"] = lengths
+        messages = np.zeros(len(packets), dtype=MMSGHDR_DTYPE)
+        messages["iov"] = iovecs.ctypes.data + np.arange(len(packets)) * IOVEC_DTYPE.itemsize
+        messages["iovlen"] = 1
+
+        sent = 0
+        while sent < len(messages):
+            count = self.libc.sendmmsg(self.socket.fileno(),
+                                       messages.ctypes.data + sent * MMSGHDR_DTYPE.itemsize,
+                                       len(messages) - sent, 0)
+            if count < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOBUFS:  # The queue of the interface is full
+                    continue
+                raise OSError(error, os.strerror(error))
+            sent += count
+
+    def close(self):
+        self.socket.close()
+
+
+class PcapWriter(object):
+    """ Writes batches to a pcap file with nanosecond timestamps """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(struct.pack("<IHHiIII", 0xa1b23c4d, 2, 4, 0, 0, 65535, 1))
+
+    def write(self, packets, lengths, timestamps):
+        """ Write the first lengths bytes of each row of packets """
+        headers = np.zeros((len(packets), 4), dtype="<u4")
+        headers[:, 0] = timestamps // 1000000000
+        headers[:, 1] = timestamps % 1000000000
+        headers[:, 2] = headers[:, 3] = lengths
+        self.file.write(b"".join(header.tobytes() + packet[:length].tobytes()
+                                 for header, packet, length in zip(headers, packets, lengths)))
+
+    def close(self):
+        self.file.close()
+
+
+def parse_phase(spec):
+    """ profile:packets[:key=value,...] """
+    name, packets, *params = spec.split(":")
+    if name not in PROFILES:
+        raise argparse.ArgumentTypeError(f"Unknown profile {name}. Profiles: "
+                                         f"{', '.join(PROFILES)}")
+    kwargs = dict(param.split("=", 1) for param in ",".join(params).split(",") if param)
+    return PROFILES[name](**kwargs), int(float(packets))
+
+
+def run(phases, sink, flows, templates, rate=0, batch_size=1024, seed=0, start=None):
+    """ Generate the reports of phases, [(profile, packets)], to sink at rate packets per
+    second, or as fast as possible. Steady jitter is added to the other profiles. Returns the
+    number of packets and the time taken. """
+    rng = np.random.default_rng(seed)
+    start = time.time_ns() if start is None else start
+    begin = time.perf_counter()
+    total = 0
+    for profile, packets in phases:
+        for first in range(0, packets, batch_size):
+            batch = Batch(flows, np.arange(first, min(first + batch_size, packets)), total, rng)
+            if not isinstance(profile, Steady):
+                Steady().apply(batch)
+            profile.apply(batch)
+            data, lengths = render(templates, batch)
+
+            # Capture time of each report at the target rate
+            index = total + np.arange(len(batch))
+            timestamps = start + (index * 1e9 / (rate or 1e6)).astype(np.uint64)
+            if rate:
+                delay = (total / rate) - (time.perf_counter() - begin)
+                if delay > 0:
+                    time.sleep(delay)
+            sink.write(data, lengths, timestamps)
+            total += len(batch)
+    return total, time.perf_counter() - begin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate INT reports at high rates.")
+    parser.add_argument("phases", nargs="+", type=parse_phase,
+                        help="profile:packets[:key=value,...], with the profiles "
+                             f"{', '.join(PROFILES)}")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("-i", "--interface", help="Send the reports to this interface")
+    output.add_argument("-w", "--write", help="Write the reports to this pcap file")
+    parser.add_argument("-r", "--rate", type=float, default=0,
+                        help="Packets per second. Default: as fast as possible. Pcap "
+                             "timestamps use 1 Mpps when not set")
+    parser.add_argument("-f", "--flows", type=int, default=1000,
+                        help="Number of flows. Default: 1000")
+    parser.add_argument("--hops", default="5",
+                        help="Hops per report, or a range like 1-10. Default: 5")
+    parser.add_argument("-p", "--int-port", type=int, default=5900,
+                        help="UDP port of the reports. Default: 5900")
+    parser.add_argument("-b", "--batch-size", type=int, default=1024,
+                        help="Reports rendered and sent at once. Default: 1024")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed. Default: 0")
+    args = parser.parse_args()
+
+    low, _, high = args.hops.partition("-")
+    hops = (int(low), int(high or low))
+    if not 1 <= hops[0] <= hops[1] <= MAX_INT_HOP:
+        parser.error(f"hops must be between 1 and {MAX_INT_HOP}")
+
+    sink = PacketSocket(args.interface) if args.interface else PcapWriter(args.write)
+    flows = Flows(args.flows, hops, np.random.default_rng(args.seed))
+    try:
+        packets, duration = run(args.phases, sink, flows, Templates(args.int_port), args.rate,
+                                args.batch_size, args.seed)
+    finally:
+        sink.close()
+    print(f"{packets} reports in {duration:.2f}s ({packets / duration:.0f} reports/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the relocation of map file descriptors in eBPF bytecode """
+
+import unittest
+import numpy as np
+from libs.xdp_code.bytecode import INSN_DTYPE, map_fds, relocate_maps
+
+
+def program(*insns):
+    """ Bytes of a program from (code, regs, off, imm) tuples """
+    return np.array(list(insns), dtype=INSN_DTYPE).tobytes()
+
+
+# r1 = map fd 7 (ld_imm64 with src_reg BPF_PSEUDO_MAP_FD), r2 = 7 (plain ld_imm64), r0 = 7, exit
+PROGRAM = program((0x18, 0x11, 0, 7), (0, 0, 0, 0),
+                  (0x18, 0x02, 0, 7), (0, 0, 0, 0),
+                  (0xb7, 0x00, 0, 7),
+                  (0x18, 0x11, 0, 9), (0, 0, 0, 0),
+                  (0x95, 0x00, 0, 0))
+
+
+class TestBytecode(unittest.TestCase):
+    """ Test reading and patching map loads """
+
+    def test_map_fds(self):
+        """ Only loads of map file descriptors are maps """
+        assert map_fds(PROGRAM) == [7, 9]
+        assert map_fds(b"") == []
+
+    def test_relocate_maps(self):
+        """ Map file descriptors are replaced, other immediates are kept """
+        relocated = relocate_maps(PROGRAM, {7: 42, 9: 43})
+        assert len(relocated) == len(PROGRAM)
+        assert map_fds(relocated) == [42, 43]
+        assert np.frombuffer(relocated, dtype=INSN_DTYPE)["imm"].tolist() == \
+            [42, 0, 7, 0, 7, 43, 0, 0]
+
+    def test_missing_map(self):
+        """ A program referencing an unknown map isn't relocated """
+        with self.assertRaises(KeyError):
+            relocate_maps(PROGRAM, {7: 42})
+
+    def test_invalid_size(self):
+        """ Programs are made of 8-byte instructions """
+        with self.assertRaises(ValueError):
+            map_fds(PROGRAM[:-1])
@@ -22,7 +22,8 @@
 import os
 import unittest
 from configparser import ConfigParser
-from libs.input.config_class import MyDefaultConfig
+from libs.input.config_class import MyDefaultConfig, parse_cpu_list
+from libs.input.read_configs import read_config_file, read_config_section
 
 
 class TestCLI(unittest.TestCase):
@@ -229,3 +230,202 @@ class TestCLI(unittest.TestCase):
             my_config.mode = 'a'
         with self.assertRaises(ValueError):
             my_config.mode = None
+
+    def test_database_writer_options(self):
+        """ Writer options are only exported when they are not the default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.db_workers == 2
+        assert my_config.db_batch_size == 5000
+        assert my_config.db_batch_age == 0.1
+        assert my_config.db_gzip is False
+        assert my_config.db_retries == 3
+        assert my_config.db_timeout == 5.0
+        assert "--db-" not in str(my_config).replace("--db-name", "")
+
+        my_config.import_config({"db_workers": "8", "db_batch_size": "20000", "db_batch_age": "0.5",
+                                 "db_gzip": "True", "db_retries": "5", "db_timeout": "2"})
+        assert "--db-workers=8" in str(my_config)
+        assert "--db-batch-size=20000" in str(my_config)
+        assert "--db-batch-age=0.5" in str(my_config)
+        assert "--db-gzip" in str(my_config)
+        assert "--db-retries=5" in str(my_config)
+        assert "--db-timeout=2.0" in str(my_config)
+
+        with self.assertRaises(ValueError):
+            my_config.db_workers = 0
+        with self.assertRaises(ValueError):
+            my_config.db_batch_size = 0
+
+    def test_buffer_options(self):
+        """ Buffer options are only exported when they are not the default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.buffer_max_mb == 256
+        assert my_config.buffer_max_points == 2000000
+        assert my_config.buffer_policy == "drop-oldest"
+        assert "--buffer-" not in str(my_config)
+
+        my_config.import_config({"buffer_max_mb": "64", "buffer_max_points": "1000",
+                                 "buffer_policy": "spill", "buffer_spill_dir": "/tmp/spill",
+                                 "buffer_spill_max_mb": "100"})
+        assert "--buffer-max-mb=64" in str(my_config)
+        assert "--buffer-max-points=1000" in str(my_config)
+        assert "--buffer-policy=spill" in str(my_config)
+        assert "--buffer-spill-dir=/tmp/spill" in str(my_config)
+        assert "--buffer-spill-max-mb=100" in str(my_config)
+
+        with self.assertRaises(ValueError):
+            my_config.buffer_policy = "block"
+        with self.assertRaises(ValueError):
+            my_config.buffer_max_points = 0
+
+    def test_bpf_cache_dir(self):
+        """ The cache directory is only exported when it is not the default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.bpf_cache_dir == "/var/cache/int_collector"
+        assert "--bpf-cache-dir" not in str(my_config)
+
+        my_config.import_config({"bpf_cache_dir": "/tmp/bpf"})
+        assert "--bpf-cache-dir=/tmp/bpf" in str(my_config)
+
+    def test_pin_maps(self):
+        """ Pinning is disabled by default and only exported when enabled """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.pin_maps is False
+        assert "--pin-" not in str(my_config)
+
+        my_config.import_config({"pin_maps": "True", "pin_dir": "/sys/fs/bpf/test"})
+        assert "--pin-maps" in str(my_config)
+        assert "--pin-dir=/sys/fs/bpf/test" in str(my_config)
+
+    def test_steer_cpus(self):
+        """ CPU lists are validated and only exported when set """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.steer_cpus is None
+        assert "--steer-cpus" not in str(my_config)
+
+        my_config.import_config({"steer_cpus": "2-4, 8"})
+        assert "--steer-cpus=2-4,8" in str(my_config)
+        assert parse_cpu_list(my_config.steer_cpus) == [2, 3, 4, 8]
+
+        for value in ["4-2", "a", "1,1", "-1"]:
+            with self.assertRaises(ValueError):
+                my_config.steer_cpus = value
+
+    def test_stage_stats(self):
+        """ Stage stats are disabled by default and only exported when enabled """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.stage_stats is False
+        assert "--stage-stats" not in str(my_config)
+
+        my_config.import_config({"stage_stats": "true"})
+        assert my_config.stage_stats is True
+        assert "--stage-stats" in str(my_config)
+
+    def test_map_sizes(self):
+        """ Map sizes are validated and only exported when not the default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.flow_map_size == 10000
+        assert "-map-size" not in str(my_config)
+        assert "--map-stats" not in str(my_config)
+
+        my_config.import_config({"flow_map_size": "200000", "vlan_util_map_size": "10240",
+                                 "map_stats": "True"})
+        assert "--flow-map-size=200000" in str(my_config)
+        assert "--vlan-util-map-size=10240" in str(my_config)
+        assert "--queue-map-size" not in str(my_config)
+        assert "--map-stats" in str(my_config)
+
+        for value in ["0", "-1", "a"]:
+            with self.assertRaises(ValueError):
+                my_config.queue_map_size = value
+
+    def test_latency_hist(self):
+        """ Histograms are disabled by default and bucket widths are validated """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.latency_hist is False
+        assert my_config.latency_hist_width == 0
+        assert "--latency-hist" not in str(my_config)
+
+        my_config.import_config({"latency_hist": "True", "latency_hist_width": "1000"})
+        assert "--latency-hist" in str(my_config).split()
+        assert "--latency-hist-width=1000" in str(my_config)
+
+        with self.assertRaises(ValueError):
+            my_config.latency_hist_width = "-1"
+
+    def test_queue_peaks(self):
+        """ Queue peaks are disabled by default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.queue_peaks is False
+        assert "--queue-peaks" not in str(my_config)
+
+        my_config.import_config({"queue_peaks": "true"})
+        assert "--queue-peaks" in str(my_config).split()
+
+    def test_event_workers(self):
+        """ Events are decoded by the collector process by default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.event_workers == 0
+        assert my_config.event_worker_cpus is None
+        assert "--event-worker" not in str(my_config)
+
+        my_config.import_config({"event_workers": "4", "event_worker_cpus": "2-5"})
+        assert "--event-workers=4" in str(my_config)
+        assert "--event-worker-cpus=2-5" in str(my_config)
+
+        for value in ["-1", "9"]:
+            with self.assertRaises(ValueError):
+                my_config.event_workers = value
+
+    def test_destinations(self):
+        """ Destinations are validated and only exported when not the default """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.destinations == "influxdb"
+        assert "--destinations" not in str(my_config)
+
+        my_config.import_config({"destinations": "influxdb, file", "file_path": "/tmp/points.lp"})
+        assert "--destinations=influxdb,file" in str(my_config)
+        assert "--file-path=/tmp/points.lp" in str(my_config)
+
+        with self.assertRaises(ValueError):
+            my_config.destinations = "influxdb,carrier-pigeon"
+
+    def test_file_destination_without_path(self):
+        """ The file destination requires file_path """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        my_config.import_config({"destinations": "influxdb,file"})
+        assert my_config.is_config_accurate() is False
+        my_config.file_path = "/tmp/points.lp"
+        assert my_config.is_config_accurate() is True
+
+    def test_counters_refresh(self):
+        """ counters_refresh is a counter mode option """
+        my_config = MyDefaultConfig("instance_1", self.my_configs[0])
+        assert my_config.counters_refresh == 60.0
+        assert my_config.counters_rates is False
+
+        my_config.import_config({"counters_refresh": "10", "counters_rates": "True"})
+        assert "--counters-refresh=10.0" in str(my_config)
+        assert "--counters-rates" in str(my_config)
+
+        my_config.mode = 2
+        assert "--counters-refresh" not in str(my_config)
+
+        # 0 exports all counters every time
+        my_config.mode = 0
+        my_config.import_config({"counters_refresh": "0"})
+        assert my_config.counters_refresh == 0
+        assert "--counters-refresh=0.0" in str(my_config).split()
+        with self.assertRaises(ValueError):
+            my_config.counters_refresh = "-1"
+
+    def test_read_config_section(self):
+        """ Instances started from a config file can read their section again """
+        config_file = os.getcwd() + "/tests/data/collector.ini"
+        my_config = read_config_file(config_file)[0]
+        assert "--config-file=%s" % config_file in str(my_config)
+
+        reloaded = read_config_section(config_file, my_config.name)
+        assert reloaded.hop_latency == my_config.hop_latency
+        assert reloaded.mode == my_config.mode
+        assert read_config_section(config_file, "missing-section") is None
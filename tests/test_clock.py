@@ -0,0 +1,46 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+""" Test the translation of kernel timestamps """
+
+import time
+import unittest
+from libs.xdp_code.clock import KernelClock
+
+
+class TestKernelClock(unittest.TestCase):
+    """ Test KernelClock """
+
+    def test_to_wall(self):
+        """ A monotonic timestamp taken now translates to now """
+        clock = KernelClock()
+        kernel_ns = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+        assert abs(clock.to_wall(kernel_ns) - time.time_ns()) < 10000000  # 10 ms
+
+    def test_resync_interval(self):
+        """ Calibration is only repeated after resync_interval """
+        clock = KernelClock(resync_interval=3600)
+        last_sync = clock.last_sync
+        clock.maybe_resync()
+        assert clock.last_sync == last_sync
+
+        clock = KernelClock(resync_interval=0)
+        last_sync = clock.last_sync
+        clock.maybe_resync()
+        assert clock.last_sync > last_sync
@@ -0,0 +1,195 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+""" Test the decoding of threshold events """
+
+import struct
+import unittest
+import numpy as np
+import pyximport; pyximport.install()  # pylint: disable=C0321
+from libs.xdp_code.decoder import FLOW_EVENT_DTYPE, HOP_LATENCY_EVENT_DTYPE, \
+    QUEUE_OCCUP_EVENT_DTYPE, encode_events  # pylint: disable=C0413
+from libs.xdp_code.decoder import EGR_VLAN_KEY_DTYPE, EGR_QUEUE_KEY_DTYPE, \
+    EGR_INTERFACE_KEY_DTYPE, TX_INFO_DTYPE, sum_cpus  # pylint: disable=C0413
+from libs.xdp_code.decoder import HIST_KEY_DTYPE, hist_lower_bounds  # pylint: disable=C0413
+from libs.xdp_code.decoder import PEAK_KEY_DTYPE, QUEUE_PEAK_DTYPE, \
+    merge_peaks  # pylint: disable=C0413
+from libs.xdp_code.EventRecords import EventBatch  # pylint: disable=C0413
+from libs.xdp_code.LineProtocol import LineBuffer  # pylint: disable=C0413
+
+
+EVENT_FLOW, EVENT_HOP_LATENCY, EVENT_QUEUE_OCCUP = 1, 2, 3
+
+
+def record(event_type, entries, sink_time=5):
+    """ Event record of the last switch 10, port 20, on VLAN 42. entries are bytes. """
+    header = struct.pack("<QIIHHBBH", sink_time, 10, 2001, 42, 20, event_type, len(entries), 0)
+    return header + b"".join(entries)
+
+
+def path_hop(hop):
+    """ Switch i has ID 10 + i, ingress port 1, egress port 20 + i and queue 2 """
+    return struct.pack("<IHHHH", 10 + hop, 1, 20 + hop, 2, 0)
+
+
+def hop_latency(hop):
+    """ Hop i has a latency of 1000 + i """
+    return struct.pack("<II", 10 + hop, 1000 + hop)
+
+
+def queue_occup(hop):
+    """ Queue of hop i has an occupancy of 100 + i """
+    return struct.pack("<IHHI", 10 + hop, 20 + hop, 2, 100 + hop)
+
+
+def to_lines(*records):
+    """ Decode records and split the encoded events in lines """
+    batch = EventBatch()
+    for event in records:
+        batch.add(event)
+    lines = LineBuffer()
+    encode_events(batch.flows, batch.hop_latencies, batch.queue_occups, lines, lambda ts: ts)
+    return lines.getvalue().decode().splitlines()
+
+
+class TestDecoder(unittest.TestCase):
+    """ Test the decoding of records and their encoding against the expected InfluxDB lines """
+
+    def test_struct_sizes(self):
+        """ Same sizes as the rows of EventRecords.pyx """
+        assert FLOW_EVENT_DTYPE.itemsize == 144
+        assert HOP_LATENCY_EVENT_DTYPE.itemsize == 24
+        assert QUEUE_OCCUP_EVENT_DTYPE.itemsize == 24
+
+    def test_map_struct_sizes(self):
+        """ Same sizes as the keys and values of the utilization maps """
+        assert EGR_VLAN_KEY_DTYPE.itemsize == 12
+        assert EGR_QUEUE_KEY_DTYPE.itemsize == 8
+        assert EGR_INTERFACE_KEY_DTYPE.itemsize == 8
+        assert TX_INFO_DTYPE.itemsize == 16
+        assert HIST_KEY_DTYPE.itemsize == 12
+        assert PEAK_KEY_DTYPE.itemsize == 12
+        assert QUEUE_PEAK_DTYPE.itemsize == 24
+
+    def test_hist_lower_bounds(self):
+        """ Buckets are tagged with the lowest latency they count """
+        buckets = np.array([0, 1, 2, 3, 10], dtype=np.uint32)
+        assert hist_lower_bounds(buckets).tolist() == [0, 1, 2, 4, 512]
+        assert hist_lower_bounds(buckets[:3], 1000).tolist() == [0, 1000, 2000]
+
+    def test_merge_peaks(self):
+        """ Copies of the interval are merged over CPUs, stale copies are ignored """
+        keys = np.zeros(3, dtype=PEAK_KEY_DTYPE)
+        keys["sw_id"] = [1, 2, 3]
+        keys["slot"] = [1, 1, 0]
+        values = np.zeros((3, 2), dtype=QUEUE_PEAK_DTYPE)
+        # Switch 1 is seen by both CPUs, switch 2 only by the second one
+        values[0] = [(5, 40, 10, 20, 100), (5, 60, 30, 30, 90)]
+        values[1] = [(3, 99, 99, 99, 200), (5, 7, 7, 7, 50)]
+        values[2] = [(4, 1, 1, 1, 10), (4, 1, 1, 1, 10)]
+
+        keys, maximum, minimum, last = merge_peaks(keys, values, 5)
+        assert keys["sw_id"].tolist() == [1, 2]
+        assert maximum.tolist() == [60, 7]
+        assert minimum.tolist() == [10, 7]
+        assert last.tolist() == [20, 7]
+
+    def test_sum_cpus(self):
+        """ Per-CPU copies are summed field by field """
+        values = np.zeros((2, 4), dtype=TX_INFO_DTYPE)
+        values["octets"] = [[1, 2, 3, 4], [2 ** 63, 2 ** 62, 0, 0]]
+        values["packets"][0, 3] = 7
+        total = sum_cpus(values)
+        assert total["octets"].tolist() == [10, 2 ** 63 + 2 ** 62]
+        assert total["packets"].tolist() == [7, 0]
+
+    def test_no_events(self):
+        """ Nothing received, nothing exported """
+        assert to_lines() == []
+
+    def test_new_flow(self):
+        """ A new flow exports its path and the latency of every hop """
+        lines = to_lines(record(EVENT_FLOW, [path_hop(0), path_hop(1)]),
+                         record(EVENT_HOP_LATENCY, [hop_latency(0), hop_latency(1)]))
+        assert lines == [
+            'flow_lat_path\\,vlan_id=42\\,sw_id=10\\,port=20 '
+            'flow_latency=2001,path="1-11-21.2,1-10-20.2" 5',
+            'latency\\,vlan\\=42\\,sw\\=10\\,port\\=20\\,hop\\=10 value=1000 5',
+            'latency\\,vlan\\=42\\,sw\\=10\\,port\\=20\\,hop\\=11 value=1001 5',
+        ]
+
+    def test_queue_occupancy(self):
+        """ Only queues in the records are exported, with the timestamp of their record """
+        lines = to_lines(record(EVENT_QUEUE_OCCUP, [queue_occup(1)], sink_time=5),
+                         record(EVENT_QUEUE_OCCUP, [queue_occup(0)], sink_time=6))
+        assert lines == [
+            'queue_occ\\,sw\\=11\\,port\\=21\\,queue\\=2 value=101 5',
+            'queue_occ\\,sw\\=10\\,port\\=20\\,queue\\=2 value=100 6',
+        ]
+
+    def test_malformed_records(self):
+        """ Truncated records and unknown types are counted and skipped """
+        batch = EventBatch()
+        batch.add(record(EVENT_HOP_LATENCY, [hop_latency(0), hop_latency(1)])[:-4])
+        batch.add(record(9, [hop_latency(0)]))
+        batch.add(b"\0" * 8)
+        assert len(batch) == 0
+        assert batch.malformed == 3
+
+    def test_full_batch(self):
+        """ The callback stops the drain once the batch is full """
+        batch = EventBatch(capacity=2)
+        assert batch.add(record(EVENT_QUEUE_OCCUP, [queue_occup(0)]))
+        assert not batch.add(record(EVENT_HOP_LATENCY, [hop_latency(i) for i in range(10)]))
+        assert batch.is_full()
+        assert len(batch.hop_latencies) == 10
+        batch.clear()
+        assert len(batch) == 0 and len(batch.queue_occups) == 0
+
+
+class TestLineBuffer(unittest.TestCase):
+    """ Test the line protocol encoder """
+
+    def test_add_points(self):
+        """ Integers are encoded as is, with or without timestamps """
+        lines = LineBuffer(capacity=8)
+        lines.add_points("tx_octs\\,sw\\=%d", ([1, 2],), b"value", [0, 2 ** 64 - 1])
+        lines.add_points("tx_pkts\\,sw\\=%d", ([1],), b"value", [10], [1650000000000000000])
+        assert lines.points == 3
+        assert lines.getvalue() == (b"tx_octs\\,sw\\=1 value=0\n"
+                                    b"tx_octs\\,sw\\=2 value=18446744073709551615\n"
+                                    b"tx_pkts\\,sw\\=1 value=10 1650000000000000000\n")
+
+    def test_integers(self):
+        """ Same digits as str() """
+        values = [0, 1, 9, 10, 99, 100, 101, 12345, 980327060, 2 ** 32 - 1, 10 ** 19, 2 ** 64 - 1]
+        lines = LineBuffer()
+        lines.add_points("m\\,i\\=%d", (list(range(len(values))),), b"value", values)
+        encoded = [line.split(b"=")[-1] for line in lines.getvalue().splitlines()]
+        assert encoded == [str(value).encode() for value in values]
+
+    def test_clear(self):
+        """ The buffer is reused after clear() """
+        lines = LineBuffer()
+        lines.add_line(b"flow", b"a=1", 1)
+        lines.clear()
+        assert lines.points == 0
+        assert lines.getvalue() == b""
+        lines.add_line(b"flow", b"a=2", 2)
+        assert lines.getvalue() == b"flow a=2 2\n"
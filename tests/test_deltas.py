@@ -0,0 +1,79 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the delta export of counter maps """
+
+import unittest
+import numpy as np
+from libs.xdp_code.decoder import EGR_QUEUE_KEY_DTYPE, TX_INFO_DTYPE
+from libs.xdp_code.deltas import SnapshotDelta, rate
+
+
+def snapshot(entries):
+    """ Keys and values from {(sw_id, p_id, q_id): (octets, packets)} """
+    keys = np.zeros(len(entries), dtype=EGR_QUEUE_KEY_DTYPE)
+    values = np.zeros(len(entries), dtype=TX_INFO_DTYPE)
+    for i, (key, value) in enumerate(entries.items()):
+        keys[i] = key
+        values[i] = value
+    return keys, values
+
+
+class TestSnapshotDelta(unittest.TestCase):
+    """ Test the comparison of consecutive snapshots """
+
+    def test_first_snapshot(self):
+        """ Everything is exported the first time """
+        delta = SnapshotDelta(refresh_interval=60)
+        export, previous, elapsed = delta.update(*snapshot({(1, 1, 0): (100, 1)}), 0)
+        assert export.tolist() == [0]
+        assert previous["octets"].tolist() == [0]
+        assert elapsed is None
+
+    def test_changed_and_new(self):
+        """ Only changed and new entries are exported, wherever they are in the map """
+        delta = SnapshotDelta(refresh_interval=60)
+        delta.update(*snapshot({(1, 1, 0): (100, 1), (1, 2, 0): (200, 2), (1, 3, 0): (300, 3)}), 0)
+
+        keys, values = snapshot({(1, 3, 0): (300, 3), (1, 4, 0): (50, 1), (1, 1, 0): (150, 2)})
+        export, previous, elapsed = delta.update(keys, values, 500000000)
+        assert keys[export]["p_id"].tolist() == [4, 1]
+        assert previous["octets"].tolist() == [300, 0, 100]
+        assert elapsed == 0.5
+
+    def test_refresh(self):
+        """ Unchanged entries are exported after refresh_interval """
+        delta = SnapshotDelta(refresh_interval=1)
+        entries = snapshot({(1, 1, 0): (100, 1)})
+        delta.update(*entries, 0)
+        assert delta.update(*entries, 500000000)[0].tolist() == []
+        assert delta.update(*entries, 1000000000)[0].tolist() == [0]
+        assert delta.update(*entries, 1500000000)[0].tolist() == []
+
+    def test_snapshot_arrays_are_reused(self):
+        """ The previous snapshot is a copy """
+        delta = SnapshotDelta(refresh_interval=60)
+        keys, values = snapshot({(1, 1, 0): (100, 1)})
+        delta.update(keys, values, 0)
+        values["octets"] = 200
+        assert delta.update(keys, values, 1)[0].tolist() == [0]
+
+    def test_rate(self):
+        """ Rates per second, counting a reset counter from zero """
+        values = np.array([1100, 50], dtype=np.uint64)
+        previous = np.array([100, 1000], dtype=np.uint64)
+        assert rate(values, previous, 0.5, 8).tolist() == [16000, 800]
@@ -0,0 +1,199 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the destinations and the fan-out to them """
+
+import os
+import socket
+import tempfile
+import time
+import unittest
+from libs.destinations import Batch, Destination, create, register
+from libs.destinations.event_buffer import EventBuffer
+from libs.destinations.outputs import Outputs
+
+
+class FailingDestination(Destination):
+    """ Fails the first writes """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.batches = []
+
+    def write(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("unreachable")
+        self.batches.append(batch)
+
+
+class RejectingDestination(Destination):
+    """ Reports every batch as failed like an asynchronous destination, without raising """
+
+    healthy = True
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, batch):
+        self.writes += 1
+        self.healthy = False
+        self.on_failure(batch.data, batch.points)
+
+
+class UnopenedDestination(FailingDestination):
+    """ Fails to open the first times """
+
+    def __init__(self, failures):
+        super().__init__(0)
+        self.open_failures = failures
+        self.closed = False
+
+    def open(self):
+        if self.open_failures:
+            self.open_failures -= 1
+            raise OSError("broker down")
+
+    def close(self):
+        self.closed = True
+
+
+register("failing", "tests.test_destinations.FailingDestination")
+register("unopened", "tests.test_destinations.UnopenedDestination")
+register("rejecting", "tests.test_destinations.RejectingDestination")
+
+
+def new_buffer(**kwargs):
+    """ Buffer large enough for the tests """
+    return EventBuffer(max_bytes=1 << 20, max_points=10000, **kwargs)
+
+
+class TestOutputs(unittest.TestCase):
+    """ Test the fan-out """
+
+    def test_fan_out(self):
+        """ All destinations receive all batches """
+        outputs = Outputs(interval=0.01)
+        first = create("memory", keep=True)
+        second = create("memory", keep=True)
+        outputs.add("first", first, new_buffer())
+        outputs.add("second", second, new_buffer())
+        outputs.start()
+        for i in range(10):
+            outputs.put(b"m value=%d\n" % i, 1)
+        outputs.close()
+        assert first.points == second.points == 10
+        assert b"".join(batch.data for batch in first.batches) == \
+            b"".join(b"m value=%d\n" % i for i in range(10))
+
+    def test_slow_destination(self):
+        """ A slow destination doesn't hold the others """
+        outputs = Outputs(batch_size=1, interval=0.01)
+        fast = create("memory")
+        slow = create("memory", delay=0.2)
+        outputs.add("fast", fast, new_buffer())
+        outputs.add("slow", slow, new_buffer())
+        outputs.start()
+        for i in range(5):
+            outputs.put(b"m value=%d\n" % i, 1)
+        time.sleep(0.1)
+        assert fast.points == 5
+        assert slow.points < 5
+        outputs.close()
+        assert slow.points == 5
+
+    def test_failed_writes_are_spilled(self):
+        """ Failed batches are spilled and written once the destination is back """
+        with tempfile.TemporaryDirectory() as spill_dir:
+            outputs = Outputs(interval=0.01)
+            failing = create("failing", failures=1)
+            outputs.add("failing", failing, new_buffer(policy="spill", spill_dir=spill_dir))
+            outputs.start()
+            outputs.put(b"m value=1\n", 1)
+            time.sleep(0.1)
+            outputs.put(b"m value=2\n", 1)
+            outputs.close()
+            assert [batch.data for batch in failing.batches] == [b"m value=2\n", b"m value=1\n"]
+
+    def test_unhealthy_destination_is_probed(self):
+        """ Batches stay buffered while an unhealthy destination is probed with backoff """
+        for name, options in (("failing", {"failures": 1000}), ("rejecting", {})):
+            outputs = Outputs(batch_size=1, interval=0.01)
+            destination = create(name, **options)
+            buffer = new_buffer()
+            outputs.add(name, destination, buffer)
+            outputs.start()
+            for i in range(50):
+                outputs.put(b"m value=%d\n" % i, 1)
+            time.sleep(0.3)
+            attempts = 1000 - destination.failures if name == "failing" else destination.writes
+            assert attempts < 10, name
+            assert buffer.points == 50 and buffer.dropped == 0, name
+            outputs.close()
+
+    def test_failed_open_is_retried(self):
+        """ Batches are kept until the destination opens """
+        outputs = Outputs(interval=0.01)
+        unopened = create("unopened", failures=3)
+        outputs.add("unopened", unopened, new_buffer())
+        outputs.start()
+        outputs.put(b"m value=1\n", 1)
+        time.sleep(0.1)
+        assert outputs.sinks[0].is_alive()
+        outputs.put(b"m value=2\n", 1)
+        outputs.close()
+        assert [batch.data for batch in unopened.batches] == [b"m value=1\n", b"m value=2\n"]
+        assert unopened.closed
+
+    def test_unknown_destination(self):
+        """ Unknown names are rejected """
+        with self.assertRaises(ValueError):
+            create("carrier-pigeon")
+
+
+class TestDestinations(unittest.TestCase):
+    """ Test the destinations that don't need external services """
+
+    def test_file(self):
+        """ Batches are appended """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "points.lp")
+            for i in range(2):
+                destination = create("file", path=path)
+                destination.open()
+                destination.write(Batch(b"m value=%d\n" % i, 1))
+                destination.close()
+            with open(path, "rb") as points:
+                assert points.read() == b"m value=0\nm value=1\n"
+
+    def test_influxdb_udp(self):
+        """ Datagrams are split at line boundaries """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.settimeout(1)
+
+        destination = create("influxdb-udp", host="127.0.0.1", port=listener.getsockname()[1],
+                             payload_size=25)
+        destination.open()
+        destination.write(Batch(b"m value=1\nm value=2\nm value=3\n"
+                                b"long value=12345678901234567890\n", 4))
+        destination.close()
+
+        datagrams = [listener.recvfrom(1024)[0] for _ in range(3)]
+        listener.close()
+        assert datagrams == [b"m value=1\nm value=2\n", b"m value=3\n",
+                             b"long value=12345678901234567890\n"]
@@ -0,0 +1,138 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the bounded event buffer and its spill log """
+
+import os
+import tempfile
+import unittest
+from libs.destinations.event_buffer import EventBuffer
+
+
+def batch(i, points=1):
+    """ Encoded batch of points, 10 bytes per point """
+    return b"".join(b"m value=%d\n" % i for _ in range(points)), points
+
+
+class TestEventBuffer(unittest.TestCase):
+    """ Test the overflow policies """
+
+    def setUp(self):
+        """ setUp """
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+
+    def tearDown(self):
+        """ tearDown """
+        self.tmp.cleanup()
+
+    def test_get_merges_batches(self):
+        """ get() returns batches in order, up to max_points """
+        buffer = EventBuffer(max_bytes=1000, max_points=100)
+        for i in range(5):
+            buffer.put(*batch(i, 2))
+        assert buffer.get(4) == (batch(0, 2)[0] + batch(1, 2)[0], 4)
+        assert buffer.get(100) == (batch(2, 2)[0] + batch(3, 2)[0] + batch(4, 2)[0], 6)
+        assert buffer.get(100) is None
+        assert buffer.points == 0 and buffer.bytes == 0
+
+    def test_drop_oldest(self):
+        """ Old batches make room for new ones """
+        buffer = EventBuffer(max_bytes=1000, max_points=3, policy="drop-oldest")
+        for i in range(5):
+            buffer.put(*batch(i))
+        assert buffer.dropped == 2
+        assert buffer.get(100) == (b"m value=2\nm value=3\nm value=4\n", 3)
+
+    def test_drop_newest(self):
+        """ New batches are discarded """
+        buffer = EventBuffer(max_bytes=25, max_points=100, policy="drop-newest")
+        for i in range(5):
+            buffer.put(*batch(i))
+        assert buffer.dropped == 3
+        assert buffer.bytes == 20
+        assert buffer.get(100) == (b"m value=0\nm value=1\n", 2)
+
+    def test_requeue(self):
+        """ A failed batch goes back to the front and the policy applies when it overflows """
+        buffer = EventBuffer(max_bytes=1000, max_points=100)
+        for i in range(3):
+            buffer.put(*batch(i))
+        failed = buffer.get(2)
+        buffer.requeue(*failed)
+        assert buffer.dropped == 0
+        assert buffer.get(100) == (b"m value=0\nm value=1\nm value=2\n", 3)
+
+        for policy, expected in (("drop-oldest", b"m value=2\nm value=3\n"),
+                                 ("drop-newest", b"m value=0\nm value=1\n")):
+            buffer = EventBuffer(max_bytes=1000, max_points=4, policy=policy)
+            for i in range(4):
+                buffer.put(*batch(i))
+            failed = buffer.get(2)
+            buffer.put(*batch(4))
+            buffer.put(*batch(5))
+            buffer.requeue(*failed)
+            assert buffer.points == 4 and buffer.dropped == 2
+            assert buffer.get(2) == (expected, 2), policy
+
+    def test_spill_and_replay(self):
+        """ Batches that don't fit are written to disk and replayed oldest first """
+        buffer = EventBuffer(max_bytes=1000, max_points=2, policy="spill", spill_dir=self.tmp.name)
+        for i in range(5):
+            buffer.put(*batch(i))
+        buffer.requeue(*batch(5))
+        assert buffer.spilled == 4
+        assert buffer.dropped == 0
+
+        assert buffer.get(100) == (b"m value=0\nm value=1\n", 2)
+        assert buffer.get(100) is None
+        assert buffer.get(100, replay=True) == (b"m value=2\nm value=3\nm value=4\nm value=5\n", 4)
+        assert buffer.replayed == 4
+        assert buffer.get(100, replay=True) is None
+        assert not os.listdir(self.tmp.name)
+
+    def test_spill_survives_restart(self):
+        """ Spilled batches are replayed by the next run, ignoring a torn record """
+        buffer = EventBuffer(max_bytes=1000, max_points=1, policy="spill", spill_dir=self.tmp.name)
+        for i in range(3):
+            buffer.put(*batch(i))
+        buffer.close()
+        segment = os.path.join(self.tmp.name, os.listdir(self.tmp.name)[0])
+        with open(segment, "ab") as torn:
+            torn.write(b"\x10\x00")
+
+        buffer = EventBuffer(max_bytes=1000, max_points=10, policy="spill", spill_dir=self.tmp.name)
+        assert buffer.get(100, replay=True) == (b"m value=1\nm value=2\n", 2)
+
+    def test_spill_max_size(self):
+        """ The oldest segments are deleted to stay under the disk limit """
+        buffer = EventBuffer(max_bytes=1000, max_points=1, policy="spill", spill_dir=self.tmp.name,
+                             spill_max_bytes=40)
+        buffer.spill.segment_size = 1
+        for i in range(6):
+            buffer.put(*batch(i))
+        assert buffer.spilled == 5
+        assert buffer.dropped == 3
+        assert buffer.get(100) == (b"m value=0\n", 1)
+        assert buffer.get(100, replay=True) == (b"m value=4\n", 1)
+        assert buffer.get(100, replay=True) == (b"m value=5\n", 1)
+
+    def test_invalid_policy(self):
+        """ Unknown policies and spill without directory are rejected """
+        with self.assertRaises(ValueError):
+            EventBuffer(max_bytes=1000, max_points=10, policy="block")
+        with self.assertRaises(ValueError):
+            EventBuffer(max_bytes=1000, max_points=10, policy="spill")
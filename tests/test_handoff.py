@@ -0,0 +1,86 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the handoff of encoded events from the poll loop to the destinations """
+
+import unittest
+import pyximport; pyximport.install()  # pylint: disable=C0321
+from libs.xdp_code.handoff import Handoff  # pylint: disable=C0413
+
+
+class ListOutputs(object):
+    """ Outputs keeping the batches put """
+
+    def __init__(self):
+        self.batches = []
+
+    def put(self, data, points):
+        self.batches.append((data, points))
+
+
+def add_point(handoff, value):
+    handoff.lines.add_line(b"queue_occ", b"value=%d" % value, value)
+
+
+class TestHandoff(unittest.TestCase):
+    """ Test the ring of LineBuffers between the poll loop and the outputs """
+
+    def test_publish(self):
+        """ Published buffers are put in order, empty buffers aren't published """
+        outputs = ListOutputs()
+        handoff = Handoff(outputs, slots=4)
+        handoff.publish()
+        assert handoff.depth == 0
+
+        for value in range(3):
+            add_point(handoff, value)
+            handoff.publish()
+        assert handoff.depth == 3
+        assert handoff.gauges() == (3, 3, 0)
+
+        handoff.start()
+        handoff.close()
+        assert handoff.depth == 0
+        assert outputs.batches == [(b"queue_occ value=%d %d\n" % (value, value), 1)
+                                   for value in range(3)]
+
+    def test_no_free_buffer(self):
+        """ The producer keeps appending to its buffer until one is free """
+        outputs = ListOutputs()
+        handoff = Handoff(outputs, slots=2)
+        add_point(handoff, 1)
+        handoff.publish()
+        add_point(handoff, 2)
+        handoff.publish()
+        add_point(handoff, 3)
+        handoff.publish()
+        assert handoff.depth == 1
+        assert handoff.stalls == 2
+
+        handoff.start()
+        handoff.close()
+        assert [points for _, points in outputs.batches] == [1, 2]
+
+    def test_max_depth(self):
+        """ The max depth restarts when read """
+        handoff = Handoff(ListOutputs(), slots=4)
+        for value in range(2):
+            add_point(handoff, value)
+            handoff.publish()
+        handoff.tail = 2
+        assert handoff.gauges() == (0, 2, 0)
+        assert handoff.gauges() == (0, 0, 0)
@@ -0,0 +1,130 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+""" Test the InfluxDB writer against a local HTTP server """
+
+import gzip
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from libs.destinations.influxdb_http import InfluxDBWriter
+
+
+class FakeInfluxDB(BaseHTTPRequestHandler):
+    """ Records the bodies of /write requests. Replies with the next status in server.statuses
+    or 204 when there are none. """
+
+    def do_POST(self):  # pylint: disable=C0103
+        """ /write """
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        if status == 204:
+            self.server.bodies.append(body)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        """ Quiet """
+
+
+class TestInfluxDBWriter(unittest.TestCase):
+    """ Test batching, compression and retries """
+
+    def setUp(self):
+        """ setUp """
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeInfluxDB)
+        self.server.bodies = []
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        """ tearDown """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def writer(self, **kwargs):
+        """ Writer connected to the local server """
+        return InfluxDBWriter("127.0.0.1", "test", port=self.server.server_port, **kwargs)
+
+    def test_batch_size(self):
+        """ Writes are merged until batch_size points """
+        writer = self.writer(workers=1, batch_size=4, batch_age=60)
+        for i in range(8):
+            writer.write(b"m value=%d\n" % i, 1)
+        writer.close()
+        assert len(self.server.bodies) == 2
+        assert self.server.bodies[0] == b"".join(b"m value=%d\n" % i for i in range(4))
+        assert writer.points_written == 8
+
+    def test_batch_age(self):
+        """ Small batches are written after batch_age """
+        writer = self.writer(batch_size=1000, batch_age=0.05)
+        writer.write(b"m value=1\n", 1)
+        time.sleep(0.5)
+        assert self.server.bodies == [b"m value=1\n"]
+        writer.close()
+
+    def test_gzip(self):
+        """ Compressed bodies have the same points """
+        writer = self.writer(use_gzip=True)
+        writer.write(b"m value=1\n", 1)
+        writer.close()
+        assert self.server.bodies == [b"m value=1\n"]
+
+    def test_retry_server_errors(self):
+        """ 5xx are retried """
+        self.server.statuses = [500, 503]
+        writer = self.writer(retries=3, backoff=0.01)
+        writer.write(b"m value=1\n", 1)
+        writer.close()
+        assert self.server.bodies == [b"m value=1\n"]
+        assert writer.retried == 2
+        assert writer.points_failed == 0
+
+    def test_no_retry_client_errors(self):
+        """ 4xx are not retried """
+        self.server.statuses = [400]
+        writer = self.writer(retries=3, backoff=0.01)
+        writer.write(b"m value\n", 1)
+        writer.close()
+        assert self.server.bodies == []
+        assert writer.retried == 0
+        assert writer.points_failed == 1
+
+    def test_on_failure(self):
+        """ Batches that fail after all retries are handed back """
+        self.server.statuses = [503, 503]
+        failed = []
+        writer = self.writer(retries=1, backoff=0.01,
+                             on_failure=lambda data, points: failed.append((data, points)))
+        writer.write(b"m value=1\n", 1)
+        writer.flush()
+        writer.close()
+        assert failed == [(b"m value=1\n", 1)]
+        assert writer.healthy is False
+
+        writer = self.writer()
+        writer.write(b"m value=2\n", 1)
+        writer.close()
+        assert writer.healthy is True
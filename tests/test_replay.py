@@ -0,0 +1,210 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the replay of captured INT reports """
+
+import os
+import struct
+import tempfile
+import unittest
+import pyximport; pyximport.install()  # pylint: disable=C0321
+from libs.input.config_class import MyDefaultConfig  # pylint: disable=C0413
+from libs.replay import Capture, Replay  # pylint: disable=C0413
+from libs.replay.parser import DAMAGED, NOT_REPORT, TRUNCATED, VALID  # pylint: disable=C0413
+
+
+def report(seq, hops, vlan_id=100, damaged=False, remaining=None):
+    """ An INT report over UDP 5900 with hops [(sw_id, e_port_id, queue_id, occup, latency)].
+    remaining is the remaining hop count of the header, 10 minus the hops by default. """
+    metadata = b"".join(struct.pack("!IHHI", sw_id, 1, e_port_id, 0) +
+                        struct.pack("!I", queue_id << 24 | occup) +
+                        struct.pack("!II", 1000, 1000 + latency)
+                        for sw_id, e_port_id, queue_id, occup, latency in hops)
+    shim = struct.pack("!BBBB", 1, 0, 3 + 6 * len(hops), 0)
+    if remaining is None:
+        remaining = 10 - len(hops)
+    header = struct.pack("!BBBB", 0x10, 0, 6, remaining + (10 if damaged else 0))
+    header += struct.pack("!HH", 0xff00, 0)
+    inner_udp = struct.pack("!HHHH", 1000, 2000, 8 + len(shim + header + metadata), 0)
+    payload = inner_udp + shim + header + metadata
+    inner_ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0, 0, 64, 17, 0,
+                           b"\x0a\x00\x00\x01", b"\x0a\x00\x00\x02")
+    inner = b"\x00" * 12 + struct.pack("!HHH", 0x8100, vlan_id, 0x0800) + inner_ip + payload
+    telemetry = struct.pack("!BBHIII", 0x10, 0, 0, 1, seq, 0)
+    udp = struct.pack("!HHHH", 5900, 5900, 8 + len(telemetry + inner), 0)
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp + telemetry + inner), 0, 0, 64, 17,
+                     0, b"\x0a\x00\x01\x01", b"\x0a\x00\x01\x02")
+    return b"\x00" * 12 + struct.pack("!H", 0x0800) + ip + udp + telemetry + inner
+
+
+def write_pcap(path, packets):
+    """ Write [(ns, data)] to a pcap with nanosecond timestamps """
+    with open(path, "wb") as capture:
+        capture.write(struct.pack("<IHHiIII", 0xa1b23c4d, 2, 4, 0, 0, 65535, 1))
+        for timestamp, data in packets:
+            capture.write(struct.pack("<IIII", timestamp // 1000000000, timestamp % 1000000000,
+                                      len(data), len(data)))
+            capture.write(data)
+
+
+def write_pcapng(path, packets):
+    """ Write [(ns, data)] to a pcapng with the default microsecond resolution """
+    with open(path, "wb") as capture:
+        capture.write(struct.pack("<IIIHHqI", 0x0a0d0d0a, 28, 0x1a2b3c4d, 1, 0, -1, 28))
+        capture.write(struct.pack("<IIHHII", 1, 20, 1, 0, 65535, 20))
+        for timestamp, data in packets:
+            padded = data + b"\x00" * (-len(data) % 4)
+            length = 32 + len(padded)
+            timestamp //= 1000
+            capture.write(struct.pack("<IIIIIII", 6, length, 0, timestamp >> 32,
+                                      timestamp & 0xffffffff, len(data), len(data)))
+            capture.write(padded + struct.pack("<I", length))
+
+
+class Points(object):
+    """ Outputs keeping the lines, without the escapes of the measurements """
+
+    def __init__(self):
+        self.lines = []
+
+    def put(self, data, points):
+        self.lines += bytes(data).decode().replace("\\", "").splitlines()
+        assert len(self.lines) >= points
+
+
+class TestReplay(unittest.TestCase):
+    """ Test the user-space version of the XDP code """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "capture.pcap")
+        self.config = MyDefaultConfig("replay", {"counters_interval": "1"})
+        self.points = Points()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def replay(self, packets, writer=write_pcap):
+        writer(self.path, packets)
+        replay = Replay(self.config, self.points)
+        replay.replay(self.path)
+        return replay
+
+    def measurements(self):
+        return [line.split(",")[0] for line in self.points.lines]
+
+    def test_capture(self):
+        """ Packets and timestamps are read from pcap and pcapng """
+        packets = [(1500000000123, report(1, [(1, 2, 0, 10, 100)])), (1500000001000, b"x" * 9)]
+        for writer, first in ((write_pcap, 1500000000123), (write_pcapng, 1500000000000)):
+            writer(self.path, packets)
+            with Capture(self.path) as capture:
+                assert len(capture) == 2
+                assert list(capture.timestamps) == [first, 1500000001000]
+                assert list(capture.lengths) == [len(packets[0][1]), 9]
+                start = capture.offsets[0]
+                assert bytes(capture.data[start:start + capture.lengths[0]]) == packets[0][1]
+
+    def test_new_flow(self):
+        """ A new flow sends its path, hop latencies, and queue occupancies """
+        hops = [(1, 2, 0, 10, 100), (3, 4, 1, 20, 200)]
+        replay = self.replay([(5000000000, report(1, hops))])
+        assert replay.packets == 1 and replay.reports == 1
+        measurements = self.measurements()
+        assert measurements.count("flow_lat_path") == 1
+        assert measurements.count("latency") == 2
+        assert measurements.count("queue_occ") == 2
+        assert self.points.lines[0] == ('flow_lat_path,vlan_id=100,sw_id=1,port=2 '
+                                        'flow_latency=300,path="1-3-4.1,1-1-2.0" 5000000000')
+
+    def test_steady_flow(self):
+        """ Reports within the thresholds don't send events """
+        hops = [(1, 2, 0, 10, 100)]
+        replay = self.replay([(5000000000 + i * 1000, report(i, hops)) for i in range(5)])
+        assert replay.reports == 5
+        assert self.measurements().count("flow_lat_path") == 1
+        assert replay.flows.inserts == 1 and replay.queues.inserts == 1
+        assert "int_reports,type=0 value=5 6000000000" in self.points.lines
+
+    def test_threshold(self):
+        """ A hop latency change above hop_latency sends an event """
+        replay = self.replay([(5000000000, report(1, [(1, 2, 0, 10, 100)])),
+                              (5000001000, report(2, [(1, 2, 0, 10, 100 + 60000)]))])
+        assert replay.reports == 2
+        assert self.measurements().count("latency") == 2
+        assert self.measurements().count("queue_occ") == 1
+
+    def test_decrease(self):
+        """ Values going down within the thresholds don't send events """
+        replay = self.replay([(5000000000, report(1, [(1, 2, 0, 100, 1000)])),
+                              (5000001000, report(2, [(1, 2, 0, 90, 900)]))])
+        assert replay.reports == 2
+        assert self.measurements().count("latency") == 1
+        assert self.measurements().count("queue_occ") == 1
+
+    def test_large_occupancy(self):
+        """ Occupancies above 16 bits are compared on 16 bits, like tb_queue """
+        hops = [(1, 2, 0, 70000, 100)]
+        self.replay([(5000000000 + i * 1000, report(i, hops)) for i in range(5)])
+        queue_occ = [line for line in self.points.lines if line.startswith("queue_occ")]
+        assert queue_occ == ["queue_occ,sw=1,port=2,queue=0 value=70000 5000000000"]
+
+    def test_no_hops(self):
+        """ A report without hops sends its flow, but no hop latency or queue occupancy """
+        hops = [(1, 2, 0, 10, 100)] * 10
+        replay = self.replay([(5000000000, report(1, hops, remaining=10))])
+        assert replay.reports == 1
+        measurements = self.measurements()
+        assert measurements.count("flow_lat_path") == 1
+        assert measurements.count("latency") == 0
+        assert measurements.count("queue_occ") == 0
+        assert len(replay.queues) == 0
+
+    def test_counters(self):
+        """ Utilization counters are exported every counters_interval of capture time """
+        hops = [(1, 2, 0, 10, 100)]
+        self.replay([(5000000000, report(1, hops)), (5500000000, report(2, hops)),
+                     (6500000000, report(3, hops))])
+        assert self.measurements().count("tx_octs_int") == 2
+        received = [line for line in self.points.lines if line.startswith("int_reports,type=0")]
+        assert received == ["int_reports,type=0 value=2 6000000000",
+                            "int_reports,type=0 value=3 7000000000"]
+
+    def test_damaged_and_truncated(self):
+        """ Damaged reports are counted, truncated packets dropped, other packets passed """
+        good = report(1, [(1, 2, 0, 10, 100)])
+        packets = [good, report(2, [(1, 2, 0, 10, 100)], damaged=True), good[:60], b"\x00" * 60]
+        replay = self.replay([(5000000000 + i, data) for i, data in enumerate(packets)])
+        assert replay.packets == 4 and replay.reports == 1
+        assert "int_reports,type=3 value=1 6000000000" in self.points.lines
+
+    def test_status(self):
+        """ Outcome of each packet """
+        from libs.replay.parser import parse  # pylint: disable=C0415
+        good = report(1, [(1, 2, 0, 10, 100)])
+        packets = [good, report(2, [(1, 2, 0, 10, 100)], damaged=True), good[:60], b"\x00" * 60]
+        write_pcap(self.path, [(i, data) for i, data in enumerate(packets)])
+        with Capture(self.path) as capture:
+            status, seqs, reports = parse(capture.data, capture.offsets, capture.lengths,
+                                          capture.timestamps, 5900)
+        assert list(status) == [VALID, DAMAGED, TRUNCATED, NOT_REPORT]
+        assert list(seqs) == [1, 2, 1, -1]
+        assert reports["num_hops"][0] == 1 and reports["flow_latency"][0] == 100
+
+
+if __name__ == '__main__':
+    unittest.main()
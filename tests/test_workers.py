@@ -0,0 +1,71 @@
+#
+#  This file is part of the INT Collector distribution (https://github.com/amlight/int_collector).
+#  Copyright (c) [2018] [Nguyen Van Tu],
+#  Copyright (c) [2022] [AmLight SDN Team]
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+""" Test the handoff of batches from event workers through shared memory """
+
+import multiprocessing
+import queue
+import unittest
+from libs.xdp_code.workers import ShmChannel
+
+
+class TestShmChannel(unittest.TestCase):
+    """ Test the slots of shared memory between a worker and the collector process """
+
+    def setUp(self):
+        self.context = multiprocessing.get_context("fork")
+        self.channel = ShmChannel(self.context, slots=2, slot_size=64)
+
+    def tearDown(self):
+        self.channel.release()
+
+    def test_batch(self):
+        """ A batch is copied to a slot and back """
+        self.channel.put(b"a value=1 1\nb value=2 2\n", 2)
+        assert self.channel.get(timeout=1) == (b"a value=1 1\nb value=2 2\n", 2)
+        with self.assertRaises(queue.Empty):
+            self.channel.get(timeout=0.01)
+
+    def test_split_on_lines(self):
+        """ Batches larger than a slot are split on lines, slots are reused """
+        lines = [b"queue_occ\\,sw\\=%d value=%d 0\n" % (i, i) for i in range(10)]
+        data = b"".join(lines)
+
+        worker = self.context.Process(target=self.channel.put, args=(data, len(lines)))
+        worker.start()
+        received, points = b"", 0
+        while len(received) < len(data):
+            chunk, chunk_points = self.channel.get(timeout=5)
+            assert len(chunk) <= 64
+            assert chunk.endswith(b"\n")
+            assert chunk.count(b"\n") == chunk_points
+            received += chunk
+            points += chunk_points
+        worker.join()
+
+        assert received == data
+        assert points == len(lines)
+
+    def test_line_too_long(self):
+        """ A line is never split """
+        with self.assertRaises(ValueError):
+            self.channel.put(b"x" * 100 + b"\n", 1)
+
+    def test_close(self):
+        """ The collector process sees when a worker is done """
+        self.channel.close()
+        assert self.channel.get(timeout=1) is None